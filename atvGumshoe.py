@@ -7,266 +7,4474 @@
 #
 #       third-party library:
 #           paramiko >= 2.7
-#           scp >= 0.13
+#           pyfiglet
+#           tabulate
 #
 #        You should be able to install the third-party libraries via pip (or pip3
 #        depending on the setup):
 #
-#           pip3 install paramiko scp
+#           pip3 install -r requirements.txt
 #
+#   The third-party libraries are imported on first use, so the menu comes up
+#   without waiting for paramiko.
+#
+
+import time
+# Cold start is measured from here, before any other import
+STARTED = time.time()
+
+import os
+import os.path
+import json
+import datetime
+import re
+import sys
+import pathlib
+import stat
+import select
+import shlex
+import base64
+import plistlib
+import tarfile
+import io
+import codecs
+import hashlib
+import threading
+import queue
+import csv
+import sqlite3
+import bisect
+import functools
+import contextlib
+import socket
+import socketserver
+import struct
+import subprocess
+import glob
+import tempfile
+import weakref
+from array import array
+from argparse import ArgumentParser
+from datetime import datetime as dt
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from logging import basicConfig as logging_basicConfig, \
+    addLevelName as logging_addLevelName, \
+    getLogger as logging_getLogger, \
+    log as logging_log, \
+    DEBUG   as logging_level_DEBUG, \
+    INFO    as logging_level_INFO, \
+    WARN    as logging_level_WARN, \
+    ERROR   as logging_level_ERROR, \
+    debug   as debug, \
+    info    as info, \
+    warning as warning, \
+    error   as error
+from getpass import getpass
+
+STATUS = False
+
+#
+# Remote commands are run concurrently, one SSH channel per command, on the
+# transport of the connected SSHClient. A command that did not finish within
+# COMMAND_TIMEOUT seconds has its channel closed and is reported as failed.
+#
+COMMAND_CONCURRENCY = 4
+COMMAND_TIMEOUT = 60
+CHANNEL_CHUNK_SIZE = 32768
+
+FORENSIC_FILES = {
+    'wifi': '/private/var/mobile/Library/SyncedPreferences/com.apple.wifid.plist',
+    'id_cache': '/private/var/mobile/Library/Preferences/com.apple.identityservices.idstatuscache.plist',
+    'location': '/private/var/mobile/Library/SyncedPreferences/com.apple.cloudrecents.CloudRecentsAgent-com.apple.eventkit.locations.plist',
+    'app_ids' : '/private/var/mobile/Library/UserNotificationsServer/Library.plist',
+    'apple_app_info': '/Applications/APPNAME/Info.plist',
+    'other_app_info': '/private/var/containers/Bundle/Application/UUID/iTunesMetadata.plist',
+    'appstored': '/private/var/mobile/Library/Preferences/com.apple.appstored.plist',
+    'tvsettings': '/private/var/mobile/Library/Preferences/com.apple.TVSettings.plist',
+    'systemversion': '/System/Library/CoreServices/SystemVersion.plist'
+}
+
+#
+# The installed applications inventory dumps the metadata plist of every
+# application in a single remote command. Each plist is wrapped between two
+# marker lines so the combined output can be split back per application:
+#
+#   @@ATVGUMSHOE@@ BEGIN <kind> <directory name>
+#   <plutil -showjson output>
+#   @@ATVGUMSHOE@@ END <plutil exit status>
+#
+FRAME_MARKER = '@@ATVGUMSHOE@@'
+
+PLUTIL_JSON = 'plutil -showjson '
+OTCTL_STATUS = 'otctl status -j'
+
+APP_INVENTORY_ROOTS = {
+    'apple': FORENSIC_FILES['apple_app_info'].split('/APPNAME/'),
+    'other': FORENSIC_FILES['other_app_info'].split('/UUID/'),
+}
+
+APP_METADATA_FIELDS = {
+    'apple': ('CFBundleName', 'CFBundleVersion', 'CFBundleIdentifier'),
+    'other': ('itemName', 'bundleVersion', 'softwareVersionBundleId'),
+}
+
+#
+# Every remote source an extractor can read. The 'plist' and 'otctl' sources
+# are small and are fetched together with the app 'inventory' in one framed
+# command (frames of kind 'source'). The large synced preferences are 'values'
+# sources, whose values dictionary is streamed over its own channel.
+#
+Source = namedtuple('Source', ['kind', 'path'])
+
+SOURCES = OrderedDict([
+    ('otctl', Source('otctl', None)),
+    ('systemversion', Source('plist', FORENSIC_FILES['systemversion'])),
+    ('tvsettings', Source('plist', FORENSIC_FILES['tvsettings'])),
+    ('appstored', Source('plist', FORENSIC_FILES['appstored'])),
+    ('id_cache', Source('plist', FORENSIC_FILES['id_cache'])),
+    ('wifi', Source('values', FORENSIC_FILES['wifi'])),
+    ('location', Source('values', FORENSIC_FILES['location'])),
+    ('inventory', Source('inventory', None)),
+])
+
+#
+# The acquisition stage pulls the raw artifact plists from the device in one
+# tar stream and parses them locally, keeping the original bytes as evidence.
+#
+ACQUISITION_SOURCES = ('wifi', 'id_cache', 'location', 'app_ids',
+                       'appstored', 'tvsettings', 'systemversion')
+
+APP_METADATA_GLOBS = tuple(root.lstrip('/') + '/*/' + plist
+                           for root, plist in APP_INVENTORY_ROOTS.values())
+
+#
+# Acquisitions also save the output of otctl, as the Octagon state is not a
+# plain file. Offline analysis finds the remote tree of an evidence directory
+# or tarball by looking for these files.
+#
+OTCTL_EVIDENCE = 'otctl_status.json'
+EVIDENCE_MARKERS = tuple(FORENSIC_FILES[name] for name in ACQUISITION_SOURCES) + ('/' + OTCTL_EVIDENCE,)
+
+#
+# Logical imaging of a whole remote tree splits its files into shards of about
+# IMAGE_SHARD_BYTES, each streamed as its own tar over one of IMAGE_WORKERS
+# concurrent channels. Shard command lines stay under IMAGE_SHARD_ARG_BYTES.
+# Finished shards are checkpointed so an interrupted image resumes.
+#
+IMAGE_WORKERS = 4
+IMAGE_SHARD_BYTES = 64 * 1024 * 1024
+IMAGE_SHARD_ARG_BYTES = 64 * 1024
+IMAGE_SHARD_RETRIES = 2
+
+#
+# Every file received is written to the evidence directory and hashed in the
+# same pass. Files of HASH_PARALLEL_BYTES or more are hashed on a thread pool
+# so hashing overlaps the transfer. Each acquisition ends with a manifest of
+# the hashes, sealed with its own digest and optionally an SSH key signature.
+#
+HASH_ALGORITHMS = ('sha256',)
+HASH_WORKERS = 4
+HASH_PARALLEL_BYTES = 8 * 1024 * 1024
+HASH_QUEUE_CHUNKS = 64
+RECEIVE_CHUNK_SIZE = 1024 * 1024
+MANIFEST_NAME = 'manifest.json'
+
+#
+# Decoded artifacts are cached in memory and on disk, keyed by the device
+# host key, the remote path and the remote size, mtime, inode and ctime. The
+# output of otctl is keyed by the state files of the TrustedPeersHelper
+# daemon. The cache holds personal data, so only its owner can read it.
+#
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.atvgumshoe', 'cache')
+CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+#
+# Incremental re-acquisition keeps a snapshot of every device it has seen,
+# so the next pass only fetches and parses the artifacts that changed. The
+# snapshots hold personal data, so only their owner can read them.
+#
+SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), '.atvgumshoe', 'snapshots')
+
+#
+# The Octagon trust networks of every device acquired are merged into one
+# peer graph, to correlate the devices of a household across acquisitions.
+#
+PEER_GRAPH_PATH = os.path.join(os.path.expanduser('~'), '.atvgumshoe', 'peers.json')
+
+#
+# The Apple IDs and places of every device acquired are indexed in one SQLite
+# search store, readable only by its owner; concurrent writers wait up to
+# SEARCH_INDEX_TIMEOUT seconds.
+#
+SEARCH_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.atvgumshoe', 'search.db')
+SEARCH_INDEX_TIMEOUT = 60
+
+OTCTL_STATE_FILES = ('/private/var/protected/trustedpeershelper/TrustedPeersHelper.db',
+                     '/private/var/protected/trustedpeershelper/TrustedPeersHelper.db-wal')
+
+#
+# Headless and fleet acquisitions run the extractors below without prompts and
+# write one JSON result file per host.
+#
+DEFAULT_SSH_PORT = 44
+DEFAULT_USERNAME = 'root'
+DEFAULT_PASSWORD = 'alpine'
+FLEET_WORKERS = 8
+EXPORT_QUEUE_SIZE = 16
+EXPORT_BATCH_SIZE = 256
+TIMELINE_BATCH_SIZE = 10000
+
+#
+# The optional agent keeps authenticated SSH transports to every device warm
+# across invocations. CLI runs reach it over a Unix socket readable only by the
+# owner; it sends SSH keepalives and reconnects dropped devices on its own.
+#
+AGENT_SOCKET = os.path.join(os.path.expanduser('~'), '.atvgumshoe', 'agent.sock')
+AGENT_KEEPALIVE = 15
+AGENT_IDLE_TIMEOUT = 3600
+AGENT_RECONNECT_ATTEMPTS = 3
+AGENT_START_TIMEOUT = 10
+
+#
+# The interactive menu clears the screen with ANSI escapes and renders the
+# banner once; rendered banners are kept so that pyfiglet is not imported at
+# start. COLD_START_BUDGET is the time allowed from start to the first menu;
+# atvGumshoe_bench.py startup measures it with a warm banner cache.
+#
+ANSI_CLEAR = '\033[H\033[2J\033[3J'
+ANSI_CYAN = '\033[36m'
+ANSI_RESET = '\033[39m'
+BANNER_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.atvgumshoe', 'banners')
+COLD_START_BUDGET = 0.25
+
+PROFILE_COLUMNS = ('kind', 'name', 'count', 'total_seconds', 'mean_seconds', 'max_seconds',
+                   'open_seconds', 'wait_seconds', 'bytes')
+
+#
+# Column schemas of the rows yielded by every extractor. Exporters write the
+# columns in this order, so they must only ever be appended to.
+#
+SCHEMAS = OrderedDict([
+    ('device', ('serial_number', 'hw_model', 'os_version', 'os_build', 'device_id')),
+    ('peers', ('relation', 'peer_id', 'serial_number', 'model', 'os_version')),
+    ('wifi', ('ssid', 'added_by', 'os_version', 'added_at')),
+    ('ids', ('category', 'id')),
+    ('location', ('name', 'address', 'timestamp', 'source')),
+    ('apps', ('kind', 'name', 'version', 'bundle_id', 'error')),
+    ('timeline', ('time_utc', 'unix_time', 'device', 'source', 'description')),
+    ('vouchers', ('peer_id', 'serial_number', 'model', 'vouches_for', 'observed_utc', 'seen_by')),
+    ('reachable', ('peer_id', 'serial_number', 'model', 'hops')),
+    ('id_matches', ('id', 'category', 'device')),
+    ('place_matches', ('name', 'address', 'visits', 'devices', 'first_seen_utc', 'last_seen_utc', 'visits_by_source')),
+])
+
+LOGGING_LEVELS = {
+    'ERROR': {
+        'level': logging_level_ERROR,
+        'name': 'ERROR',
+        'xterm': '31m',
+        '256color': '38;5;196m',
+    },
+    'NORMAL': {
+        'level': 35,
+        'name': 'CAD',
+        'xterm': '37m',
+        '256color': '38;5;255m',
+    },
+    'WARNING': {
+        'level': logging_level_WARN,
+        'name': 'WARNING',
+        'xterm': '33m',
+        '256color': '38;5;227m',
+    },
+    'INFO': {
+        'level': logging_level_INFO,
+        'name': 'INFO',
+        'xterm': '36m',
+        '256color': '38;5;45m',
+    },
+    'DEBUG': {
+        'level': logging_level_DEBUG,
+        'name': 'DEBUG',
+        'xterm': '35m',
+        '256color': '38;5;135m',
+    },
+}
+
+#
+# We allow the log level to be specified on the command-line or in the
+# config by name (string/keyword), but we need to convert these to the
+# numeric value:
+#
+LOGGING_LEVELS_MAP = {
+    'NORMAL': LOGGING_LEVELS['NORMAL']['level'],
+    'ERROR': logging_level_ERROR,
+    'WARN': logging_level_WARN,
+    'INFO': logging_level_INFO,
+    'DEBUG': logging_level_DEBUG,
+    'normal': LOGGING_LEVELS['NORMAL']['level'],
+    'error': logging_level_ERROR,
+    'warn': logging_level_WARN,
+    'info': logging_level_INFO,
+    'debug': logging_level_DEBUG
+}
+
+
+def logg(msg):
+    """Wrapper function for calling logging.log with our 'NORMAL' level"""
+    logging_log(LOGGING_LEVELS['NORMAL']['level'], msg)
+
+
+def tabulate(rows, headers=()):
+    """tabulate.tabulate, imported on first use"""
+    from tabulate import tabulate as _tabulate
+    return _tabulate(rows, headers=headers)
+
+
+def render_table(rows, headers):
+    with PROFILER.stage('render', 'tabulate'):
+        return tabulate(rows, headers=headers)
+
+
+def clear_screen():
+    """Clear the terminal with ANSI escapes rather than by running clear"""
+    if sys.stdout.isatty():
+        sys.stdout.write(ANSI_CLEAR)
+        sys.stdout.flush()
+
+
+@functools.lru_cache(maxsize=None)
+def render_banner(text):
+    """Return the figlet rendering of text, from the banner cache when it was rendered before
+
+    pyfiglet is only imported to render a banner for the first time.
+    """
+    path = os.path.join(BANNER_CACHE_DIR, hashlib.sha256(text.encode('utf-8')).hexdigest()[:16] + '.txt')
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except (IOError, OSError):
+        pass
+    from pyfiglet import Figlet
+    banner = Figlet().renderText(text)
+    try:
+        os.makedirs(BANNER_CACHE_DIR, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write(banner)
+        os.replace(path + '.tmp', path)
+    except (IOError, OSError) as err:
+        debug("Caching the banner failed - {}".format(err))
+    return banner
+
+
+def welcome(text):
+    if sys.stdout.isatty():
+        return ANSI_CYAN + render_banner(text) + ANSI_RESET
+    return render_banner(text)
+
+
+@functools.lru_cache(maxsize=None)
+def render_menu(connected_to=None):
+    """Return the main menu text; connected_to is the (host, port) of the connected device"""
+    if connected_to:
+        connect = "\t1 : Connect (Already Connected to {}:{})".format(*connected_to)
+    else:
+        connect = "\t1 : Connect"
+    return '\n'.join([
+        "ATV Gumshoe is an Apple TV Logical Forensic Tool. (For Jailbroken Devices)\n",
+        "Please select an option ",
+        connect,
+        """\t2 : Device Info
+        3 : Keychain Trusted Peers
+        4 : User Wifi information
+        5 : User ID information
+        6 : User Location History
+        7 : Installed Applications
+        8 : Acquire Artifacts
+        9 : Artifact Cache
+        10 : Timeline
+        11 : Re-acquire Changes
+        12 : Peer Graph
+        13 : Search Index
+        0 : Exit"""])
+
+
+def report_cold_start(budget=COLD_START_BUDGET):
+    """Log the time from the start of the module to the first menu against the cold start budget"""
+    elapsed = time.time() - STARTED
+    PROFILER.add_stage('startup', 'cold start', elapsed)
+    if elapsed > budget:
+        warning("Cold start took {:.3f}s, over the budget of {:.3f}s".format(elapsed, budget))
+    else:
+        info("Cold start took {:.3f}s (budget {:.3f}s)".format(elapsed, budget))
+    return elapsed
+
+
+def ssh_login(agent_socket=None):
+    global STATUS
+    clear_screen()
+    print(welcome("ATV GUMSHOE"))
+    host = input("Enter the Apple TV IP Address: ") or "192.168.1.151"
+    port = int(input("Enter the Apple TV SSH Port [44]: ") or 44)
+    username = input("Enter the Apple TV username [root]: ") or "root"
+    password = getpass("Enter the Apple TV password [alpine]: ") or "alpine"
+
+    try:
+        r = connect_device(host, port, username, password, agent_socket=agent_socket)
+    except Exception as err:
+        logg("SSH connection to {} failed - {}".format(host, err))
+        input("Press any key to go to main menu.")
+        return None
+
+    STATUS = True
+
+    input("Press any key to go to main menu.")
+    return r
+
+
+class Profiler(object):
+    """Collect the timings of remote commands and local processing stages
+
+    Disabled by default; --profile enables it. Every remote command records
+    its channel open latency, its execution time, the bytes received and, for
+    streamed commands, the time spent waiting on the network. Local steps
+    (decode, parse, render, ...) are recorded with stage(). With --cprofile a
+    cProfile.Profile is also attached to every thread entering thread(), or
+    to the whole process from Python 3.12.
+    """
+
+    TOOLS = re.compile(r'\b(plutil|otctl|tar|stat|ls|find)\b')
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = False
+        self.records = []
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def command(self, cmd, open_seconds, exec_seconds, bytes_received, exit_status, wait_seconds=None):
+        debug("Command {} opened in {:.3f}s, ran in {:.3f}s, {} bytes received".format(
+            cmd, open_seconds, exec_seconds, bytes_received))
+        if self.enabled:
+            with self.lock:
+                self.records.append({
+                    'kind': 'command',
+                    'name': self.command_name(cmd),
+                    'label': cmd,
+                    'open_seconds': open_seconds,
+                    'seconds': exec_seconds,
+                    'wait_seconds': wait_seconds,
+                    'bytes': bytes_received,
+                    'exit_status': exit_status,
+                })
+
+    @classmethod
+    def command_name(cls, cmd):
+        """Name a command by the first device tool it runs, as the shell wrappers are not informative"""
+        match = cls.TOOLS.search(cmd)
+        return match.group(1) if match else cmd.split(' ', 1)[0]
+
+    def add_stage(self, name, label, seconds):
+        if self.enabled:
+            with self.lock:
+                self.records.append({'kind': 'stage', 'name': name, 'label': label, 'seconds': seconds})
+
+    @contextlib.contextmanager
+    def stage(self, name, label=''):
+        """Time the enclosed block as one local processing stage"""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, label, time.time() - started)
+
+    @contextlib.contextmanager
+    def thread(self):
+        """Capture the enclosed block of the current thread with cProfile when enabled
+
+        From Python 3.12 cProfile is built on sys.monitoring, which allows a
+        single active profiler that already sees every thread, so the first
+        block enables one process wide profile and the others only run. A
+        thread whose profile cannot be enabled is still timed by stage().
+        """
+        if not self.cprofile or getattr(self.local, 'profile', None):
+            yield
+            return
+        import cProfile
+        if sys.version_info >= (3, 12):
+            with self.lock:
+                if not self.profiles:
+                    profile = cProfile.Profile()
+                    if self._enable(profile):
+                        self.profiles.append(profile)
+                    else:
+                        self.cprofile = False
+            yield
+            return
+        profile = cProfile.Profile()
+        if not self._enable(profile):
+            yield
+            return
+        with self.lock:
+            self.profiles.append(profile)
+        self.local.profile = profile
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.local.profile = None
+
+    def _enable(self, profile):
+        try:
+            profile.enable()
+            return True
+        except ValueError as err:
+            # Another profiling tool is already active
+            warning("cProfile could not be enabled - {}".format(err))
+            return False
+
+    def summary(self):
+        """Aggregate the records into [kind, name, count, total, mean, max, open, wait, bytes] rows"""
+        groups = OrderedDict()
+        with self.lock:
+            records = list(self.records)
+        for record in records:
+            groups.setdefault((record['kind'], record['name']), []).append(record)
+        rows = []
+        for (kind, name), group in groups.items():
+            seconds = [record['seconds'] for record in group]
+            rows.append([kind, name, len(group), round(sum(seconds), 3),
+                         round(sum(seconds) / len(group), 3), round(max(seconds), 3),
+                         round(sum(record.get('open_seconds') or 0 for record in group), 3),
+                         round(sum(record.get('wait_seconds') or 0 for record in group), 3),
+                         sum(record.get('bytes') or 0 for record in group)])
+        return rows
+
+    def write(self, path):
+        """Write the summary and every record as JSON"""
+        report = {
+            'summary': [dict(zip(PROFILE_COLUMNS, row)) for row in self.summary()],
+            'records': self.records,
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    def dump_cprofile(self, path):
+        with self.lock:
+            profiles = list(self.profiles)
+        if profiles:
+            import pstats
+            pstats.Stats(*profiles).dump_stats(path)
+
+
+PROFILER = Profiler()
+
+
+class CountingReader(object):
+    """File object wrapper counting the bytes read and the time spent waiting for them"""
+
+    def __init__(self, fileobj, channel=None):
+        self.fileobj = fileobj
+        self.channel = channel
+        self.bytes = 0
+        self.wait = 0.0
+
+    def read(self, size=-1):
+        started = time.time()
+        data = self.fileobj.read(size)
+        self.wait += time.time() - started
+        self.bytes += len(data)
+        return data
+
+
+class CommandError(Exception):
+    pass
+
+
+class CommandResult(namedtuple('CommandResult', ['cmd', 'stdout', 'stderr', 'exit_status'])):
+
+    def check(self):
+        """Raise CommandError if the command exited with a non zero status"""
+        if self.exit_status != 0:
+            raise CommandError("The command {} exited with status {}: {}".format(
+                self.cmd, self.exit_status, self.stderr.decode('utf-8', 'replace').strip()))
+        return self
+
+
+class CommandExecutor(object):
+    """Run remote commands concurrently over the transport of one SSHClient"""
+
+    def __init__(self, ssh_client, max_workers=COMMAND_CONCURRENCY, timeout=COMMAND_TIMEOUT):
+        self.transport = ssh_client.get_transport()
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, cmd, timeout=None):
+        """Schedule a command and return a future resolving to its CommandResult"""
+        return self.pool.submit(self._exec, cmd, timeout or self.timeout)
+
+    def run(self, cmd, timeout=None):
+        return self.submit(cmd, timeout).result()
+
+    def open(self, cmd, timeout=None):
+        """Start a command and return its channel for streaming reads
+
+        The timeout applies to every read on the channel rather than to the
+        whole command, so long transfers are only aborted when they stall.
+        """
+        info("Trying to run the command: {}".format(cmd))
+        channel = self.transport.open_session(timeout=timeout or self.timeout)
+        channel.settimeout(timeout or self.timeout)
+        channel.exec_command(cmd)
+        return channel
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+    @contextlib.contextmanager
+    def stream(self, cmd, timeout=None):
+        """Run a command and yield a reader over its stdout; the command is profiled when the block exits
+
+        The channel of the command is available as the channel attribute of
+        the reader.
+        """
+        started = time.time()
+        channel = self.open(cmd, timeout)
+        opened = time.time() - started
+        reader = CountingReader(channel.makefile('rb'), channel)
+        try:
+            yield reader
+        finally:
+            exit_status = channel.exit_status if channel.exit_status_ready() else None
+            PROFILER.command(cmd, opened, time.time() - started - opened, reader.bytes, exit_status, reader.wait)
+            channel.close()
+
+    def _exec(self, cmd, timeout):
+        with PROFILER.thread():
+            return self._exec_profiled(cmd, timeout)
+
+    def _exec_profiled(self, cmd, timeout):
+        info("Trying to run the command: {}".format(cmd))
+        started = time.time()
+        deadline = started + timeout
+        channel = self.transport.open_session(timeout=timeout)
+        opened = time.time() - started
+        stdout = []
+        stderr = []
+        try:
+            channel.exec_command(cmd)
+            while True:
+                while channel.recv_ready():
+                    stdout.append(channel.recv(CHANNEL_CHUNK_SIZE))
+                while channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(CHANNEL_CHUNK_SIZE))
+                if (channel.eof_received or channel.closed) and channel.exit_status_ready() \
+                        and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    error("Running the command {} timed out.".format(cmd))
+                    raise CommandError("The command {} timed out after {} seconds".format(cmd, timeout))
+                select.select([channel], [], [], min(remaining, 1))
+            return CommandResult(cmd, b''.join(stdout), b''.join(stderr), channel.recv_exit_status())
+        finally:
+            channel.close()
+            PROFILER.command(cmd, opened, time.time() - started - opened, sum(len(chunk) for chunk in stdout),
+                             channel.exit_status if channel.exit_status_ready() else None)
+
+
+def build_inventory_cmd():
+    """Build one shell command dumping the metadata plist of every installed app"""
+    loops = []
+    for kind, (root, plist) in APP_INVENTORY_ROOTS.items():
+        loops.append(
+            'for d in {root}/*; do '
+            'echo "{marker} BEGIN {kind} ${{d##*/}}"; '
+            'plutil -showjson "$d/{plist}" 2>&1; rc=$?; echo; '
+            'echo "{marker} END $rc"; '
+            'done'.format(root=root, plist=plist, kind=kind, marker=FRAME_MARKER))
+    return '; '.join(loops)
+
+
+def source_cmd(name):
+    """Return the remote command printing a plist or otctl source of SOURCES"""
+    if SOURCES[name].kind == 'otctl':
+        return OTCTL_STATUS
+    return PLUTIL_JSON + shlex.quote(SOURCES[name].path)
+
+
+def build_batch_cmd(names):
+    """Build one shell command printing the named sources as frames of kind 'source'
+
+    The app inventory is appended when 'inventory' is among the names, so all
+    the small sources of a plan are read in a single round trip.
+    """
+    frames = []
+    for name in names:
+        if SOURCES[name].kind == 'inventory':
+            continue
+        frames.append(
+            'echo "{marker} BEGIN source {name}"; '
+            '{cmd} 2>&1; rc=$?; echo; '
+            'echo "{marker} END $rc"'.format(marker=FRAME_MARKER, name=name, cmd=source_cmd(name)))
+    if 'inventory' in names:
+        frames.append(build_inventory_cmd())
+    return '; '.join(frames)
+
+
+def split_frames(lines):
+    """Split a framed stream into (kind, name, exit status, body) tuples"""
+    begin = FRAME_MARKER + ' BEGIN '
+    end = FRAME_MARKER + ' END '
+    kind = name = None
+    body = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        if line.startswith(begin):
+            if kind is not None:
+                # Previous frame was cut short (e.g. the shell got killed)
+                yield kind, name, None, ''.join(body)
+            kind, name = line[len(begin):].rstrip('\r\n').split(' ', 1)
+            body = []
+        elif line.startswith(end) and kind is not None:
+            rc = line[len(end):].strip()
+            yield kind, name, int(rc) if rc.isdigit() else None, ''.join(body)
+            kind = name = None
+            body = []
+        elif kind is not None:
+            body.append(line)
+    if kind is not None:
+        yield kind, name, None, ''.join(body)
+
+
+CF_ABSOLUTE_EPOCH = datetime.datetime(2001, 1, 1)
+
+
+CF_ABSOLUTE_UNIX_OFFSET = 978307200.0
+
+
+def get_cfAbsoluteTime(seconds):
+    if not seconds:
+        return "Not Available"
+    utc_time = CF_ABSOLUTE_EPOCH + datetime.timedelta(seconds=seconds)
+    return utc_time.strftime('%b %d %Y %H:%M:%S')
+
+
+def cf_to_unix(cf_times):
+    """Convert a sequence of CFAbsoluteTime values to Unix times in one pass
+
+    Missing or non numeric values become NaN so the result keeps the
+    positions of the input.
+    """
+    offset = CF_ABSOLUTE_UNIX_OFFSET
+    nan = float('nan')
+    return array('d', [value + offset if isinstance(value, (int, float)) and value else nan
+                       for value in cf_times])
+
+
+class PlutilJSONDecoder(object):
+    """Incremental decoder for the JSON printed by plutil -showjson
+
+    plutil leaves trailing commas before closing brackets and prints nothing
+    for some values (``"key":,``). Both are accepted while tokenizing, so
+    string contents are never rewritten. The input is read in chunks from a
+    file object returning bytes or text, and at most FAST_PATH_LIMIT
+    characters of it are buffered at any time.
+    """
+
+    NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?|true|false|null')
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+    DELIMITER = re.compile(r'[ \t\n\r,\]}]')
+    MEMBER = re.compile(r'[ \t\n\r,]*"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*')
+    LITERALS = {'true': True, 'false': False, 'null': None}
+    JSON = json.JSONDecoder(strict=False)
+    FAST_PATH_LIMIT = 1024 * 1024
+
+    def __init__(self, fileobj, chunk_size=CHANNEL_CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.utf8 = codecs.getincrementaldecoder('utf-8')('replace')
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = ''
+        while not chunk:
+            if self.eof:
+                return False
+            chunk = self.fileobj.read(self.chunk_size)
+            self.eof = not chunk
+            if isinstance(chunk, bytes):
+                # A chunk may end inside a multi byte character
+                chunk = self.utf8.decode(chunk, final=self.eof)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            self.pos = self.WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("Expecting '{}' at offset {} of the plutil output".format(char, self.pos))
+        self.pos += 1
+
+    def _skip_commas(self):
+        while self._peek() == ',':
+            self.pos += 1
+
+    def _string(self):
+        while True:
+            try:
+                value, end = json.decoder.scanstring(self.buf, self.pos + 1, False)
+                break
+            except ValueError:
+                if not self._fill():
+                    raise
+        self.pos = end
+        return value
+
+    def _number(self):
+        while True:
+            end = self.DELIMITER.search(self.buf, self.pos)
+            if end or not self._fill():
+                break
+        token = self.buf[self.pos:end.start() if end else len(self.buf)]
+        if not self.NUMBER.match(token) or self.NUMBER.match(token).end() != len(token):
+            raise ValueError("Unexpected data {!r} at offset {} of the plutil output".format(token[:20], self.pos))
+        self.pos += len(token)
+        if token in self.LITERALS:
+            return self.LITERALS[token]
+        if '.' in token or 'e' in token or 'E' in token:
+            return float(token)
+        return int(token)
+
+    def _object_keys(self):
+        # Yields each key once its ':' has been consumed; the caller then
+        # decodes (or streams) the value before asking for the next key.
+        self._expect('{')
+        while True:
+            # Fast path for a complete '"key":' already in the buffer
+            match = self.MEMBER.match(self.buf, self.pos)
+            if match and match.end() < len(self.buf):
+                self.pos = match.end()
+                key = match.group(1)
+                yield json.decoder.scanstring(key + '"', 0, False)[0] if '\\' in key else key
+                continue
+            self._skip_commas()
+            if self._peek() == '}':
+                self.pos += 1
+                return
+            if self._peek() != '"':
+                raise ValueError("Expecting a key at offset {} of the plutil output".format(self.pos))
+            key = self._string()
+            self._expect(':')
+            yield key
+
+    def _array(self):
+        self._expect('[')
+        items = []
+        while True:
+            self._skip_commas()
+            if self._peek() == ']':
+                self.pos += 1
+                return items
+            items.append(self.value())
+
+    def _fast_value(self):
+        # Well formed containers that fit in FAST_PATH_LIMIT characters are
+        # handed to the C decoder; anything else (a plutil quirk, or a value
+        # too large to buffer) is tokenized here, container by container.
+        while True:
+            try:
+                value, self.pos = self.JSON.raw_decode(self.buf, self.pos)
+                return value, True
+            except ValueError as err:
+                truncated = getattr(err, 'pos', 0) >= len(self.buf) - 1 \
+                    or str(err).startswith('Unterminated string')
+                if not truncated or len(self.buf) - self.pos > self.FAST_PATH_LIMIT or not self._fill():
+                    return None, False
+
+    def value(self):
+        """Decode the next value"""
+        char = self._peek()
+        if char in ('{', '['):
+            value, decoded = self._fast_value()
+            if decoded:
+                return value
+        if char == '{':
+            return dict((key, self.value()) for key in self._object_keys())
+        if char == '[':
+            return self._array()
+        if char == '"':
+            return self._string()
+        if char in (',', '}', ']'):
+            # plutil printed nothing for this value
+            return ""
+        return self._number()
+
+    def load(self):
+        """Decode the whole document"""
+        return self.value()
+
+    def iter_values(self, key='values'):
+        """Yield (key, record) for each entry of a top level dictionary without keeping the others"""
+        for name in self._object_keys():
+            if name == key and self._peek() == '{':
+                for record_key in self._object_keys():
+                    yield record_key, self.value()
+            else:
+                self.value()
+
+
+def loads_plutil_json(data):
+    """Decode plutil -showjson output already held in memory"""
+    if isinstance(data, bytes):
+        return PlutilJSONDecoder(io.BytesIO(data)).load()
+    return PlutilJSONDecoder(io.StringIO(data)).load()
+
+
+def stream_plutil_values(executor, path, key='values'):
+    """Run plutil on a remote plist and yield the entries of its values dictionary as they arrive"""
+    with executor.stream(PLUTIL_JSON + shlex.quote(path)) as reader:
+        started = time.time()
+        try:
+            for item in PlutilJSONDecoder(reader).iter_values(key):
+                yield item
+        finally:
+            # Time spent in the consumer of the records is counted as well
+            PROFILER.add_stage('decode', PLUTIL_JSON + path, time.time() - started - reader.wait)
+        exit_status = reader.channel.recv_exit_status()
+        if exit_status != 0:
+            raise CommandError("The command {}{} exited with status {}".format(PLUTIL_JSON, path, exit_status))
+
+
+def build_tar_cmd(paths, globs=()):
+    """Build the remote command streaming the given absolute paths as a tar archive"""
+    members = [shlex.quote(path.lstrip('/')) for path in paths] + list(globs)
+    return 'cd / && tar -cf - ' + ' '.join(members)
+
+
+class StreamHasher(object):
+    """Hash one byte stream, inline or on a pool thread so that hashing overlaps the transfer
+
+    Chunks handed to a pool thread must not be modified afterwards.
+    """
+
+    def __init__(self, algorithms=HASH_ALGORITHMS, pool=None):
+        self.hashes = [hashlib.new(name) for name in algorithms]
+        self.size = 0
+        self.queue = None
+        self.future = None
+        if pool is not None:
+            self.queue = queue.Queue(HASH_QUEUE_CHUNKS)
+            self.future = pool.submit(self._drain)
+
+    def update(self, chunk):
+        self.size += len(chunk)
+        if self.queue is None:
+            for h in self.hashes:
+                h.update(chunk)
+        else:
+            self.queue.put(chunk)
+
+    def _drain(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            for h in self.hashes:
+                h.update(chunk)
+
+    def hexdigests(self):
+        """Wait for the pending chunks and return {algorithm: hex digest}"""
+        if self.queue is not None:
+            self.queue.put(None)
+            self.future.result()
+            self.queue = None
+        return OrderedDict((h.name, h.hexdigest()) for h in self.hashes)
+
+
+def _canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def load_sign_key(key_filename):
+    """Load the SSH private key used to sign manifests, asking for its passphrase if needed"""
+    from paramiko import RSAKey as SSH_RSAKey, \
+        ECDSAKey as SSH_ECDSAKey, \
+        Ed25519Key as SSH_Ed25519Key
+    from paramiko.ssh_exception import \
+        PasswordRequiredException as SSH_PasswordRequiredException, \
+        SSHException as SSH_SSHException
+    last_error = None
+    for key_class in (SSH_Ed25519Key, SSH_ECDSAKey, SSH_RSAKey):
+        try:
+            try:
+                return key_class.from_private_key_file(key_filename)
+            except SSH_PasswordRequiredException:
+                return key_class.from_private_key_file(
+                    key_filename, password=getpass("Passphrase of {}: ".format(key_filename)))
+        except SSH_PasswordRequiredException:
+            raise
+        except SSH_SSHException as err:
+            last_error = err
+    raise SSH_SSHException("Cannot load the signing key {} - {}".format(key_filename, last_error))
+
+
+def _public_key(key_type, data):
+    """Rebuild the public key of a manifest signature"""
+    from paramiko import RSAKey as SSH_RSAKey, \
+        ECDSAKey as SSH_ECDSAKey, \
+        Ed25519Key as SSH_Ed25519Key
+    if key_type == 'ssh-ed25519':
+        return SSH_Ed25519Key(data=data)
+    if key_type.startswith('ecdsa-sha2-'):
+        return SSH_ECDSAKey(data=data)
+    return SSH_RSAKey(data=data)
+
+
+def key_fingerprint(key):
+    """Return the OpenSSH SHA256 fingerprint of a key"""
+    return 'SHA256:' + base64.b64encode(hashlib.sha256(key.asbytes()).digest()).decode('ascii').rstrip('=')
+
+
+def load_signer(signer):
+    """Return the fingerprint of the expected signer, an OpenSSH public key file or a SHA256: fingerprint"""
+    if signer.startswith('SHA256:'):
+        return signer
+    with open(signer, 'r') as f:
+        fields = f.read().split()
+    return key_fingerprint(_public_key(fields[0], base64.b64decode(fields[1])))
+
+
+class CustodyManifest(object):
+    """Chain of custody record of one acquisition
+
+    Collects the size and hashes of every file written to the evidence
+    directory; seal() writes them with the acquisition details, the digest
+    of the whole manifest and, given an SSH private key, its signature.
+    """
+
+    def __init__(self, algorithms=HASH_ALGORITHMS, workers=HASH_WORKERS):
+        self.algorithms = tuple(algorithms)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.started = time.time()
+        self.files = []
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def hasher(self, size):
+        return StreamHasher(self.algorithms, self.pool if size >= HASH_PARALLEL_BYTES else None)
+
+    def command(self, cmd):
+        with self.lock:
+            self.commands.append(cmd)
+
+    def entry(self, remote_path, local_path, hasher, evidence_dir=None):
+        """Build the manifest entry of a received file once its hashes are final"""
+        entry = OrderedDict([
+            ('remote_path', remote_path),
+            ('local_path', os.path.relpath(local_path, evidence_dir) if local_path and evidence_dir else local_path),
+            ('size', hasher.size),
+        ])
+        entry.update(hasher.hexdigests())
+        return entry
+
+    def extend(self, entries):
+        with self.lock:
+            self.files.extend(entries)
+
+    def add(self, remote_path, local_path, hasher, evidence_dir=None):
+        entry = self.entry(remote_path, local_path, hasher, evidence_dir)
+        self.extend([entry])
+        return entry
+
+    def seal(self, evidence_dir, device=None, peer=None, examiner=None, sign_key=None):
+        """Write the manifest into the evidence directory and return its path"""
+        self.pool.shutdown(wait=True)
+        manifest = OrderedDict([
+            ('tool', 'atvGumshoe'),
+            ('device', device),
+            ('peer', peer),
+            ('examiner', examiner),
+            ('started', dt.utcfromtimestamp(self.started).isoformat() + 'Z'),
+            ('sealed', dt.utcnow().isoformat() + 'Z'),
+            ('algorithms', list(self.algorithms)),
+            ('commands', self.commands),
+            ('files', sorted(self.files, key=lambda entry: entry['remote_path'])),
+        ])
+        body = _canonical_json(manifest)
+        manifest['manifest_sha256'] = hashlib.sha256(body).hexdigest()
+        if sign_key is not None:
+            key = load_sign_key(sign_key) if isinstance(sign_key, str) else sign_key
+            sig = key.sign_ssh_data(body, 'rsa-sha2-256') if key.get_name() == 'ssh-rsa' \
+                else key.sign_ssh_data(body)
+            manifest['signature'] = OrderedDict([
+                ('key_type', key.get_name()),
+                ('public_key', key.get_base64()),
+                ('fingerprint', key_fingerprint(key)),
+                ('signature', base64.b64encode(sig.asbytes()).decode('ascii')),
+            ])
+        path = os.path.join(evidence_dir, MANIFEST_NAME)
+        os.makedirs(evidence_dir, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        logg("Manifest of {} files sealed in {}".format(len(self.files), path))
+        return path
+
+
+def verify_manifest(path, signer=None):
+    """Check a sealed manifest against the evidence files next to it; return the list of problems
+
+    The digest of the manifest only shows it was not damaged: anyone editing
+    the evidence can rebuild it. The signature shows who sealed it only when
+    checked against the expected signer, a public key file or fingerprint,
+    as the key stored in the manifest can be replaced along with it.
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f, object_pairs_hook=OrderedDict)
+    problems = []
+    signature = manifest.pop('signature', None)
+    digest = manifest.pop('manifest_sha256', None)
+    body = _canonical_json(manifest)
+    if hashlib.sha256(body).hexdigest() != digest:
+        problems.append("The manifest digest does not match, the manifest was damaged or modified")
+    expected = None
+    if signer is not None:
+        try:
+            expected = load_signer(signer)
+        except Exception as err:
+            problems.append("Reading the expected signer {} failed - {}".format(signer, err))
+    if signature:
+        from paramiko import Message as SSH_Message
+        key = _public_key(signature['key_type'], base64.b64decode(signature['public_key']))
+        fingerprint = key_fingerprint(key)
+        if not key.verify_ssh_sig(body, SSH_Message(base64.b64decode(signature['signature']))):
+            problems.append("The signature of {} does not verify".format(fingerprint))
+        elif signer is None:
+            logg("The manifest is signed by {}".format(fingerprint))
+            warning("The signing key was not checked against an expected signer, "
+                 "anyone can sign a rebuilt manifest with their own key")
+        elif expected is not None and fingerprint != expected:
+            problems.append("The manifest is signed by {}, not by the expected {}".format(fingerprint, expected))
+        elif expected is not None:
+            logg("The manifest is signed by the expected {}".format(fingerprint))
+    elif signer is not None:
+        problems.append("The manifest is not signed")
+    evidence_dir = os.path.dirname(os.path.abspath(path))
+    for entry in manifest['files']:
+        hasher = StreamHasher(manifest['algorithms'])
+        try:
+            with open(os.path.join(evidence_dir, entry['local_path']), 'rb') as f:
+                for chunk in iter(functools.partial(f.read, RECEIVE_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+        except (IOError, OSError) as err:
+            problems.append("{} - {}".format(entry['local_path'], err))
+            continue
+        digests = hasher.hexdigests()
+        if hasher.size != entry['size'] or any(digests[name] != entry[name] for name in digests):
+            problems.append("{} does not match its recorded hash".format(entry['local_path']))
+    return problems
+
+
+def receive_file(fileobj, size, local_path=None, hasher=None, keep=True):
+    """Read size bytes from fileobj once, writing and hashing every chunk as it arrives
+
+    With keep the bytes are read straight into one buffer, which is
+    returned for parsing; without it they are only written and hashed.
+    """
+    out = open(local_path, 'wb') if local_path else None
+    data = bytearray(size) if keep else None
+    view = memoryview(data) if keep else None
+    received = 0
+    chunk = None
+    try:
+        while received < size:
+            try:
+                if keep:
+                    n = fileobj.readinto(view[received:received + RECEIVE_CHUNK_SIZE])
+                    chunk = view[received:received + n]
+                else:
+                    chunk = fileobj.read(min(RECEIVE_CHUNK_SIZE, size - received))
+                    n = len(chunk)
+            except tarfile.ReadError:
+                # A tar stream ended inside this file
+                n = 0
+            if not n:
+                break
+            if out:
+                out.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+            received += n
+    finally:
+        if out:
+            out.close()
+    if received < size:
+        warning("{} was cut short at {} of {} bytes".format(local_path or 'A file', received, size))
+        # Release every view of the buffer, including the chunks queued to
+        # the hasher, before shrinking it
+        chunk = None
+        if hasher:
+            hasher.hexdigests()
+        if keep:
+            view.release()
+            del data[received:]
+    return data
+
+
+def read_tar_stream(fileobj, evidence_dir=None, custody=None, keep=True):
+    """Yield (remote path, raw bytes) for every regular file of a tar stream
+
+    When an evidence directory is given each file is also written below it
+    at its remote path, and with a CustodyManifest it is hashed in the same
+    pass. Without keep only None is yielded in place of the bytes.
+    """
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                name = os.path.normpath(member.name).lstrip('/')
+                if name.startswith('..'):
+                    warning("Skipping tar member outside the root: {}".format(member.name))
+                    continue
+                local_path = None
+                if evidence_dir:
+                    local_path = os.path.join(evidence_dir, name)
+                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                hasher = custody.hasher(member.size) if custody else None
+                data = receive_file(tar.extractfile(member), member.size, local_path, hasher, keep)
+                if custody:
+                    custody.add('/' + name, local_path, hasher, evidence_dir)
+                yield '/' + name, data
+    except tarfile.ReadError as err:
+        # The stream ended early (e.g. the link dropped); the files received so far are kept
+        warning("The tar stream ended early - {}".format(err))
+
+
+def acquire_artifacts(executor, evidence_dir=None, include_apps=False, custody=None):
+    """Pull the forensic artifacts in one tar stream
+
+    Returns the raw bytes keyed by remote path and the list of requested
+    paths that were not received.
+    """
+    paths = [FORENSIC_FILES[name] for name in ACQUISITION_SOURCES]
+    globs = APP_METADATA_GLOBS if include_apps else ()
+    cmd = build_tar_cmd(paths, globs)
+    if custody:
+        custody.command(cmd)
+    otctl = executor.submit(OTCTL_STATUS) if evidence_dir else None
+    with executor.stream(cmd) as reader:
+        artifacts = dict(read_tar_stream(reader, evidence_dir, custody))
+        for line in reader.channel.makefile_stderr('rb').read().decode('utf-8', 'replace').splitlines():
+            warning("tar: {}".format(line))
+    missing = [path for path in paths if path not in artifacts]
+    if otctl:
+        # Saved for offline analysis of the trusted peers
+        try:
+            _save_command_output(otctl.result().check(), evidence_dir, OTCTL_EVIDENCE, custody)
+        except Exception as err:
+            warning("Saving the output of {} failed - {}".format(OTCTL_STATUS, err))
+    return artifacts, missing
+
+
+def _save_command_output(result, evidence_dir, name, custody=None):
+    """Write the stdout of a command into the evidence directory, hashing it into the manifest"""
+    local_path = os.path.join(evidence_dir, name)
+    os.makedirs(evidence_dir, exist_ok=True)
+    hasher = custody.hasher(len(result.stdout)) if custody else None
+    receive_file(io.BytesIO(result.stdout), len(result.stdout), local_path, hasher, keep=False)
+    if custody:
+        custody.command(result.cmd)
+        custody.add(result.cmd, local_path, hasher, evidence_dir)
+
+
+def _plist_to_json(value):
+    # Mirror what plutil -showjson produces so the parse_* functions see the
+    # same structures whichever way the plist was read.
+    if isinstance(value, dict):
+        return dict((str(k), _plist_to_json(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_plist_to_json(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return (value - CF_ABSOLUTE_EPOCH).total_seconds()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    if hasattr(plistlib, 'UID') and isinstance(value, plistlib.UID):
+        return value.data
+    return value
+
+
+def parse_plist(data):
+    """Decode the raw bytes of a binary or XML plist"""
+    return _plist_to_json(plistlib.loads(data))
+
+
+def parse_artifacts(artifacts):
+    """Parse the acquired artifacts, returning the decoded plist or the error per remote path"""
+    parsed = {}
+    for path, data in artifacts.items():
+        try:
+            with PROFILER.stage('decode', path):
+                parsed[path] = parse_plist(data)
+        except Exception as err:
+            parsed[path] = err
+    return parsed
+
+
+def load_plutil_json(result):
+    """Decode the output of a plutil -showjson command"""
+    with PROFILER.stage('decode', result.cmd):
+        return loads_plutil_json(result.check().stdout)
+
+
+def load_otctl_json(result):
+    """Decode the output of otctl status -j"""
+    with PROFILER.stage('decode', result.cmd):
+        return json.loads(result.check().stdout.decode("utf-8"))
+
+
+def _raise_if_error(source):
+    if isinstance(source, Exception):
+        raise source
+    return source
+
+
+def device_id(executor):
+    """Return a stable identity of the connected device from its SSH host key"""
+    return hashlib.sha256(executor.transport.get_remote_server_key().asbytes()).hexdigest()
+
+
+def device_label(executor, otctl):
+    """Return the serial number of the device, or the identity of its host key when otctl could not be read
+
+    The merged timeline, the peer graph and the search index label the device
+    this way whether it is read from the menu, headless or from saved evidence.
+    """
+    try:
+        return _raise_if_error(otctl)['contextDump']['self']['stableInfo']['serial_number']
+    except Exception:
+        return device_id(executor)
+
+
+def remote_stat(executor, paths, globs=(), identity=False):
+    """Return {path: (size, mtime)} for the existing remote paths, and the matches of globs, using one command
+
+    With identity the inode and ctime are appended, so that a file replaced
+    within the same second as its last stat is still seen as changed.
+    """
+    quoted = ' '.join([shlex.quote(path) for path in paths] + list(globs))
+    gnu, bsd = ('%s %Y %i %Z', '%z %m %i %c') if identity else ('%s %Y', '%z %m')
+    cmd = ('if stat -c %s / >/dev/null 2>&1; '
+           'then stat -c \'{1} %n\' {0}; '
+           'else stat -f \'{2} %N\' {0}; fi 2>/dev/null').format(quoted, gnu, bsd)
+    count = 4 if identity else 2
+    stats = {}
+    for line in executor.run(cmd).stdout.decode('utf-8', 'replace').splitlines():
+        fields = line.split(' ', count)
+        if len(fields) == count + 1 and all(field.isdigit() for field in fields[:count]):
+            stats[fields[count]] = tuple(int(field) for field in fields[:count])
+    return stats
+
+
+def makedirs_private(directory):
+    """Create a directory, and its missing parents, readable only by its owner"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # A directory left by an earlier version may be readable by others
+    os.chmod(directory, 0o700)
+
+
+def open_private(path, mode='w'):
+    """Open a file for writing, or appending with an 'a' mode, readable only by its owner"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if mode.startswith('a') else os.O_TRUNC), 0o600)
+    # An existing file may be readable by others
+    os.fchmod(fd, 0o600)
+    return os.fdopen(fd, mode)
+
+
+class ArtifactCache(object):
+    """LRU cache of decoded artifacts, held in memory and mirrored on disk
+
+    The records of 'values' sources are only cached on disk, one per line,
+    so that they can be streamed back at constant memory. The directory and
+    its files are created readable by their owner only.
+    """
+
+    SUFFIXES = ('.json', '.ndjson')
+
+    def __init__(self, directory=CACHE_DIR, memory_bytes=CACHE_MEMORY_BYTES,
+                 disk_bytes=CACHE_DISK_BYTES, enabled=True):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.enabled = enabled
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def key(device, path, stats):
+        """Build the cache key of a source from its remote (size, mtime, inode, ctime) stats"""
+        return hashlib.sha256(json.dumps([device, path, stats]).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached value, or raise KeyError"""
+        with self.lock:
+            return self._get(key)
+
+    def put(self, key, value):
+        data = json.dumps(value).encode('utf-8')
+        with self.lock:
+            self._put(key, value, data)
+
+    def _get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key][1]
+        disk_path = os.path.join(self.directory, key + '.json')
+        try:
+            with open(disk_path, 'rb') as f:
+                data = f.read()
+            os.utime(disk_path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            raise KeyError(key)
+        self.hits += 1
+        value = json.loads(data.decode('utf-8'))
+        self._remember(key, value, len(data))
+        return value
+
+    def _put(self, key, value, data):
+        self._remember(key, value, len(data))
+        path = os.path.join(self.directory, key + '.json')
+        try:
+            makedirs_private(self.directory)
+            with open_private(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            self._evict_disk()
+        except (IOError, OSError) as err:
+            warning("Writing the artifact cache failed - {}".format(err))
+
+    def has_records(self, key):
+        """Return whether a values source is cached under key"""
+        return os.path.exists(os.path.join(self.directory, key + '.ndjson'))
+
+    def records(self, key):
+        """Return an iterator over the (key, record) pairs cached for a values source, or raise KeyError"""
+        path = os.path.join(self.directory, key + '.ndjson')
+        try:
+            f = open(path, 'r', encoding='utf-8')
+            os.utime(path, None)
+        except (IOError, OSError):
+            with self.lock:
+                self.misses += 1
+            raise KeyError(key)
+        with self.lock:
+            self.hits += 1
+        return self._read_records(f)
+
+    @staticmethod
+    def _read_records(f):
+        with f:
+            for line in f:
+                record_key, record = json.loads(line)
+                yield record_key, record
+
+    def spool_records(self, key, records):
+        """Yield the (key, record) pairs of a values source while writing them to the cache
+
+        The records are written one per line, so they are never all held in
+        memory; the cache entry only appears once every record was read.
+        """
+        path = os.path.join(self.directory, key + '.ndjson')
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        f = None
+        try:
+            makedirs_private(self.directory)
+            f = open_private(tmp, 'w')
+        except (IOError, OSError) as err:
+            warning("Writing the artifact cache failed - {}".format(err))
+        complete = False
+        try:
+            for item in records:
+                if f is not None:
+                    try:
+                        f.write(json.dumps(item) + '\n')
+                    except (IOError, OSError) as err:
+                        warning("Writing the artifact cache failed - {}".format(err))
+                        f.close()
+                        f = None
+                yield item
+            complete = True
+        finally:
+            if f is not None:
+                f.close()
+                try:
+                    if complete:
+                        os.replace(tmp, path)
+                        with self.lock:
+                            self._evict_disk()
+                    else:
+                        os.remove(tmp)
+                except (IOError, OSError) as err:
+                    warning("Writing the artifact cache failed - {}".format(err))
+
+    def clear(self):
+        """Forget every cached artifact, in memory and on disk; return the number of files removed"""
+        removed = 0
+        with self.lock:
+            self.memory.clear()
+            self.memory_used = 0
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.endswith(self.SUFFIXES + ('.tmp',)):
+                        os.remove(os.path.join(self.directory, name))
+                        removed += 1
+        return removed
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'memory_entries': len(self.memory),
+            'memory_bytes': self.memory_used,
+        }
+
+    def _remember(self, key, value, size):
+        if key in self.memory:
+            self.memory_used -= self.memory.pop(key)[0]
+        self.memory[key] = (size, value)
+        self.memory_used += size
+        while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+            self.memory_used -= self.memory.popitem(last=False)[1][0]
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIXES):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        used = sum(entry[1] for entry in entries)
+        for mtime, size, name in sorted(entries):
+            if used <= self.disk_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            used -= size
+
+
+def _source_paths(name):
+    if SOURCES[name].kind == 'otctl':
+        return OTCTL_STATE_FILES
+    return (SOURCES[name].path,)
+
+
+def plan_sources(names, extractors=None):
+    """Return {source: number of the named extractors reading it}, in order of first use"""
+    consumers = OrderedDict()
+    for name in names:
+        for source in (extractors or EXTRACTORS)[name].sources:
+            consumers[source] = consumers.get(source, 0) + 1
+    return consumers
+
+
+class RecordStream(object):
+    """The (key, record) pairs of the values dictionary of a remote plist, read when iterated
+
+    The records are never held in memory: plutil is streamed over a channel
+    of its own. With an artifact cache key, a read that got through the whole
+    dictionary leaves it in the cache, and the reads after that read the
+    cached file instead of the device.
+    """
+
+    def __init__(self, executor, path, cache=None, key=None):
+        self.executor = executor
+        self.path = path
+        self.cache = cache
+        self.key = key
+
+    def __iter__(self):
+        if self.key is None:
+            return stream_plutil_values(self.executor, self.path)
+        try:
+            return self.cache.records(self.key)
+        except KeyError:
+            return self.cache.spool_records(self.key, stream_plutil_values(self.executor, self.path))
+
+    def cached(self):
+        return self.key is not None and self.cache.has_records(self.key)
+
+
+class RecordSpool(object):
+    """The (key, record) pairs of a values source, read once into a private temporary file
+
+    Every iteration reads the file from the start, so that all the readers of
+    a source share one transfer. The file is removed with the spool.
+    """
+
+    def __init__(self, records):
+        fd, self.path = tempfile.mkstemp(prefix='atvgumshoe_', suffix='.ndjson')
+        self._remove = weakref.finalize(self, os.remove, self.path)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for item in records:
+                    f.write(json.dumps(item) + '\n')
+        except BaseException:
+            self._remove()
+            raise
+
+    def __iter__(self):
+        return ArtifactCache._read_records(open(self.path, 'r', encoding='utf-8'))
+
+
+def fetch_sources(executor, consumers, cache=None):
+    """Return {name: decoded source or exception} for the named sources of SOURCES
+
+    consumers is a list of source names or the {source: readers} plan of
+    plan_sources. With an enabled cache the remote stats of all sources are
+    read in one command and unchanged sources are served from the cache. The
+    other small sources are fetched together in one command. A 'values'
+    source with one reader is left as a RecordStream, streamed by that
+    reader or read from the cache; one with several readers is transferred
+    once into a RecordSpool that they all read.
+    """
+    if not isinstance(consumers, dict):
+        consumers = OrderedDict((name, 1) for name in consumers)
+    sources = {}
+    keys = {}
+    if cache is not None and cache.enabled:
+        cached = [name for name in consumers if SOURCES[name].kind != 'inventory']
+        try:
+            device = device_id(executor)
+            stats = remote_stat(executor, [path for name in cached for path in _source_paths(name)], identity=True)
+        except Exception as err:
+            warning("Checking the artifact cache failed - {}".format(err))
+            stats = {}
+        for name in cached:
+            source_stats = [stats.get(path) for path in _source_paths(name)]
+            if source_stats[0] is None:
+                # Nothing to key on, always read it from the device
+                continue
+            keys[name] = cache.key(device, name, source_stats)
+            if SOURCES[name].kind == 'values':
+                continue
+            try:
+                sources[name] = cache.get(keys[name])
+            except KeyError:
+                pass
+
+    batch = [name for name in consumers if name not in sources and SOURCES[name].kind != 'values']
+    if batch:
+        sources.update(_fetch_batch(executor, batch))
+        for name in batch:
+            if name in keys and not isinstance(sources[name], Exception):
+                cache.put(keys[name], sources[name])
+    streams = OrderedDict((name, RecordStream(executor, SOURCES[name].path, cache, keys.get(name)))
+                          for name in consumers if name not in sources)
+    shared = [name for name, stream in streams.items() if consumers[name] > 1 and not stream.cached()]
+    if shared:
+        with ThreadPoolExecutor(max_workers=len(shared)) as pool:
+            spools = [(name, pool.submit(RecordSpool, streams[name])) for name in shared]
+        for name, spool in spools:
+            try:
+                streams[name] = spool.result()
+            except Exception as err:
+                streams[name] = err
+    sources.update(streams)
+    return sources
+
+
+def _fetch_batch(executor, names):
+    cmd = build_batch_cmd(names)
+    try:
+        result = executor.run(cmd)
+    except Exception as err:
+        return dict((name, err) for name in names)
+
+    sources = {}
+    inventory = []
+    lines = result.stdout.decode("utf-8", "replace").splitlines(True)
+    for kind, name, rc, body in split_frames(lines):
+        if kind != 'source':
+            inventory.append((kind, name, rc, body))
+            continue
+        # Rebuild the result of the command on its own, so that it is checked and decoded as usual
+        output = body.encode('utf-8')
+        frame = CommandResult(source_cmd(name), output if rc == 0 else b'', b'' if rc == 0 else output, rc)
+        try:
+            if SOURCES[name].kind == 'otctl':
+                sources[name] = load_otctl_json(frame)
+            else:
+                sources[name] = load_plutil_json(frame)
+        except Exception as err:
+            sources[name] = err
+    for name in names:
+        if SOURCES[name].kind == 'inventory':
+            with PROFILER.stage('parse', 'apps'):
+                sources[name] = parse_inventory(inventory)
+        elif name not in sources:
+            sources[name] = CommandError("The command {} printed no output".format(source_cmd(name)))
+    return sources
+
+
+def fetch_plan(executor, names, cache=None, extractors=None):
+    """Fetch once every source read by the named extractors; return {source: decoded source or exception}"""
+    return fetch_sources(executor, plan_sources(names, extractors), cache)
+
+
+def _records(source):
+    """Return the (key, record) pairs of a fetched 'values' source"""
+    source = _raise_if_error(source)
+    if isinstance(source, dict):
+        return source['values'].items()
+    return source
+
+
+def parse_device_info(otctl, systemversion, tvsettings, appstored):
+    """Return the device information and the errors of the fields that could not be read
+
+    Each argument is either the decoded source or the exception raised while
+    fetching it, so that one missing source only blanks its own fields.
+    """
+    device_info = {
+        'serial_number': '',
+        'hw_model': '',
+        'os_version': '',
+        'os_build': '',
+        'device_id': '',
+    }
+    errors = []
+
+    # Get device Serial Number
+    try:
+        result_data = _raise_if_error(otctl)
+        device_info['serial_number'] = result_data['contextDump']['self']['stableInfo']['serial_number']
+    except Exception as err:
+        errors.append("Getting Device Serial Number Failed - {}".format(err))
+
+    # Get OS Version
+    try:
+        result_data = _raise_if_error(systemversion)
+        device_info['os_version'] = result_data['ProductName'] + ' ' \
+                                    + result_data['ProductVersion']
+        device_info['os_build'] = result_data['ProductBuildVersion']
+    except Exception as err:
+        errors.append("Getting OS Version Failed - {}".format(err))
+
+    # Get HW Model
+    try:
+        result_data = _raise_if_error(tvsettings)
+        device_info['hw_model'] = result_data['SSDeviceType']['hardwareModel']
+    except Exception as err:
+        errors.append("Getting HW Model Failed - {}".format(err))
+
+    # Get Device ID
+    try:
+        result_data = _raise_if_error(appstored)
+        device_info['device_id'] = result_data['ArcadeDeviceGUID']
+    except Exception as err:
+        errors.append("Getting Device ID Failed - {}".format(err))
+
+    return device_info, errors
+
+
+def parse_trusted_peers(result_data):
+    """Return the self, trusted and excluded peers of the Octagon trust network"""
+    trusted_peers = set(result_data['contextDump']['self']['dynamicInfo']['included'])
+    excluded_peers = set(result_data['contextDump']['self']['dynamicInfo']['excluded'])
+    trusted_peers_list = []
+    excluded_peers_list = []
+    self_list = []
+    for peer in result_data['contextDump']['peers']:
+        if peer['peerID'] in trusted_peers:
+            trusted_peers_list.append([peer['peerID'],
+                                       peer['stableInfo']['serial_number'],
+                                       peer['permanentInfo']['model_id'],
+                                       peer['stableInfo']['os_version']])
+        elif peer['peerID'] in excluded_peers:
+            excluded_peers_list.append([peer['peerID'],
+                                        peer['stableInfo']['serial_number'],
+                                        peer['permanentInfo']['model_id'],
+                                        peer['stableInfo']['os_version']])
+    self_list.append([result_data['contextDump']['self']['peerID'],
+                      result_data['contextDump']['self']['stableInfo']['serial_number'],
+                      result_data['contextDump']['self']['permanentInfo']['model_id'],
+                      result_data['contextDump']['self']['stableInfo']['os_version']])
+    return self_list, trusted_peers_list, excluded_peers_list
+
+
+def iter_wifi_info(records):
+    """Yield [SSID, added by, OS version, added at] from the (SSID, record) pairs of the values dictionary"""
+    for ssid, record in records:
+        yield [
+            ssid,
+            record['value'].get('added_by', "Not Available"),
+            record['value'].get('added_by_os_ver', "Not Available"),
+            record['value'].get('added_at',
+                                get_cfAbsoluteTime(record.get("timestamp", None))
+                                + ' (Estimate)'
+                                )
+        ]
+
+
+def parse_wifi_info(records):
+    """Return the synced Wifi networks keyed by SSID from the (SSID, record) pairs of the values dictionary"""
+    return dict((row[0], row[1:]) for row in iter_wifi_info(records))
+
+
+def parse_id_info(result_data):
+    """Return the Apple IDs found in the identity services cache"""
+    id_dict = {
+        'icloud': [],
+        'fmd': [],
+        'cloudmessaging': [],
+        'nearby': [],
+    }
+    for record in result_data.keys():
+        if 'icloudpairing' in record:
+            id_dict['icloud'] = list(result_data[record].keys())
+        elif 'fmd' in record:
+            id_dict['fmd'] = list(result_data[record].keys())
+        elif 'cloudmessaging' in record:
+            id_dict['cloudmessaging'] = list(result_data[record].keys())
+        elif 'nearby' in record:
+            id_dict['nearby'] = list(result_data[record].keys())
+    return id_dict
+
+
+def iter_location_history(records):
+    """Yield [name, address, timestamp, source] from the (key, record) pairs of the values dictionary"""
+    for key, record in records:
+        yield [
+            record['value'].get('n', "Not Available"),
+            record['value'].get('a', "Not Available"),
+            get_cfAbsoluteTime(record.get("timestamp", None)),
+            record['value'].get('S', "Not Available"),
+        ]
+
+
+def parse_location_history(records):
+    """Return the synced location history from the (key, record) pairs of the values dictionary"""
+    return list(iter_location_history(records))
+
+
+def parse_app_metadata(kind, result_data):
+    """Return the [name, version, bundle id] row of an Info.plist or iTunesMetadata.plist"""
+    return [result_data.get(field, "Not Available") for field in APP_METADATA_FIELDS[kind]]
+
+
+def parse_inventory(frames):
+    """Return the Apple apps, the user apps and the per app failures from the frames of the inventory command"""
+    apple_app_list = []
+    other_app_list = []
+    failures = []
+    for kind, name, rc, body in frames:
+        if rc != 0:
+            failures.append([kind, name, "plutil exit status {}: {}".format(rc, body.strip())])
+            continue
+        try:
+            row = parse_app_metadata(kind, loads_plutil_json(body))
+        except Exception as err:
+            failures.append([kind, name, "Parsing failed - {}".format(err)])
+            continue
+        if kind == 'apple':
+            apple_app_list.append(row)
+        else:
+            other_app_list.append(row)
+    return apple_app_list, other_app_list, failures
+
+
+def get_device_info(executor, cache=None):
+    """Return the device information and the errors of the fields that could not be read"""
+    sources = fetch_plan(executor, ['device'], cache)
+    with PROFILER.stage('parse', 'device'):
+        return parse_device_info(**sources)
+
+
+def get_wifi_info(executor, cache=None):
+    return parse_wifi_info(_records(fetch_plan(executor, ['wifi'], cache)['wifi']))
+
+
+def get_id_info(executor, cache=None):
+    result_data = _raise_if_error(fetch_plan(executor, ['ids'], cache)['id_cache'])
+    with PROFILER.stage('parse', 'ids'):
+        return parse_id_info(result_data)
+
+
+def get_installed_apps(executor):
+    """Return the Apple apps, the user apps and the per app failures in one round trip"""
+    return _raise_if_error(fetch_plan(executor, ['apps'])['inventory'])
+
+
+class Timeline(object):
+    """Time sorted store of events merged from every artifact and device
+
+    Times are Unix seconds held in an array; the device, source and
+    description of every event sit in parallel lists. Events are appended
+    in bulk and sorted once, on the first query after a change, and range
+    queries are answered with a binary search.
+    """
+
+    def __init__(self):
+        self.times = array('d')
+        self.devices = []
+        self.sources = []
+        self.descriptions = []
+        self.is_sorted = True
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getstate__(self):
+        # Timelines travel back from the worker processes of offline batches
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def extend(self, device, source, unix_times, descriptions):
+        """Add events in bulk; events without a time (NaN) are skipped"""
+        with self.lock:
+            for unix_time, description in zip(unix_times, descriptions):
+                if unix_time == unix_time:
+                    self.times.append(unix_time)
+                    self.devices.append(device)
+                    self.sources.append(source)
+                    self.descriptions.append(description)
+            self.is_sorted = False
+
+    def add_records(self, device, source, records, describe, event_time=None, batch_size=TIMELINE_BATCH_SIZE):
+        """Add the (key, record) pairs of a values dictionary, converting their times in batches
+
+        event_time returns the CFAbsoluteTime of a (key, record) pair; by
+        default the time the record was synced.
+        """
+        cf_times = []
+        descriptions = []
+        for key, record in records:
+            cf_times.append(event_time(key, record) if event_time else record.get('timestamp'))
+            descriptions.append(describe(key, record))
+            if len(cf_times) >= batch_size:
+                self.extend(device, source, cf_to_unix(cf_times), descriptions)
+                cf_times = []
+                descriptions = []
+        self.extend(device, source, cf_to_unix(cf_times), descriptions)
+
+    def merge(self, other):
+        """Merge the events of another timeline, interleaving the two sorted arrays run by run"""
+        other.sort()
+        self.sort()
+        with self.lock:
+            times = array('d')
+            devices = []
+            sources = []
+            descriptions = []
+
+            def take(timeline, lo, hi):
+                times.extend(timeline.times[lo:hi])
+                devices.extend(timeline.devices[lo:hi])
+                sources.extend(timeline.sources[lo:hi])
+                descriptions.extend(timeline.descriptions[lo:hi])
+
+            i = j = 0
+            n, m = len(self.times), len(other.times)
+            while j < m:
+                # The events of this timeline up to the next one of the other, then the reverse
+                k = bisect.bisect_right(self.times, other.times[j], i)
+                take(self, i, k)
+                l = m if k == n else bisect.bisect_left(other.times, self.times[k], j)
+                take(other, j, l)
+                i, j = k, l
+            take(self, i, n)
+            self.times, self.devices, self.sources, self.descriptions = times, devices, sources, descriptions
+
+    def extend_events(self, events):
+        """Add (unix time, device, source, description) events"""
+        with self.lock:
+            for unix_time, device, source, description in events:
+                self.times.append(unix_time)
+                self.devices.append(device)
+                self.sources.append(source)
+                self.descriptions.append(description)
+            self.is_sorted = False
+
+    def sort(self):
+        with self.lock:
+            if self.is_sorted:
+                return
+            order = sorted(range(len(self.times)), key=self.times.__getitem__)
+            self.times = array('d', [self.times[i] for i in order])
+            self.devices = [self.devices[i] for i in order]
+            self.sources = [self.sources[i] for i in order]
+            self.descriptions = [self.descriptions[i] for i in order]
+            self.is_sorted = True
+
+    def between(self, start=None, end=None):
+        """Yield the (unix time, device, source, description) events with start <= time <= end"""
+        self.sort()
+        lo = 0 if start is None else bisect.bisect_left(self.times, start)
+        hi = len(self.times) if end is None else bisect.bisect_right(self.times, end)
+        for i in range(lo, hi):
+            yield self.times[i], self.devices[i], self.sources[i], self.descriptions[i]
+
+    def save(self, path):
+        """Write the events as time sorted NDJSON"""
+        with open(path, 'w') as f:
+            for unix_time, device, source, description in self.between():
+                f.write(json.dumps([unix_time, device, source, description]) + '\n')
+
+    @classmethod
+    def load(cls, *paths):
+        """Load and merge timelines written by save()"""
+        timeline = cls()
+        for path in paths:
+            with open(path) as f:
+                timeline.extend_events(json.loads(line) for line in f if line.strip())
+        return timeline
+
+
+def describe_location(key, record):
+    return "{} - {} ({})".format(record['value'].get('n', "Not Available"),
+                                 record['value'].get('a', "Not Available"),
+                                 record['value'].get('S', "Not Available"))
+
+
+def describe_wifi(ssid, record):
+    return "Wifi network {} added by {}".format(ssid, record['value'].get('added_by', "Not Available"))
+
+
+def wifi_added_time(ssid, record):
+    """Return the CFAbsoluteTime a Wifi network was added, or the time it was synced when unknown"""
+    added_at = record['value'].get('added_at')
+    if isinstance(added_at, (int, float)) and not isinstance(added_at, bool) and added_at:
+        return added_at
+    return record.get('timestamp')
+
+
+#
+# Every timeline source describes its (key, record) pairs, and gives the
+# time of their event (the sync time of the record when event_time is None).
+#
+TimelineSource = namedtuple('TimelineSource', ['describe', 'event_time'])
+
+TIMELINE_SOURCES = OrderedDict([
+    ('location', TimelineSource(describe_location, None)),
+    ('wifi', TimelineSource(describe_wifi, wifi_added_time)),
+])
+
+
+def build_timeline(executor, cache=None, device=None, timeline=None):
+    """Add the timestamped records of every timeline source of a device to a timeline"""
+    if timeline is None:
+        timeline = Timeline()
+    if device is None:
+        device = executor.transport.getpeername()[0]
+    return add_timeline_sources(timeline, device, fetch_plan(executor, ['timeline'], cache))
+
+
+def add_timeline_sources(timeline, device, sources):
+    """Add the timestamped records of the fetched timeline sources of a device to a timeline"""
+    for source, (describe, event_time) in TIMELINE_SOURCES.items():
+        try:
+            timeline.add_records(device, source, _records(sources[source]), describe, event_time)
+        except Exception as err:
+            warning("Adding {} to the timeline failed - {}".format(source, err))
+    return timeline
+
+
+def format_unix_time(unix_time):
+    return dt.utcfromtimestamp(unix_time).strftime('%b %d %Y %H:%M:%S')
+
+
+def parse_time(text):
+    """Parse a YYYY-MM-DD[THH:MM[:SS]] UTC time given on the command line into Unix seconds"""
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return (dt.strptime(text, fmt) - datetime.datetime(1970, 1, 1)).total_seconds()
+        except ValueError:
+            pass
+    raise ValueError("time data {!r} does not match YYYY-MM-DD[THH:MM[:SS]]".format(text))
+
+
+class PeerGraph(object):
+    """Persistent index of the Octagon trust networks seen across devices and acquisitions
+
+    Peers are keyed by peerID, with an index of the peerIDs of every serial
+    number. Each otctl dump merged records the included and excluded edges
+    of every peer carrying dynamicInfo, tagged with the observing device and
+    time; only the latest edge between two peers is kept, so the index grows
+    with the trust network rather than with the number of acquisitions.
+    Forward and reverse adjacency of the included edges are dicts of sets.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.peers = {}
+        self.serials = {}
+        self.edges = {}
+        self.includes = {}
+        self.vouchers = {}
+        self.observations = []
+        self.lock = threading.RLock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self.peers)
+
+    def __getstate__(self):
+        # Peer graphs travel back from the worker processes of offline batches
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def add_context_dump(self, result_data, source, observed=None):
+        """Merge the output of otctl status -j of one device, as seen by source at the observed Unix time"""
+        dump = result_data['contextDump']
+        observed = time.time() if observed is None else observed
+        peers = [dump['self']] + list(dump.get('peers', ()))
+        with self.lock:
+            for peer in peers:
+                self._add_peer(peer['peerID'], [peer.get('stableInfo', {}).get('serial_number'),
+                                                peer.get('permanentInfo', {}).get('model_id'),
+                                                peer.get('stableInfo', {}).get('os_version'),
+                                                observed, observed])
+            for peer in peers:
+                dynamic_info = peer.get('dynamicInfo') or {}
+                for relation in ('included', 'excluded'):
+                    for peer_id in dynamic_info.get(relation, ()):
+                        self._add_edge(peer['peerID'], peer_id, [relation, observed, source])
+            self.observations.append([source, dump['self']['peerID'], observed])
+
+    def merge(self, other):
+        """Merge another peer graph, keeping the latest observation of every peer and edge"""
+        with self.lock:
+            for peer_id, record in other.peers.items():
+                self._add_peer(peer_id, list(record))
+            for observer, edges in other.edges.items():
+                for peer_id, edge in edges.items():
+                    self._add_edge(observer, peer_id, list(edge))
+            self.observations.extend(other.observations)
+
+    def _add_peer(self, peer_id, record):
+        # record is [serial number, model, OS version, first seen, last seen]
+        current = self.peers.get(peer_id)
+        if current is None:
+            self.peers[peer_id] = record
+        else:
+            first_seen = min(current[3], record[3])
+            if record[4] >= current[4]:
+                current[:] = record
+            current[3] = first_seen
+            record = current
+        if record[0]:
+            self.serials.setdefault(record[0], set()).add(peer_id)
+
+    def _add_edge(self, observer, peer_id, edge):
+        # edge is [relation, observed time, observing device]
+        edges = self.edges.setdefault(observer, {})
+        current = edges.get(peer_id)
+        if current is not None and current[1] > edge[1]:
+            return
+        edges[peer_id] = edge
+        if edge[0] == 'included':
+            self.includes.setdefault(observer, set()).add(peer_id)
+            self.vouchers.setdefault(peer_id, set()).add(observer)
+        else:
+            self.includes.get(observer, set()).discard(peer_id)
+            self.vouchers.get(peer_id, set()).discard(observer)
+
+    def resolve(self, key):
+        """Return the peerIDs of a peerID or a serial number"""
+        with self.lock:
+            if key in self.peers or key in self.edges or key in self.vouchers:
+                return {key}
+            return set(self.serials.get(key, ()))
+
+    def vouches_for(self, key):
+        """Return [voucher peerID, voucher serial, model, vouched peerID, observed, seen by] rows
+
+        The vouchers of a peerID or serial number are the peers whose latest
+        observed dynamicInfo includes it.
+        """
+        rows = []
+        with self.lock:
+            for peer_id in sorted(self.resolve(key)):
+                for voucher in sorted(self.vouchers.get(peer_id, ())):
+                    relation, observed, source = self.edges[voucher][peer_id]
+                    serial, model = self.peers.get(voucher, [None, None])[:2]
+                    rows.append([voucher, serial, model, peer_id, observed, source])
+        return rows
+
+    def reachable(self, key):
+        """Return {peerID: hops} of the peers reachable over included edges from a peerID or serial number"""
+        with self.lock:
+            hops = dict((peer_id, 0) for peer_id in self.resolve(key))
+            pending = deque(hops)
+            while pending:
+                peer_id = pending.popleft()
+                for next_peer in self.includes.get(peer_id, ()):
+                    if next_peer not in hops:
+                        hops[next_peer] = hops[peer_id] + 1
+                        pending.append(next_peer)
+        return hops
+
+    def save(self, path=None):
+        path = path or self.path
+        with self.lock:
+            state = {'peers': self.peers, 'edges': self.edges, 'observations': self.observations}
+            os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+            # The serial numbers of a household are personal data
+            with open_private(path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(path + '.tmp', path)
+
+    def _load(self):
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        for peer_id, record in state['peers'].items():
+            self._add_peer(peer_id, record)
+        for observer, edges in state['edges'].items():
+            for peer_id, edge in edges.items():
+                self._add_edge(observer, peer_id, edge)
+        self.observations = state['observations']
+
+
+def normalize_search_text(text):
+    """Lower case text, drop the URI scheme of an ID and collapse the whitespace
+
+    Phone numbers keep only their digits, so any way of writing one finds it.
+    """
+    text = re.sub(r'^(mailto|tel):', '', (text or '').strip().lower())
+    if re.match(r'^\+?[\d\s().-]*\d[\d\s().-]*$', text):
+        return re.sub(r'\D', '', text)
+    return ' '.join(text.split())
+
+
+def search_terms(text):
+    """Return the word tokens of normalized text"""
+    return set(re.findall(r'\w+', text))
+
+
+def search_grams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class SearchIndex(object):
+    """Searchable store of the Apple IDs and places of every device acquired
+
+    Backed by SQLite, so it persists across runs and devices and fleet
+    threads and offline worker processes each write through their own
+    connection. Places are deduplicated on their normalized name and
+    address, with one visit per synced record and its source app. IDs and
+    places are indexed by word, and the distinct words by trigram, so both
+    prefix and substring queries never read the plists again.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS ids (id INTEGER PRIMARY KEY, value TEXT UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS id_sightings (id INTEGER, device TEXT, category TEXT, '
+        'PRIMARY KEY (id, device, category)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS places (id INTEGER PRIMARY KEY, place_key TEXT UNIQUE, name TEXT, address TEXT)',
+        'CREATE TABLE IF NOT EXISTS visits (device TEXT, record TEXT, place INTEGER, source TEXT, unix_time REAL, '
+        'PRIMARY KEY (device, record)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS visits_place ON visits (place)',
+        'CREATE TABLE IF NOT EXISTS terms (term TEXT, kind TEXT, ref INTEGER, '
+        'PRIMARY KEY (term, kind, ref)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS vocabulary (term TEXT PRIMARY KEY) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS term_grams (gram TEXT, term TEXT, PRIMARY KEY (gram, term)) WITHOUT ROWID',
+    )
+
+    # Query words matching more entries than this are checked against the
+    # text of the candidates left by the more selective words instead
+    SELECTIVE_REFS = 2000
+
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        # The index holds personal data: create it readable only by its owner,
+        # which SQLite carries over to its journal files
+        open_private(path, 'ab').close()
+        for journal in (path + '-wal', path + '-shm'):
+            if os.path.exists(journal):
+                os.chmod(journal, 0o600)
+        self.db = sqlite3.connect(path, timeout=SEARCH_INDEX_TIMEOUT)
+        # Readers are not blocked by a device being indexed
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS matches (ref INTEGER PRIMARY KEY)')
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS word_terms (word TEXT, term TEXT, PRIMARY KEY (word, term))')
+        self.pending_terms = []
+
+    def close(self):
+        self.db.close()
+
+    def _index(self, kind, ref, text):
+        self.pending_terms.extend((term, kind, ref) for term in search_terms(text))
+
+    def _flush_index(self):
+        # Inserting in key order keeps the index B-trees append only
+        self.pending_terms.sort()
+        self.db.executemany('INSERT OR IGNORE INTO terms VALUES (?, ?, ?)', self.pending_terms)
+        # Only words not seen before add trigrams
+        new = []
+        for term in sorted(set(term for term, kind, ref in self.pending_terms)):
+            if self.db.execute('INSERT OR IGNORE INTO vocabulary VALUES (?)', (term,)).rowcount:
+                new.append(term)
+        self.db.executemany('INSERT OR IGNORE INTO term_grams VALUES (?, ?)',
+                            sorted((gram, term) for term in new for gram in search_grams(term)))
+        self.pending_terms = []
+
+    def add_ids(self, device, id_dict):
+        """Add the {category: [ID]} of parse_id_info seen on a device"""
+        with self.db:
+            for category, ids in id_dict.items():
+                for value in ids:
+                    cursor = self.db.execute('INSERT OR IGNORE INTO ids (value) VALUES (?)', (value,))
+                    if cursor.rowcount:
+                        ref = cursor.lastrowid
+                        self._index('id', ref, normalize_search_text(value))
+                    else:
+                        ref = self.db.execute('SELECT id FROM ids WHERE value = ?', (value,)).fetchone()[0]
+                    self.db.execute('INSERT OR IGNORE INTO id_sightings VALUES (?, ?, ?)', (ref, device, category))
+            self._flush_index()
+
+    def add_locations(self, device, records, batch_size=TIMELINE_BATCH_SIZE):
+        """Add the (key, record) pairs of the synced locations values dictionary of a device"""
+        places = {}
+        visits = []
+        cf_times = []
+        with self.db:
+            for key, record in records:
+                name = record['value'].get('n', "Not Available")
+                address = record['value'].get('a', "Not Available")
+                place_key = normalize_search_text(name) + '\n' + normalize_search_text(address)
+                ref = places.get(place_key)
+                if ref is None:
+                    cursor = self.db.execute('INSERT OR IGNORE INTO places (place_key, name, address) VALUES (?, ?, ?)',
+                                             (place_key, name, address))
+                    if cursor.rowcount:
+                        ref = cursor.lastrowid
+                        self._index('place', ref, place_key.replace('\n', ' '))
+                    else:
+                        ref = self.db.execute('SELECT id FROM places WHERE place_key = ?', (place_key,)).fetchone()[0]
+                    places[place_key] = ref
+                visits.append([device, key, ref, record['value'].get('S', "Not Available")])
+                cf_times.append(record.get('timestamp'))
+                if len(visits) >= batch_size:
+                    self._add_visits(visits, cf_times)
+                    visits = []
+                    cf_times = []
+            self._add_visits(visits, cf_times)
+            self._flush_index()
+        return len(places)
+
+    def _add_visits(self, visits, cf_times):
+        unix_times = cf_to_unix(cf_times)
+        self.db.executemany('INSERT OR REPLACE INTO visits VALUES (?, ?, ?, ?, ?)',
+                            [visit + [unix_time if unix_time == unix_time else None]
+                             for visit, unix_time in zip(visits, unix_times)])
+
+    def _word_refs(self, kind, word, substring):
+        """Return the SQL and parameters selecting the refs of kind with a word starting with, or containing, word"""
+        if not substring:
+            return ('SELECT ref FROM terms WHERE term >= ? AND term < ? AND kind = ?',
+                    (word, word + '\U0010ffff', kind))
+        grams = sorted(search_grams(word))
+        if grams:
+            terms = self.db.execute('SELECT term FROM term_grams WHERE gram IN ({}) GROUP BY term HAVING COUNT(*) = ?'
+                                    .format(','.join('?' * len(grams))), grams + [len(grams)])
+        else:
+            # Too short for a trigram, check every word
+            terms = self.db.execute('SELECT term FROM vocabulary WHERE instr(term, ?)', (word,))
+        self.db.executemany('INSERT OR IGNORE INTO word_terms VALUES (?, ?)',
+                            [(word, term) for term, in terms.fetchall() if word in term])
+        return ('SELECT ref FROM word_terms JOIN terms ON terms.term = word_terms.term AND kind = ? WHERE word = ?',
+                (kind, word))
+
+    def _match(self, kind, text, substring):
+        """Fill the matches temporary table with the refs of kind whose indexed text matches the query
+
+        Every word of the query must start (or, for substring queries, be
+        part of) a word of the entry. The words are looked up from the most
+        selective one, and words matching too many entries, or a substring
+        query spanning several words, are checked on the remaining
+        candidates' text instead.
+        """
+        table, column = ('ids', 'value') if kind == 'id' else ('places', 'place_key')
+        self.db.execute('DELETE FROM matches')
+        self.db.execute('DELETE FROM word_terms')
+        words = sorted(search_terms(text))
+        if not words:
+            # Nothing to look up, check every entry
+            candidates = self.db.execute('SELECT id, {} FROM {}'.format(column, table)).fetchall()
+        else:
+            selects = []
+            for word in words:
+                sql, params = self._word_refs(kind, word, substring)
+                count = self.db.execute('SELECT COUNT(*) FROM ({} LIMIT ?)'.format(sql),
+                                        params + (self.SELECTIVE_REFS,)).fetchone()[0]
+                selects.append((count, sql, params))
+            selects.sort(key=lambda select: select[0])
+            count, sql, params = selects[0]
+            self.db.execute('INSERT OR IGNORE INTO matches ' + sql, params)
+            exact = not substring or text == words[0]
+            for count, sql, params in selects[1:]:
+                if count >= self.SELECTIVE_REFS:
+                    exact = False
+                    continue
+                self.db.execute('DELETE FROM matches WHERE ref NOT IN ({})'.format(sql), params)
+            if exact:
+                return
+            candidates = self.db.execute('SELECT ref, {} FROM matches JOIN {} ON id = ref'.format(column, table)).fetchall()
+            self.db.execute('DELETE FROM matches')
+        matched = []
+        for ref, value in candidates:
+            # Place keys are normalized already
+            value = normalize_search_text(value) if kind == 'id' else value.replace('\n', ' ')
+            if substring:
+                if text in value:
+                    matched.append((ref,))
+            else:
+                tokens = search_terms(value)
+                if all(any(token.startswith(word) for token in tokens) for word in words):
+                    matched.append((ref,))
+        self.db.executemany('INSERT INTO matches VALUES (?)', matched)
+
+    def search_ids(self, query, substring=False):
+        """Return [ID, category, device] rows of the IDs matching the query"""
+        self._match('id', normalize_search_text(query), substring)
+        return [list(row) for row in self.db.execute(
+            'SELECT value, category, device FROM matches JOIN ids ON ids.id = ref '
+            'JOIN id_sightings ON id_sightings.id = ref ORDER BY value, category, device')]
+
+    def search_places(self, query, substring=False):
+        """Return [name, address, visits, devices, first seen, last seen, visits per source] rows, most visited first"""
+        self._match('place', normalize_search_text(query), substring)
+        sources = {}
+        # CROSS JOIN keeps SQLite from scanning every visit
+        for place, source, count in self.db.execute(
+                'SELECT place, source, COUNT(*) FROM matches CROSS JOIN visits ON place = ref '
+                'GROUP BY place, source ORDER BY COUNT(*) DESC, source'):
+            sources.setdefault(place, []).append("{} {}".format(source, count))
+        rows = []
+        for place, name, address, visits, devices, first, last in self.db.execute(
+                'SELECT ref, name, address, COUNT(*), COUNT(DISTINCT device), MIN(unix_time), MAX(unix_time) '
+                'FROM matches CROSS JOIN places ON places.id = ref CROSS JOIN visits ON place = ref '
+                'GROUP BY ref ORDER BY COUNT(*) DESC, name, address'):
+            rows.append([name, address, visits, devices,
+                         format_unix_time(first) if first is not None else "Not Available",
+                         format_unix_time(last) if last is not None else "Not Available",
+                         ', '.join(sources.get(place, ()))])
+        return rows
+
+    def stats(self):
+        return OrderedDict((table, self.db.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0])
+                           for table in ('ids', 'id_sightings', 'places', 'visits'))
+
+
+def search_menu(path=SEARCH_INDEX_PATH):
+    """Prompt for searches of the IDs and places of every device until an empty query"""
+    index = SearchIndex(path)
+    try:
+        while True:
+            query = input("\nSearch the IDs and places of every device "
+                          "(word prefix, *text* for any substring, empty to return): ").strip()
+            if not query:
+                return
+            substring = len(query) > 2 and query.startswith('*') and query.endswith('*')
+            text = query[1:-1] if substring else query
+            started = time.time()
+            ids = index.search_ids(text, substring)
+            places = index.search_places(text, substring)
+            elapsed = time.time() - started
+            print("\nIDs:")
+            print(render_table(ids, headers=['ID', 'Category', 'Device']))
+            print("\nPlaces:")
+            print(render_table(places, headers=['Name', 'Address', 'Visits', 'Devices', 'First Seen', 'Last Seen',
+                                                'Visits by Source']))
+            print("\n{} IDs and {} places found in {:.3f}s".format(len(ids), len(places), elapsed))
+    finally:
+        index.close()
+
+
+def index_sources(path, device, sources):
+    """Add the IDs and places of the fetched sources of a device to the search index at path"""
+    index = SearchIndex(path)
+    try:
+        try:
+            with PROFILER.stage('index', 'ids'):
+                index.add_ids(device, parse_id_info(_raise_if_error(sources['id_cache'])))
+        except Exception as err:
+            warning("Adding the IDs to the search index failed - {}".format(err))
+        try:
+            with PROFILER.stage('index', 'location'):
+                index.add_locations(device, _records(sources['location']))
+        except Exception as err:
+            warning("Adding the locations to the search index failed - {}".format(err))
+    finally:
+        index.close()
+
+
+def snapshot_wifi(data):
+    values = data['values']
+    return OrderedDict((row[0], row) for row in iter_wifi_info(values.items()))
+
+
+def snapshot_location(data):
+    values = data['values']
+    return OrderedDict(zip(values.keys(), iter_location_history(values.items())))
+
+
+def snapshot_ids(data):
+    return OrderedDict(("{} {}".format(category, apple_id), [category, apple_id])
+                       for category, ids in parse_id_info(data).items() for apple_id in ids)
+
+
+SNAPSHOT_RECORDS = OrderedDict([
+    ('wifi', (FORENSIC_FILES['wifi'], snapshot_wifi)),
+    ('location', (FORENSIC_FILES['location'], snapshot_location)),
+    ('ids', (FORENSIC_FILES['id_cache'], snapshot_ids)),
+])
+
+
+def app_record_key(path):
+    """Return (kind, bundle directory) for the remote path of an app metadata plist, or None"""
+    for kind, (root, plist) in APP_INVENTORY_ROOTS.items():
+        if path.startswith(root + '/') and path.endswith('/' + plist):
+            return kind, path[len(root) + 1:-len(plist) - 1]
+    return None
+
+
+def diff_records(old, new):
+    """Return the added, removed and changed records between two {key: row} snapshots"""
+    return OrderedDict([
+        ('added', OrderedDict((key, row) for key, row in new.items() if key not in old)),
+        ('removed', OrderedDict((key, row) for key, row in old.items() if key not in new)),
+        ('changed', OrderedDict((key, row) for key, row in new.items() if key in old and old[key] != row)),
+    ])
+
+
+class SnapshotStore(object):
+    """Per device record of the last acquisition, to re-acquire only what changed
+
+    Each device directory holds the remote (size, mtime) of every artifact,
+    the records of every source as {key: row}, one evidence directory per
+    acquisition with the files it fetched, and deltas.ndjson with one line
+    per acquisition.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+
+    def path(self, device, *parts):
+        return os.path.join(self.directory, device, *parts)
+
+    def makedirs(self, device, *parts):
+        """Create a directory of the store and return its path; the store is readable only by its owner"""
+        makedirs_private(self.directory)
+        path = self.path(device, *parts)
+        makedirs_private(path)
+        return path
+
+    def _load(self, device, name, default):
+        try:
+            with open(self.path(device, name), 'r') as f:
+                return json.load(f, object_pairs_hook=OrderedDict)
+        except (IOError, OSError):
+            return default
+
+    def _dump(self, device, name, value):
+        path = self.path(device, name)
+        self.makedirs(device, os.path.dirname(name))
+        with open_private(path + '.tmp', 'w') as f:
+            json.dump(value, f)
+        os.replace(path + '.tmp', path)
+
+    def files(self, device):
+        return dict((path, tuple(stats)) for path, stats in self._load(device, 'files.json', {}).items())
+
+    def records(self, device, source):
+        return self._load(device, os.path.join('records', source + '.json'), OrderedDict())
+
+    def deltas(self, device):
+        try:
+            with open(self.path(device, 'deltas.ndjson'), 'r') as f:
+                return [json.loads(line, object_pairs_hook=OrderedDict) for line in f if line.strip()]
+        except (IOError, OSError):
+            return []
+
+    def save(self, device, files, records, delta):
+        """Record an acquisition; records only holds the sources that changed"""
+        for source, source_records in records.items():
+            self._dump(device, os.path.join('records', source + '.json'), source_records)
+        self._dump(device, 'files.json', files)
+        with open_private(self.path(device, 'deltas.ndjson'), 'a') as f:
+            f.write(json.dumps(delta) + '\n')
+
+
+def reacquire(executor, store, custody=None, examiner=None, sign_key=None):
+    """Acquire only the artifacts that changed since the last snapshot and return the record deltas
+
+    One stat command covers every artifact and app metadata plist, and the
+    changed files come back in one tar stream, so the time taken follows
+    the amount of change rather than the size of the evidence. With a
+    CustodyManifest the files fetched are hashed and the manifest is sealed
+    in the evidence directory of the pass.
+    """
+    device = device_id(executor)
+    previous = store.files(device)
+    taken = dt.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    stats = remote_stat(executor, [FORENSIC_FILES[name] for name in ACQUISITION_SOURCES],
+                        ['/' + glob for glob in APP_METADATA_GLOBS])
+    changed = sorted(path for path, path_stats in stats.items() if previous.get(path) != path_stats)
+    removed = sorted(path for path in previous if path not in stats)
+    delta = OrderedDict([
+        ('device', device),
+        ('taken', taken),
+        ('baseline', not previous),
+        ('changed_files', changed),
+        ('removed_files', removed),
+        ('records', OrderedDict()),
+        ('errors', OrderedDict()),
+        ('manifest', None),
+    ])
+
+    artifacts = {}
+    if changed:
+        evidence_dir = store.makedirs(device, taken)
+        cmd = build_tar_cmd(changed)
+        if custody:
+            custody.command(cmd)
+        with executor.stream(cmd) as reader:
+            artifacts = dict(read_tar_stream(reader, evidence_dir, custody))
+        if custody:
+            peer = '{}:{}'.format(*executor.transport.getpeername()[:2])
+            delta['manifest'] = custody.seal(evidence_dir, device, peer, examiner, sign_key)
+    parsed = parse_artifacts(artifacts)
+    for path in changed:
+        if path not in parsed:
+            parsed[path] = CommandError("{} was not received".format(path))
+        if isinstance(parsed[path], Exception):
+            # Forget the stats so the next acquisition fetches it again
+            delta['errors'][path] = str(parsed[path])
+            stats.pop(path)
+
+    records = OrderedDict()
+    with PROFILER.stage('parse', 'snapshot'):
+        for source, (path, extract) in SNAPSHOT_RECORDS.items():
+            if path in delta['errors'] or (path not in changed and path not in removed):
+                continue
+            try:
+                records[source] = extract(parsed[path]) if path in changed else OrderedDict()
+            except Exception as err:
+                delta['errors'][path] = "Parsing failed - {}".format(err)
+                stats.pop(path, None)
+                continue
+            delta['records'][source] = diff_records(store.records(device, source), records[source])
+
+        app_paths = [path for path in changed + removed if app_record_key(path) and path not in delta['errors']]
+        if app_paths:
+            old = store.records(device, 'apps')
+            records['apps'] = new = OrderedDict(old)
+            for path in app_paths:
+                kind, directory = app_record_key(path)
+                if path in removed:
+                    new.pop(directory, None)
+                else:
+                    new[directory] = [kind] + parse_app_metadata(kind, parsed[path])
+            delta['records']['apps'] = diff_records(old, new)
+
+    files = OrderedDict(sorted((path, list(path_stats)) for path, path_stats in stats.items()))
+    summary = OrderedDict((source, OrderedDict((change, len(rows)) for change, rows in changes.items()))
+                          for source, changes in delta['records'].items())
+    if delta['baseline']:
+        # Everything is new on the first acquisition; the records themselves are in the store
+        delta['records'] = summary
+    store.save(device, files, records, delta)
+    delta['summary'] = summary
+    return delta
+
+
+def remote_find(executor, root):
+    """Return [(path, size)] of the regular files below a remote root, without leaving its filesystem
+
+    Raises CommandError when the listing failed or found no file, so that
+    an empty plan is never mistaken for a complete image.
+    """
+    quoted = shlex.quote(root)
+    cmd = ('if stat -c %s / >/dev/null 2>&1; '
+           'then find {0} -xdev -type f -exec stat -c \'%s %n\' {{}} +; '
+           'else find {0} -xdev -type f -exec stat -f \'%z %N\' {{}} +; fi').format(quoted)
+    files = []
+    for line in executor.run(cmd).check().stdout.decode('utf-8', 'replace').splitlines():
+        fields = line.split(' ', 1)
+        if len(fields) == 2 and fields[0].isdigit():
+            files.append((fields[1], int(fields[0])))
+    if not files:
+        raise CommandError("No regular file was found below {}".format(root))
+    return sorted(files)
+
+
+def plan_shards(files, shard_bytes=IMAGE_SHARD_BYTES, arg_bytes=IMAGE_SHARD_ARG_BYTES):
+    """Group (path, size) pairs into shards bounded by their total size and command line length"""
+    shards = []
+    shard, size, length = [], 0, 0
+    for path, path_size in files:
+        path_length = len(shlex.quote(path.lstrip('/'))) + 1
+        if shard and (size + path_size > shard_bytes or length + path_length > arg_bytes):
+            shards.append(shard)
+            shard, size, length = [], 0, 0
+        shard.append(path)
+        size += path_size
+        length += path_length
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+class ImageCheckpoint(object):
+    """Plan and finished shards of an image, kept in the image directory so an interrupted image resumes
+
+    plan.json holds the shards; checkpoint.ndjson gets one line with the
+    manifest entries of every shard once all its files are on disk.
+    """
+
+    def __init__(self, image_dir):
+        self.image_dir = image_dir
+        self.plan_path = os.path.join(image_dir, 'plan.json')
+        self.checkpoint_path = os.path.join(image_dir, 'checkpoint.ndjson')
+        self.lock = threading.Lock()
+
+    def load_plan(self, root, compress):
+        try:
+            with open(self.plan_path, 'r') as f:
+                plan = json.load(f)
+        except (IOError, OSError):
+            return None
+        if plan['root'] != root:
+            raise CommandError("{} holds an image of {}, not {}".format(self.image_dir, plan['root'], root))
+        if not plan['shards']:
+            # Left by an earlier version that saved failed listings
+            return None
+        if plan['compress'] != compress:
+            warning("Resuming the image with compression {}".format('on' if compress else 'off'))
+        return plan['shards']
+
+    def save_plan(self, root, compress, shards):
+        os.makedirs(self.image_dir, exist_ok=True)
+        with open(self.plan_path + '.tmp', 'w') as f:
+            json.dump({'root': root, 'compress': compress, 'shards': shards}, f)
+        os.replace(self.plan_path + '.tmp', self.plan_path)
+
+    def finished(self):
+        """Return {shard index: manifest entries} of the shards already on disk"""
+        done = {}
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line, object_pairs_hook=OrderedDict)
+                    except ValueError:
+                        # Last line cut short by the interruption
+                        continue
+                    done[record['shard']] = record['files']
+        except (IOError, OSError):
+            pass
+        return done
+
+    def mark(self, index, entries):
+        line = json.dumps({'shard': index, 'files': entries}) + '\n'
+        with self.lock:
+            with open(self.checkpoint_path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _image_shard(executor, index, paths, image_dir, compress, checkpoint, custody):
+    """Stream one shard over its own channel, writing and hashing every file; returns the bytes received"""
+    cmd = 'cd / && tar -c{}f - '.format('z' if compress else '') + \
+          ' '.join(shlex.quote(path.lstrip('/')) for path in paths)
+    files_dir = os.path.join(image_dir, 'files')
+    entries = []
+    missing = set(os.path.normpath(path).lstrip('/') for path in paths)
+    with executor.stream(cmd) as reader:
+        with tarfile.open(fileobj=reader, mode='r|gz' if compress else 'r|') as tar:
+            for member in tar:
+                if not member.isfile() and not member.islnk():
+                    continue
+                name = os.path.normpath(member.name).lstrip('/')
+                if name.startswith('..'):
+                    warning("Skipping tar member outside the root: {}".format(member.name))
+                    continue
+                local_path = os.path.join(files_dir, name)
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                hasher = custody.hasher(member.size) if custody else StreamHasher(())
+                if member.islnk():
+                    # A hard link to a file earlier in the shard carries no data
+                    with open(os.path.join(files_dir, os.path.normpath(member.linkname).lstrip('/')), 'rb') as f:
+                        size = os.fstat(f.fileno()).st_size
+                        receive_file(f, size, local_path, hasher, keep=False)
+                else:
+                    size = member.size
+                    receive_file(tar.extractfile(member), size, local_path, hasher, keep=False)
+                if hasher.size < size:
+                    raise CommandError("{} was cut short".format(name))
+                missing.discard(name)
+                if custody:
+                    entries.append(custody.entry('/' + name, local_path, hasher, image_dir))
+        stderr = reader.channel.makefile_stderr('rb').read().decode('utf-8', 'replace').splitlines()
+        for line in stderr:
+            warning("tar: {}".format(line))
+        exit_status = reader.channel.recv_exit_status()
+        received = reader.bytes
+    # Only a shard holding every planned file is checkpointed
+    if exit_status != 0:
+        raise CommandError("tar exited with status {}{}".format(exit_status, ': ' + stderr[-1] if stderr else ''))
+    if missing:
+        raise CommandError("{} planned files were not received, e.g. /{}".format(len(missing), min(missing)))
+    checkpoint.mark(index, entries)
+    if custody:
+        custody.extend(entries)
+    return received
+
+
+def image_filesystem(executor, root, image_dir, workers=IMAGE_WORKERS, compress=False,
+                     shard_bytes=IMAGE_SHARD_BYTES, custody=None, examiner=None, sign_key=None):
+    """Image every regular file below a remote root into image_dir over concurrent channels
+
+    An image directory that already holds a plan is resumed: the shards
+    recorded in its checkpoint are skipped. With a CustodyManifest every
+    file is hashed as it arrives, and the manifest is sealed in image_dir
+    once the image is complete. Returns a summary of the run.
+    """
+    started = time.time()
+    checkpoint = ImageCheckpoint(image_dir)
+    shards = checkpoint.load_plan(root, compress)
+    resumed = shards is not None
+    if not resumed:
+        with PROFILER.stage('plan', root):
+            shards = plan_shards(remote_find(executor, root), shard_bytes)
+        checkpoint.save_plan(root, compress, shards)
+    done = checkpoint.finished()
+    if custody:
+        custody.command('find {} (listing of plan.json)'.format(root))
+        custody.command('tar -c{}f of the {} shards of plan.json'.format('z' if compress else '', len(shards)))
+        for entries in done.values():
+            custody.extend(entries)
+    pending = [index for index in range(len(shards)) if index not in done]
+    logg("Imaging {}: {} shards, {} already done".format(root, len(shards), len(done)))
+
+    received = 0
+    failed = OrderedDict()
+
+    def run_shard(index):
+        last_error = None
+        for attempt in range(IMAGE_SHARD_RETRIES + 1):
+            try:
+                with PROFILER.thread():
+                    return _image_shard(executor, index, shards[index], image_dir, compress, checkpoint, custody)
+            except Exception as err:
+                warning("Shard {} of {} failed (attempt {}/{}) - {}".format(
+                    index, root, attempt + 1, IMAGE_SHARD_RETRIES + 1, err))
+                last_error = err
+        raise last_error
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = OrderedDict((index, pool.submit(run_shard, index)) for index in pending)
+        for index, future in futures.items():
+            try:
+                received += future.result()
+            except Exception as err:
+                failed[str(index)] = str(err)
+
+    elapsed = time.time() - started
+    summary = OrderedDict([
+        ('root', root),
+        ('image_dir', image_dir),
+        ('resumed', resumed),
+        ('shards', len(shards)),
+        ('shards_done', len(shards) - len(failed)),
+        ('files', sum(len(shard) for shard in shards)),
+        ('bytes_received', received),
+        ('seconds', round(elapsed, 3)),
+        ('throughput_mb_s', round(received / elapsed / 1e6, 3) if elapsed else None),
+        ('failed_shards', failed),
+        ('complete', not failed),
+        ('manifest', None),
+    ])
+    if not failed:
+        if custody:
+            peer = '{}:{}'.format(*executor.transport.getpeername()[:2])
+            summary['manifest'] = custody.seal(image_dir, device_id(executor), peer, examiner, sign_key)
+        logg("Image of {} complete in {}".format(root, image_dir))
+    else:
+        error("{} shards of {} failed; run the same command again to resume".format(len(failed), root))
+    return summary
+
+
+def _glob_regex(pattern):
+    """Translate a shell glob on remote paths into a regex where * stops at /"""
+    return re.compile(''.join('[^/]*' if char == '*' else '[^/]' if char == '?' else re.escape(char)
+                              for char in pattern) + r'\Z')
+
+
+def _evidence_root(names):
+    """Return the prefix under which an evidence container keeps the remote tree, or None"""
+    for name in names:
+        for path in EVIDENCE_MARKERS:
+            path = path.lstrip('/')
+            if name == path or name.endswith('/' + path):
+                return name[:len(name) - len(path)]
+    return None
+
+
+class EvidenceDirectory(object):
+    """Saved acquisition or image directory, read by remote path"""
+
+    def __init__(self, path):
+        self.path = path
+        prefix = None
+        # Acquisitions keep the tree at the top, images below files/; fall back to searching for it
+        for candidate in ('', 'files'):
+            if self._known(candidate):
+                prefix = candidate
+                break
+        else:
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                prefix = _evidence_root(os.path.relpath(os.path.join(root, name), path).replace(os.sep, '/')
+                                        for name in files)
+                if prefix is not None:
+                    break
+        if prefix is None:
+            raise CommandError("No Apple TV evidence found in {}".format(path))
+        self.root = os.path.join(path, prefix)
+
+    def _known(self, candidate):
+        return [path.lstrip('/') for path in EVIDENCE_MARKERS
+                if os.path.isfile(os.path.join(self.path, candidate, path.lstrip('/')))]
+
+    def local(self, remote_path):
+        return os.path.join(self.root, remote_path.lstrip('/'))
+
+    def read(self, remote_path):
+        with open(self.local(remote_path), 'rb') as f:
+            return f.read()
+
+    def stat(self, remote_path):
+        try:
+            st = os.stat(self.local(remote_path))
+        except OSError:
+            return None
+        return st.st_size, int(st.st_mtime), st.st_ino, int(st.st_ctime)
+
+    def listdir(self, remote_dir):
+        try:
+            return sorted(os.listdir(self.local(remote_dir)))
+        except OSError:
+            return []
+
+    def glob(self, pattern):
+        root = self.root.rstrip(os.sep)
+        return sorted('/' + os.path.relpath(path, root).replace(os.sep, '/')
+                      for path in glob.glob(self.local(pattern)))
+
+    def close(self):
+        pass
+
+
+class EvidenceTarball(object):
+    """Saved acquisition packed in a (compressed) tarball, read by remote path without extracting it"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tar = tarfile.open(path, 'r:*')
+        self.lock = threading.Lock()
+        members = dict((os.path.normpath(member.name).lstrip('/'), member)
+                       for member in self.tar.getmembers() if member.isfile())
+        prefix = _evidence_root(members)
+        if prefix is None:
+            self.tar.close()
+            raise CommandError("No Apple TV evidence found in {}".format(path))
+        self.members = dict(('/' + name[len(prefix):], member)
+                            for name, member in members.items() if name.startswith(prefix))
+
+    def read(self, remote_path):
+        member = self.members.get(remote_path)
+        if member is None:
+            raise IOError("{} is not in {}".format(remote_path, self.path))
+        with self.lock:
+            return self.tar.extractfile(member).read()
+
+    def stat(self, remote_path):
+        member = self.members.get(remote_path)
+        if member is None:
+            return None
+        # A tarball has no inodes nor ctimes: the offset of a member identifies it
+        return member.size, int(member.mtime), member.offset, int(member.mtime)
+
+    def listdir(self, remote_dir):
+        prefix = remote_dir.rstrip('/') + '/'
+        return sorted(set(path[len(prefix):].split('/', 1)[0] for path in self.members if path.startswith(prefix)))
+
+    def glob(self, pattern):
+        regex = _glob_regex(pattern)
+        return sorted(path for path in self.members if regex.match(path))
+
+    def close(self):
+        self.tar.close()
+
+
+def open_evidence(path):
+    """Open a saved acquisition directory or tarball"""
+    if os.path.isdir(path):
+        return EvidenceDirectory(path)
+    return EvidenceTarball(path)
+
+
+class EvidenceChannel(object):
+    """Finished command of an EvidenceExecutor, with the channel methods callers of stream() use"""
+
+    def __init__(self, result):
+        self.result = result
+        self.exit_status = result.exit_status
+
+    def exit_status_ready(self):
+        return True
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def makefile_stderr(self, mode='rb'):
+        return io.BytesIO(self.result.stderr)
+
+
+class EvidenceTransport(object):
+    """Stand in for the transport of an EvidenceExecutor; the evidence path is its identity"""
+
+    def __init__(self, evidence):
+        self.evidence = evidence
+        self.host_key = AgentHostKey('evidence', os.path.abspath(evidence.path).encode('utf-8'))
+
+    def getpeername(self):
+        return (os.path.basename(os.path.normpath(self.evidence.path)), 0)
+
+    def get_remote_server_key(self):
+        return self.host_key
+
+
+class EvidenceExecutor(object):
+    """Offline backend answering the commands of the extractors from saved evidence
+
+    Has the interface of CommandExecutor, so every extractor runs unchanged
+    over an acquisition directory, an image directory or a tarball of one.
+    plutil, otctl, the app inventory, batches of them and stat are answered
+    from the saved files; any other command fails as it cannot be answered
+    offline.
+    """
+
+    PLUTIL = re.compile(r'^plutil -showjson (.+)$', re.S)
+    SOURCE_FRAME = re.compile(re.escape('echo "{} BEGIN source '.format(FRAME_MARKER))
+                              + r'(\S+)"; (.*?) 2>&1; rc=\$\?; ', re.S)
+    STAT = re.compile(r"^if stat -c %s / >/dev/null 2>&1; then stat -c '%s %Y( %i %Z)? %n' (.*?); else ", re.S)
+
+    def __init__(self, evidence):
+        self.evidence = open_evidence(evidence) if isinstance(evidence, str) else evidence
+        self.transport = EvidenceTransport(self.evidence)
+        self.inventory_cmd = build_inventory_cmd()
+
+    def submit(self, cmd, timeout=None):
+        future = Future()
+        try:
+            future.set_result(self.run(cmd, timeout))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+    def run(self, cmd, timeout=None):
+        started = time.time()
+        result = self._exec(cmd)
+        PROFILER.command(cmd, 0.0, time.time() - started, len(result.stdout), result.exit_status)
+        return result
+
+    @contextlib.contextmanager
+    def stream(self, cmd, timeout=None):
+        result = self.run(cmd, timeout)
+        yield CountingReader(io.BytesIO(result.stdout), EvidenceChannel(result))
+
+    def close(self):
+        self.evidence.close()
+
+    def acquired_time(self):
+        """Return the Unix time the saved otctl output was written, or None"""
+        stats = self.evidence.stat('/' + OTCTL_EVIDENCE)
+        return stats[1] if stats is not None else None
+
+    def _exec(self, cmd):
+        info("Answering from evidence: {}".format(cmd))
+        if cmd == OTCTL_STATUS:
+            return self._read(cmd, '/' + OTCTL_EVIDENCE, lambda data: data)
+        if cmd == self.inventory_cmd:
+            return CommandResult(cmd, self._inventory().encode('utf-8'), b'', 0)
+        if self.SOURCE_FRAME.match(cmd):
+            return CommandResult(cmd, self._batch(cmd).encode('utf-8'), b'', 0)
+        match = self.PLUTIL.match(cmd)
+        if match:
+            return self._read(cmd, shlex.split(match.group(1))[0], self._plutil)
+        match = self.STAT.match(cmd)
+        if match:
+            count = 4 if match.group(1) else 2
+            lines = []
+            for operand in shlex.split(match.group(2)):
+                for path in self.evidence.glob(operand) if '*' in operand else [operand]:
+                    stats = self.evidence.stat(path)
+                    if stats is not None:
+                        lines.append(' '.join(str(field) for field in stats[:count] + (path,)) + '\n')
+            return CommandResult(cmd, ''.join(lines).encode('utf-8'), b'', 0)
+        return CommandResult(cmd, b'', "{}: not available in offline evidence\n".format(cmd).encode('utf-8'), 127)
+
+    def _read(self, cmd, path, convert):
+        try:
+            return CommandResult(cmd, convert(self.evidence.read(path)), b'', 0)
+        except (IOError, OSError) as err:
+            return CommandResult(cmd, "{}: file does not exist or is not readable\n".format(path).encode(),
+                                 str(err).encode('utf-8'), 1)
+
+    @staticmethod
+    def _plutil(data):
+        return json.dumps(parse_plist(data)).encode('utf-8')
+
+    def _batch(self, cmd):
+        """Frame the answer to every source of a build_batch_cmd command, and the inventory it ends with"""
+        frames = []
+        for name, source in self.SOURCE_FRAME.findall(cmd):
+            result = self._exec(source)
+            body = result.stdout if result.exit_status == 0 else result.stdout + result.stderr
+            frames.append("{} BEGIN source {}\n{}\n{} END {}\n".format(
+                FRAME_MARKER, name, body.decode('utf-8', 'replace'), FRAME_MARKER, result.exit_status))
+        if cmd.endswith(self.inventory_cmd):
+            frames.append(self._inventory())
+        return ''.join(frames)
+
+    def _inventory(self):
+        """Frame the app metadata plists as the inventory command of build_inventory_cmd does"""
+        frames = []
+        for kind, (root, plist) in APP_INVENTORY_ROOTS.items():
+            for name in self.evidence.listdir(root):
+                frames.append("{} BEGIN {} {}\n".format(FRAME_MARKER, kind, name))
+                path = '{}/{}/{}'.format(root, name, plist)
+                try:
+                    body, rc = self._plutil(self.evidence.read(path)).decode('utf-8'), 0
+                except (IOError, OSError):
+                    body, rc = "{}: file does not exist or is not readable".format(path), 1
+                except Exception as err:
+                    body, rc = "{}: {}".format(path, err), 1
+                frames.append("{}\n{} END {}\n".format(body, FRAME_MARKER, rc))
+        return ''.join(frames)
+
+
+def ssh_connect(host, port=DEFAULT_SSH_PORT, username=DEFAULT_USERNAME, password=None,
+                key_filename=None, strict_host_keys=False, timeout=COMMAND_TIMEOUT):
+    """Open an SSH connection without prompting"""
+    from paramiko.client import SSHClient as SSH_Client, \
+        RejectPolicy as SSH_RejectPolicy, \
+        WarningPolicy as SSH_WarningPolicy
+    r = SSH_Client()
+    r.load_system_host_keys()
+    r.set_missing_host_key_policy(SSH_RejectPolicy() if strict_host_keys else SSH_WarningPolicy())
+    logg("Trying to open SSH connection to {}:{}".format(host, port))
+    r.connect(host, port=port, username=username, password=password, key_filename=key_filename,
+              timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
+    logg("SSH connection to {}:{} opened successfully.".format(host, port))
+    return r
+
+
+def _send_frame(sock, kind, payload=b''):
+    """Send one agent frame: a one letter kind, the payload length and the payload"""
+    sock.sendall(struct.pack('!cI', kind, len(payload)) + payload)
+
+
+def _parse_frames(buffer):
+    """Yield the complete (kind, payload) frames at the start of buffer and drop them from it"""
+    while len(buffer) >= 5:
+        kind, length = struct.unpack('!cI', bytes(buffer[:5]))
+        if len(buffer) < 5 + length:
+            break
+        payload = bytes(buffer[5:5 + length])
+        del buffer[:5 + length]
+        yield kind, payload
+
+
+def _agent_request(socket_path, request, timeout=None):
+    """Connect to the agent and send it one request; return the socket to read the reply from"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def _agent_call(socket_path, request, timeout=None):
+    """Send a request to the agent and return the payload of its reply frame"""
+    sock = _agent_request(socket_path, request, timeout)
+    buffer = bytearray()
+    try:
+        while True:
+            for kind, payload in _parse_frames(buffer):
+                if kind == b'r':
+                    raise CommandError(payload.decode('utf-8', 'replace'))
+                return json.loads(payload.decode('utf-8'))
+            data = sock.recv(CHANNEL_CHUNK_SIZE)
+            if not data:
+                raise CommandError("The agent closed the connection without replying")
+            buffer.extend(data)
+    finally:
+        sock.close()
+
+
+class AgentSession(object):
+    """Authenticated SSH connection to one device, owned by the agent"""
+
+    def __init__(self, target):
+        self.target = target
+        self.client = None
+        self.lock = threading.Lock()
+        self.connected = None
+        self.last_used = time.time()
+        self.commands = 0
+        self.reconnects = 0
+
+    def update(self, target):
+        """Take the latest credentials, dropping the connection if they changed"""
+        with self.lock:
+            if target != self.target:
+                self.target = target
+                self._drop()
+
+    def active(self):
+        return self.client is not None and self.client.get_transport() is not None \
+            and self.client.get_transport().is_active()
+
+    def transport(self):
+        """Return a live transport, reconnecting if the device dropped"""
+        from paramiko.ssh_exception import \
+            BadHostKeyException as SSH_BadHostKeyException, \
+            AuthenticationException as SSH_AuthenticationException
+        with self.lock:
+            self.last_used = time.time()
+            if self.active():
+                return self.client.get_transport()
+            for attempt in range(AGENT_RECONNECT_ATTEMPTS):
+                self._drop()
+                try:
+                    target = self.target
+                    self.client = ssh_connect(target['host'], target['port'], target['username'],
+                                              target['password'], target['key_filename'],
+                                              target['strict_host_keys'], target['timeout'])
+                except (SSH_AuthenticationException, SSH_BadHostKeyException):
+                    raise
+                except Exception as err:
+                    warning("Connecting to {}:{} failed (attempt {}/{}) - {}".format(
+                        self.target['host'], self.target['port'], attempt + 1, AGENT_RECONNECT_ATTEMPTS, err))
+                    if attempt + 1 == AGENT_RECONNECT_ATTEMPTS:
+                        raise
+                    time.sleep(2 ** attempt)
+                    continue
+                self.client.get_transport().set_keepalive(AGENT_KEEPALIVE)
+                if self.connected is not None:
+                    self.reconnects += 1
+                self.connected = time.time()
+                return self.client.get_transport()
+
+    def _drop(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def close(self):
+        with self.lock:
+            self._drop()
+
+    def describe(self):
+        return OrderedDict([
+            ('host', self.target['host']),
+            ('port', self.target['port']),
+            ('username', self.target['username']),
+            ('connected', self.active()),
+            ('since', dt.utcfromtimestamp(self.connected).isoformat() + 'Z' if self.connected else None),
+            ('commands', self.commands),
+            ('reconnects', self.reconnects),
+            ('idle_seconds', round(time.time() - self.last_used, 1)),
+        ])
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    """Serve one request line of a CLI invocation"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            op = request.get('op')
+            if op == 'connect':
+                session = self.server.session(request['target'])
+                transport = session.transport()
+                key = transport.get_remote_server_key()
+                self.reply({'peername': list(transport.getpeername()[:2]), 'key_type': key.get_name(),
+                            'host_key': base64.b64encode(key.asbytes()).decode('ascii')})
+            elif op == 'exec':
+                self.relay(self.server.session(request['target']), request['cmd'], request.get('timeout'))
+            elif op == 'status':
+                self.reply([session.describe() for session in self.server.sessions_snapshot()])
+            elif op == 'stop':
+                self.reply(True)
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                raise CommandError("Unknown agent request {}".format(op))
+        except (IOError, OSError) as err:
+            debug("Agent client went away - {}".format(err))
+        except Exception as err:
+            error("Agent request failed - {}".format(err))
+            try:
+                _send_frame(self.connection, b'r', str(err).encode('utf-8'))
+            except (IOError, OSError):
+                pass
+
+    def reply(self, value):
+        _send_frame(self.connection, b'j', json.dumps(value).encode('utf-8'))
+
+    def relay(self, session, cmd, timeout):
+        """Run cmd on the device and stream its output frames back to the client
+
+        A command that loses its transport before any output was relayed is
+        retried on a fresh connection, which is safe as acquisitions only read
+        from the device.
+        """
+        from paramiko.ssh_exception import SSHException as SSH_SSHException
+        session.commands += 1
+        acked = relayed = False
+        for attempt in range(AGENT_RECONNECT_ATTEMPTS):
+            transport = session.transport()
+            try:
+                channel = transport.open_session(timeout=timeout)
+            except (SSH_SSHException, EOFError, socket.error) as err:
+                warning("Opening a channel to {} failed, reconnecting - {}".format(session.target['host'], err))
+                session.close()
+                continue
+            try:
+                channel.exec_command(cmd)
+                if not acked:
+                    _send_frame(self.connection, b'a')
+                    acked = True
+                while True:
+                    while channel.recv_ready():
+                        _send_frame(self.connection, b'o', channel.recv(CHANNEL_CHUNK_SIZE))
+                        relayed = True
+                    while channel.recv_stderr_ready():
+                        _send_frame(self.connection, b'e', channel.recv_stderr(CHANNEL_CHUNK_SIZE))
+                        relayed = True
+                    if (channel.eof_received or channel.closed) and channel.exit_status_ready() \
+                            and not channel.recv_ready() and not channel.recv_stderr_ready():
+                        _send_frame(self.connection, b'x', json.dumps(channel.recv_exit_status()).encode())
+                        return
+                    if channel.closed or not transport.is_active():
+                        break
+                    # The client sends nothing after its request, so a readable
+                    # connection means it hung up (e.g. its timeout expired)
+                    if self.connection in select.select([channel, self.connection], [], [], AGENT_KEEPALIVE)[0]:
+                        return
+            finally:
+                channel.close()
+            if relayed:
+                raise CommandError("The connection to {} dropped while running {}".format(
+                    session.target['host'], cmd))
+            warning("The connection to {} dropped, retrying {}".format(session.target['host'], cmd))
+        raise CommandError("The connection to {} kept dropping while running {}".format(
+            session.target['host'], cmd))
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Local agent owning one AgentSession per device"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        directory = os.path.dirname(socket_path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(socket_path):
+            # A previous agent died without cleaning up
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, AgentRequestHandler)
+        os.chmod(socket_path, 0o600)
+        self.socket_path = socket_path
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        self.monitor = threading.Thread(target=self.watch, name='agent-monitor')
+        self.monitor.daemon = True
+        self.monitor.start()
+
+    def session(self, target):
+        key = (target['host'], target['port'], target['username'])
+        with self.sessions_lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = AgentSession(target)
+                return session
+        session.update(target)
+        return session
+
+    def sessions_snapshot(self):
+        with self.sessions_lock:
+            return list(self.sessions.values())
+
+    def watch(self):
+        """Forget idle devices and bring dropped ones back before they are next needed"""
+        while True:
+            time.sleep(AGENT_KEEPALIVE)
+            for session in self.sessions_snapshot():
+                if time.time() - session.last_used > AGENT_IDLE_TIMEOUT:
+                    logg("Closing the idle connection to {}".format(session.target['host']))
+                    session.close()
+                    with self.sessions_lock:
+                        self.sessions.pop((session.target['host'], session.target['port'],
+                                           session.target['username']), None)
+                elif session.connected is not None and not session.active():
+                    try:
+                        last_used = session.last_used
+                        session.transport()
+                        session.last_used = last_used
+                        logg("Reconnected to {}".format(session.target['host']))
+                    except Exception as err:
+                        warning("Reconnecting to {} failed - {}".format(session.target['host'], err))
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        for session in self.sessions_snapshot():
+            session.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class AgentHostKey(object):
+    """Host key of a device connected through the agent"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    def get_name(self):
+        return self.name
+
+    def asbytes(self):
+        return self.data
+
+
+class AgentChannel(object):
+    """One remote command run by the agent, with the parts of the paramiko Channel API CommandExecutor uses"""
+
+    def __init__(self, socket_path, target, timeout=None):
+        self.socket_path = socket_path
+        self.target = target
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = bytearray()
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        self.acked = False
+        self.exited = False
+        self.exit_status = -1
+        self.eof_received = False
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+        if self.sock is not None:
+            self.sock.settimeout(timeout)
+
+    def exec_command(self, cmd):
+        self.sock = _agent_request(self.socket_path, {'op': 'exec', 'target': self.target, 'cmd': cmd,
+                                                      'timeout': self.timeout}, self.timeout)
+        while not self.acked and not self.eof_received:
+            self._pump(True)
+        if not self.acked:
+            self.close()
+            raise CommandError(self.stderr.decode('utf-8', 'replace') or "The agent did not run {}".format(cmd))
+
+    def _pump(self, block):
+        """Sort what the agent sent so far into the buffers, waiting for more data when block is set"""
+        if self.eof_received or (not block and not select.select([self.sock], [], [], 0)[0]):
+            return
+        data = self.sock.recv(CHANNEL_CHUNK_SIZE)
+        if not data:
+            self.eof_received = self.exited = True
+            return
+        self.buffer.extend(data)
+        for kind, payload in _parse_frames(self.buffer):
+            if kind == b'o':
+                self.stdout.extend(payload)
+            elif kind == b'e':
+                self.stderr.extend(payload)
+            elif kind == b'a':
+                self.acked = True
+            elif kind == b'x':
+                self.exit_status = json.loads(payload.decode('utf-8'))
+                self.exited = True
+            elif kind == b'r':
+                self.stderr.extend(payload)
+                self.exited = True
+
+    def recv_ready(self):
+        self._pump(False)
+        return bool(self.stdout)
+
+    def recv_stderr_ready(self):
+        self._pump(False)
+        return bool(self.stderr)
+
+    def recv(self, size):
+        return self._take(self.stdout, size)
+
+    def recv_stderr(self, size):
+        return self._take(self.stderr, size)
+
+    def _take(self, buffer, size):
+        data = bytes(buffer[:size])
+        del buffer[:size]
+        return data
+
+    def exit_status_ready(self):
+        self._pump(False)
+        return self.exited
+
+    def recv_exit_status(self):
+        while not self.exited:
+            self._pump(True)
+        return self.exit_status
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def makefile(self, mode='rb'):
+        return AgentChannelFile(self, 'stdout')
+
+    def makefile_stderr(self, mode='rb'):
+        return AgentChannelFile(self, 'stderr')
+
+    def close(self):
+        self.closed = True
+        if self.sock is not None:
+            self.sock.close()
+
+
+class AgentChannelFile(object):
+    """Blocking reader over the stdout or stderr of an AgentChannel"""
+
+    def __init__(self, channel, stream):
+        self.channel = channel
+        self.stream = stream
+
+    def read(self, size=-1):
+        channel = self.channel
+        buffer = getattr(channel, self.stream)
+        while (size < 0 or len(buffer) < size) and not channel.eof_received:
+            channel._pump(True)
+        return channel._take(buffer, len(buffer) if size < 0 else size)
+
+
+class AgentTransport(object):
+    """Stand in for the paramiko Transport of a device connected through the agent"""
+
+    def __init__(self, socket_path, target, hello):
+        self.socket_path = socket_path
+        self.target = target
+        self.peername = tuple(hello['peername'])
+        self.host_key = AgentHostKey(hello['key_type'], base64.b64decode(hello['host_key']))
+
+    def open_session(self, timeout=None):
+        return AgentChannel(self.socket_path, self.target, timeout)
+
+    def getpeername(self):
+        return self.peername
+
+    def get_remote_server_key(self):
+        return self.host_key
+
+    def is_active(self):
+        return True
+
+
+class AgentSSHClient(object):
+    """Stand in for the SSHClient of a device connected through the agent
+
+    Closing it leaves the connection open in the agent for the next run.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        pass
+
+
+def agent_running(socket_path=AGENT_SOCKET):
+    try:
+        _agent_call(socket_path, {'op': 'status'}, AGENT_START_TIMEOUT)
+        return True
+    except (IOError, OSError, CommandError):
+        return False
+
+
+def start_agent(socket_path=AGENT_SOCKET):
+    """Start the agent in the background unless one already listens on socket_path"""
+    if agent_running(socket_path):
+        return
+    directory = os.path.dirname(socket_path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    logg("Starting the atvGumshoe agent on {}".format(socket_path))
+    with open(os.path.splitext(socket_path)[0] + '.log', 'a') as log_file:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), '--agent-serve', '--agent-socket', socket_path],
+                         stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file, start_new_session=True)
+    deadline = time.time() + AGENT_START_TIMEOUT
+    while time.time() < deadline:
+        if agent_running(socket_path):
+            return
+        time.sleep(0.1)
+    raise CommandError("The agent did not start on {}".format(socket_path))
+
+
+def agent_connect(socket_path, host, port=DEFAULT_SSH_PORT, username=DEFAULT_USERNAME, password=None,
+                  key_filename=None, strict_host_keys=False, timeout=COMMAND_TIMEOUT):
+    """Connect to a device through the agent, which reuses its warm connection if it has one"""
+    start_agent(socket_path)
+    target = OrderedDict([('host', host), ('port', port), ('username', username), ('password', password),
+                          ('key_filename', key_filename), ('strict_host_keys', strict_host_keys),
+                          ('timeout', timeout)])
+    hello = _agent_call(socket_path, {'op': 'connect', 'target': target},
+                        timeout * (AGENT_RECONNECT_ATTEMPTS + 1))
+    logg("Connected to {}:{} through the agent.".format(host, port))
+    return AgentSSHClient(AgentTransport(socket_path, target, hello))
+
+
+def connect_device(host, port=DEFAULT_SSH_PORT, username=DEFAULT_USERNAME, password=None,
+                   key_filename=None, strict_host_keys=False, timeout=COMMAND_TIMEOUT, agent_socket=None):
+    """Open an SSH connection to a device, through the agent when agent_socket is set"""
+    if agent_socket:
+        return agent_connect(agent_socket, host, port, username, password, key_filename, strict_host_keys,
+                             timeout)
+    return ssh_connect(host, port, username, password, key_filename, strict_host_keys, timeout)
+
+
+def run_agent(args):
+    """Run the agent in the foreground until it is stopped"""
+    server = AgentServer(args.agent_socket)
+    logg("atvGumshoe agent listening on {}".format(args.agent_socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def control_agent(args):
+    """Print the devices held by the agent, or stop it"""
+    if not agent_running(args.agent_socket):
+        print("No agent is listening on {}".format(args.agent_socket))
+        return 1
+    if args.agent_stop:
+        _agent_call(args.agent_socket, {'op': 'stop'}, AGENT_START_TIMEOUT)
+        print("Stopped the agent on {}".format(args.agent_socket))
+        return 0
+    sessions = _agent_call(args.agent_socket, {'op': 'status'}, AGENT_START_TIMEOUT)
+    print(tabulate([list(session.values()) for session in sessions],
+                   headers=['Host', 'Port', 'Username', 'Connected', 'Since', 'Commands', 'Reconnects', 'Idle (s)']))
+    return 0
+
+
+def iter_device_rows(sources, device=None):
+    with PROFILER.stage('parse', 'device'):
+        device_info, errors = parse_device_info(sources['otctl'], sources['systemversion'],
+                                                sources['tvsettings'], sources['appstored'])
+    for err in errors:
+        warning(err)
+    yield [device_info[column] for column in SCHEMAS['device']]
+
+
+def iter_peer_rows(sources, device=None):
+    with PROFILER.stage('parse', 'peers'):
+        self_list, trusted_peers_list, excluded_peers_list = parse_trusted_peers(_raise_if_error(sources['otctl']))
+    for relation, peers in (('self', self_list), ('trusted', trusted_peers_list), ('excluded', excluded_peers_list)):
+        for peer in peers:
+            yield [relation] + peer
+
 
-import os
-import os.path
-import json
-import datetime
-import re
-import sys
-import pathlib
-import stat
-from argparse import ArgumentParser
-from datetime import datetime as dt
-from logging import basicConfig as logging_basicConfig, \
-    addLevelName as logging_addLevelName, \
-    getLogger as logging_getLogger, \
-    log as logging_log, \
-    DEBUG   as logging_level_DEBUG, \
-    INFO    as logging_level_INFO, \
-    WARN    as logging_level_WARN, \
-    ERROR   as logging_level_ERROR, \
-    debug   as debug, \
-    info    as info, \
-    warn    as warn, \
-    error   as error
-from paramiko.client import SSHClient as SSH_Client
-from paramiko.ssh_exception import \
-    BadHostKeyException as SSH_BadHostKeyException, \
-    AuthenticationException as SSH_AuthenticationException, \
-    SSHException as SSH_SSHException
-from scp import SCPClient as SCP_Client
-from clint.textui import colored
-from colorama import Fore, Back, Style
-from pyfiglet import Figlet
-from getpass import getpass
-from tabulate import tabulate
+def iter_wifi_rows(sources, device=None):
+    return iter_wifi_info(_records(sources['wifi']))
 
-STATUS = False
 
-FORENSIC_FILES = {
-    'wifi': '/private/var/mobile/Library/SyncedPreferences/com.apple.wifid.plist',
-    'id_cache': '/private/var/mobile/Library/Preferences/com.apple.identityservices.idstatuscache.plist',
-    'location': '/private/var/mobile/Library/SyncedPreferences/com.apple.cloudrecents.CloudRecentsAgent-com.apple.eventkit.locations.plist',
-    'app_ids' : '/private/var/mobile/Library/UserNotificationsServer/Library.plist',
-    'apple_app_info': '/Applications/APPNAME/Info.plist',
-    'other_app_info': '/private/var/containers/Bundle/Application/UUID/iTunesMetadata.plist',
-    'appstored': '/private/var/mobile/Library/Preferences/com.apple.appstored.plist',
-    'tvsettings': '/private/var/mobile/Library/Preferences/com.apple.TVSettings.plist',
-    'systemversion': '/System/Library/CoreServices/SystemVersion.plist'
-}
+def iter_id_rows(sources, device=None):
+    with PROFILER.stage('parse', 'ids'):
+        id_dict = parse_id_info(_raise_if_error(sources['id_cache']))
+    for category, ids in id_dict.items():
+        for apple_id in ids:
+            yield [category, apple_id]
+
+
+def iter_location_rows(sources, device=None):
+    return iter_location_history(_records(sources['location']))
+
+
+def iter_app_rows(sources, device=None):
+    apple_app_list, other_app_list, failures = _raise_if_error(sources['inventory'])
+    for kind, apps in (('apple', apple_app_list), ('other', other_app_list)):
+        for app in apps:
+            yield [kind] + app + [None]
+    for kind, directory, reason in failures:
+        yield [kind, directory, None, None, reason]
+
+
+def iter_timeline_rows(sources, device=None, start=None, end=None):
+    timeline = add_timeline_sources(Timeline(), device, sources)
+    for unix_time, device, source, description in timeline.between(start, end):
+        yield [format_unix_time(unix_time), unix_time, device, source, description]
 
-LOGGING_LEVELS = {
-    'ERROR': {
-        'level': logging_level_ERROR,
-        'name': 'ERROR',
-        'xterm': '31m',
-        '256color': '38;5;196m',
-    },
-    'NORMAL': {
-        'level': 35,
-        'name': 'CAD',
-        'xterm': '37m',
-        '256color': '38;5;255m',
-    },
-    'WARNING': {
-        'level': logging_level_WARN,
-        'name': 'WARNING',
-        'xterm': '33m',
-        '256color': '38;5;227m',
-    },
-    'INFO': {
-        'level': logging_level_INFO,
-        'name': 'INFO',
-        'xterm': '36m',
-        '256color': '38;5;45m',
-    },
-    'DEBUG': {
-        'level': logging_level_DEBUG,
-        'name': 'DEBUG',
-        'xterm': '35m',
-        '256color': '38;5;135m',
-    },
-}
 
 #
-# We allow the log level to be specified on the command-line or in the
-# config by name (string/keyword), but we need to convert these to the
-# numeric value:
+# Extractors are declared as data: the SOURCES they read, the function turning
+# the fetched sources (and the device label) into rows, and the columns of the
+# rows. run_extractors fetches the union of the sources of all the requested
+# extractors once, so an extractor reading sources that are already fetched
+# adds no round trip.
 #
-LOGGING_LEVELS_MAP = {
-    'NORMAL': LOGGING_LEVELS['NORMAL']['level'],
-    'ERROR': logging_level_ERROR,
-    'WARN': logging_level_WARN,
-    'INFO': logging_level_INFO,
-    'DEBUG': logging_level_DEBUG,
-    'normal': LOGGING_LEVELS['NORMAL']['level'],
-    'error': logging_level_ERROR,
-    'warn': logging_level_WARN,
-    'info': logging_level_INFO,
-    'debug': logging_level_DEBUG
-}
+Extractor = namedtuple('Extractor', ['sources', 'rows', 'schema'])
 
+EXTRACTORS = OrderedDict([
+    ('device', Extractor(('otctl', 'systemversion', 'tvsettings', 'appstored'), iter_device_rows,
+                         SCHEMAS['device'])),
+    ('peers', Extractor(('otctl',), iter_peer_rows, SCHEMAS['peers'])),
+    ('wifi', Extractor(('wifi',), iter_wifi_rows, SCHEMAS['wifi'])),
+    ('ids', Extractor(('id_cache',), iter_id_rows, SCHEMAS['ids'])),
+    ('location', Extractor(('location',), iter_location_rows, SCHEMAS['location'])),
+    ('apps', Extractor(('inventory',), iter_app_rows, SCHEMAS['apps'])),
+    ('timeline', Extractor(tuple(TIMELINE_SOURCES), iter_timeline_rows, SCHEMAS['timeline'])),
+])
 
-def logg(msg):
-    """Wrapper function for calling logging.log with our 'NORMAL' level"""
-    logging_log(LOGGING_LEVELS['NORMAL']['level'], msg)
 
+class NDJSONExporter(object):
+    """Write every row as one JSON object per line, tagged with its table"""
 
-def welcome(text):
-    result = Figlet()
-    return colored.cyan(result.renderText(text))
+    extension = '.ndjson'
 
+    def __init__(self, path):
+        self.f = open(path, 'w')
 
-def ssh_login():
-    global STATUS
-    os.system("clear")
-    print(welcome("ATV GUMSHOE"))
-    host = input("Enter the Apple TV IP Address: ") or "192.168.1.151"
-    port = int(input("Enter the Apple TV SSH Port [44]: ") or 44)
-    username = input("Enter the Apple TV username [root]: ") or "root"
-    password = getpass("Enter the Apple TV password [alpine]: ") or "alpine"
+    def write_table(self, table, rows):
+        columns = SCHEMAS[table]
+        for row in rows:
+            record = OrderedDict(zip(columns, row))
+            record['table'] = table
+            self.f.write(json.dumps(record, default=str) + '\n')
 
-    r = SSH_Client()
-    r.load_system_host_keys()
-    logg("Trying to open SSH connection to {}".format(host))
+    def close(self):
+        self.f.close()
+
+
+class CSVExporter(object):
+    """Write one CSV file per table in a directory"""
+
+    extension = ''
+
+    def __init__(self, path):
+        self.directory = path
+        os.makedirs(path, exist_ok=True)
+
+    def write_table(self, table, rows):
+        with open(os.path.join(self.directory, table + '.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(SCHEMAS[table])
+            for row in rows:
+                writer.writerow(row)
+
+    def close(self):
+        pass
+
+
+class SQLiteExporter(object):
+    """Write one SQLite table per extractor"""
+
+    extension = '.sqlite'
+    batch_size = 1000
+
+    def __init__(self, path):
+        # Like the other exporters, overwrite the results of a previous run
+        for stale in (path, path + '-journal'):
+            if os.path.exists(stale):
+                os.remove(stale)
+        self.db = sqlite3.connect(path)
+
+    def write_table(self, table, rows):
+        columns = SCHEMAS[table]
+        self.db.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+            table, ', '.join('{} TEXT'.format(column) for column in columns)))
+        insert = 'INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * len(columns)))
+        batch = []
+        for row in rows:
+            batch.append([None if value is None else str(value) for value in row])
+            if len(batch) >= self.batch_size:
+                self.db.executemany(insert, batch)
+                batch = []
+        if batch:
+            self.db.executemany(insert, batch)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class JSONExporter(object):
+    """Collect every table into one JSON document, written on close"""
+
+    extension = '.json'
+
+    def __init__(self, path, report=None):
+        self.path = path
+        self.report = report if report is not None else {}
+        self.report.setdefault('results', OrderedDict())
+
+    def write_table(self, table, rows):
+        self.report['results'][table] = [OrderedDict(zip(SCHEMAS[table], row)) for row in rows]
+
+    def close(self):
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump(self.report, f, indent=2, default=str)
+        else:
+            print(json.dumps(self.report, indent=2, default=str))
+
+
+class TableRenderer(object):
+    """Print every table with tabulate (this one has to hold a whole table in memory)"""
+
+    extension = '.txt'
+
+    def __init__(self, path=None):
+        self.f = open(path, 'w') if path else sys.stdout
+
+    def write_table(self, table, rows):
+        self.f.write("*** {} ***\n\n".format(table))
+        self.f.write(render_table(list(rows), headers=SCHEMAS[table]) + "\n\n")
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+
+EXPORTERS = OrderedDict([
+    ('json', JSONExporter),
+    ('ndjson', NDJSONExporter),
+    ('csv', CSVExporter),
+    ('sqlite', SQLiteExporter),
+    ('table', TableRenderer),
+])
+
+_END_OF_TABLE = object()
+
+
+def _produce_rows(extractor, sources, device, rows):
+    with PROFILER.thread():
+        _produce_rows_profiled(extractor, sources, device, rows)
+
+
+def _produce_rows_profiled(extractor, sources, device, rows):
+    # Rows are queued in batches to keep the locking cost per row low
     try:
-        r.connect(host, port=port, username=username, password=password)
+        batch = []
+        for row in extractor.rows(sources, device):
+            batch.append(row)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                rows.put(batch)
+                batch = []
+        if batch:
+            rows.put(batch)
+        rows.put(_END_OF_TABLE)
     except Exception as err:
-        logg("SSH connection to {} failed.".format(host))
-        if input("Press any key to go to main menu."):
-            return None
+        rows.put(err)
 
-    logg("SSh connection to {} opened successfully. ".format(host))
-    STATUS = True
 
-    input("Press any key to go to main menu.")
-    return r
+def _drain_rows(rows):
+    rows.wait = 0.0
+    while True:
+        started = time.time()
+        batch = rows.get()
+        rows.wait += time.time() - started
+        if batch is _END_OF_TABLE or isinstance(batch, Exception):
+            rows.finished = True
+        if batch is _END_OF_TABLE:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        for row in batch:
+            yield row
 
 
-def run_cmd(ssh_client, cmd):
-    info("Trying to run the command: {}".format(cmd))
+def run_extractors(executor, names, exporter, cache=None, extractors=EXTRACTORS, sources=None):
+    """Run the named extractors concurrently, streaming their rows to the exporter table by table
+
+    The sources of all the extractors are fetched once beforehand, unless the
+    fetched sources are given. Each extractor then fills a bounded queue from
+    its own thread, so the streamed reads overlap while the rows are written
+    in order at constant memory. Returns the errors keyed by extractor.
+    """
+    if sources is None:
+        sources = fetch_plan(executor, names, cache, extractors)
+    device = executor.transport.getpeername()[0]
+    errors = OrderedDict()
+    queues = OrderedDict((name, queue.Queue(maxsize=EXPORT_QUEUE_SIZE)) for name in names)
+    threads = [threading.Thread(target=_produce_rows, args=(extractors[name], sources, device, rows))
+               for name, rows in queues.items()]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for name, rows in queues.items():
+        started = time.time()
+        try:
+            exporter.write_table(name, _drain_rows(rows))
+            # Only the time spent writing, not the time waiting on the extractor
+            PROFILER.add_stage('render', '{} {}'.format(type(exporter).__name__, name),
+                               time.time() - started - rows.wait)
+        except Exception as err:
+            error("Extractor {} failed - {}".format(name, err))
+            errors[name] = str(err)
+            # The exporter failed: let the producer finish so its thread does not block forever
+            while not getattr(rows, 'finished', False):
+                batch = rows.get()
+                rows.finished = batch is _END_OF_TABLE or isinstance(batch, Exception)
+    return errors
+
+
+def acquire_host(target, args, cache=None, timeline=None, peer_graph=None):
+    """Connect to one device and stream the requested extractors to its result file
+
+    The events and the trust network of the device are merged into the
+    timeline and the peer graph of the run, when given.
+    """
+    with PROFILER.thread():
+        return _acquire_host(target, args, cache, timeline, peer_graph)
+
+
+def _acquire_host(target, args, cache=None, timeline=None, peer_graph=None):
+    host, port, username, password = target
+    started = time.time()
+    report = OrderedDict([
+        ('host', host),
+        ('port', port),
+        ('started', dt.utcfromtimestamp(started).isoformat() + 'Z'),
+        ('extractors', args.extract),
+        ('errors', OrderedDict()),
+    ])
+    exporter, output = _open_exporter("{}_{}".format(host.replace(':', '_'), port), report, args)
+
+    ssh_client = None
+    executor = None
     try:
-        (stdin, stdout, stderr) = ssh_client.exec_command(cmd)
-        return stdout, stderr
-    except:
-        error("Running the command {} failed.".format(cmd))
+        ssh_client = connect_device(host, port, username, password, args.key_file, args.strict_host_keys,
+                                    args.timeout, args.agent_socket if args.agent else None)
+        executor = CommandExecutor(ssh_client, args.concurrency, args.timeout)
+        if args.image:
+            image_dir = args.image_dir or os.path.join(args.output_dir or '.', "image_{}_{}".format(
+                host.replace(':', '_'), port))
+            if args.image_dir and (args.inventory or len(args.host) > 1):
+                # Every device of a fleet resumes its own plan and checkpoint
+                image_dir = os.path.join(args.image_dir, device_id(executor)[:16])
+            try:
+                report['image'] = image_filesystem(executor, args.image, image_dir, args.image_workers,
+                                                   args.image_compress, args.shard_size * 1024 * 1024,
+                                                   CustodyManifest(args.hash, args.hash_workers),
+                                                   args.examiner, args.sign_key)
+            except CommandError as err:
+                error("Imaging {} failed - {}".format(args.image, err))
+                report['errors']['image'] = str(err)
+                return report, output
+            report['errors'].update(('shard {}'.format(index), reason)
+                                    for index, reason in report['image']['failed_shards'].items())
+            return report, output
+        if args.reacquire:
+            report['snapshot'] = reacquire(executor, SnapshotStore(args.snapshot_dir),
+                                           CustodyManifest(args.hash, args.hash_workers), args.examiner, args.sign_key)
+            report['errors'].update(report['snapshot']['errors'])
+            return report, output
+        report['errors'].update(_extract(executor, args, exporter, cache, timeline, peer_graph))
+    except Exception as err:
+        error("Acquisition from {}:{} failed - {}".format(host, port, err))
+        report['errors']['connect'] = str(err)
+    finally:
+        if executor:
+            executor.close()
+        if ssh_client:
+            ssh_client.close()
+        report['elapsed'] = round(time.time() - started, 3)
+        exporter.close()
+    return report, output
 
 
-def get_cfAbsoluteTime(seconds):
-    utc_time = "Not Available"
-    if seconds:
-        cfAbsoluteTime = datetime.datetime.strptime("01-01-2001", "%m-%d-%Y")
-        utc_time = cfAbsoluteTime + datetime.timedelta(seconds=seconds)
-    return utc_time.strftime('%b %d %Y %H:%M:%S')
+def _open_exporter(name, report, args):
+    """Return the exporter of one target or query and its result file"""
+    exporter_class = EXPORTERS[args.format]
+    output = None
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        output = os.path.join(args.output_dir, name + exporter_class.extension)
+    exporter = exporter_class(output, report) if exporter_class is JSONExporter else exporter_class(output)
+    return exporter, output
 
 
-def fix_json(json_data):
-    replacements = {
-        (',{1,}]', ']'),
-        (':}', ':\"\"}'),
-        (':,', ':\"\",')
-    }
+def _extract(executor, args, exporter, cache, timeline=None, peer_graph=None):
+    """Run the requested extractors into the exporter, the events into the timeline, the trust
+    network into the peer graph and the IDs and places into the search index; return the errors"""
+    extractors = OrderedDict(EXTRACTORS)
+    extractors['timeline'] = EXTRACTORS['timeline']._replace(
+        rows=functools.partial(iter_timeline_rows, start=args.start, end=args.end))
+    # The merged timeline, peer graph and search index read their sources from the same fetch as the extractors
+    plan = plan_sources(list(args.extract) + (['timeline'] if timeline is not None else []), extractors)
+    if timeline is not None or peer_graph is not None or args.search_index:
+        plan.setdefault('otctl', 1)
+    if args.search_index:
+        for source in ('id_cache', 'location'):
+            plan[source] = plan.get(source, 0) + 1
+    sources = fetch_sources(executor, plan, cache)
+    errors = run_extractors(executor, args.extract, exporter, cache, extractors, sources)
+    device = device_label(executor, sources.get('otctl'))
+    if timeline is not None:
+        add_timeline_sources(timeline, device, sources)
+    if peer_graph is not None:
+        try:
+            observed = executor.acquired_time() if isinstance(executor, EvidenceExecutor) else None
+            peer_graph.add_context_dump(_raise_if_error(sources['otctl']), device, observed)
+        except Exception as err:
+            warning("Adding the trust network to the peer graph failed - {}".format(err))
+    if args.search_index:
+        index_sources(args.search_index, device, sources)
+    return errors
+
+
+def analyze_evidence(path, name, args):
+    """Run the requested extractors over one saved acquisition; runs in a worker process of the batch
+
+    Returns the report, the result file and, with --merge-timeline and
+    --peer-graph, the timeline and peer graph of the device for the parent
+    process to merge.
+    """
+    with PROFILER.thread():
+        started = time.time()
+        report = OrderedDict([
+            ('evidence', path),
+            ('started', dt.utcfromtimestamp(started).isoformat() + 'Z'),
+            ('extractors', args.extract),
+            ('errors', OrderedDict()),
+        ])
+        exporter, output = _open_exporter(name, report, args)
+        timeline = Timeline() if args.merge_timeline else None
+        peer_graph = PeerGraph() if args.peer_graph else None
+        executor = None
+        try:
+            executor = EvidenceExecutor(path)
+            report['errors'].update(_extract(executor, args, exporter, None, timeline, peer_graph))
+        except Exception as err:
+            error("Analysis of {} failed - {}".format(path, err))
+            report['errors']['evidence'] = str(err)
+        finally:
+            if executor:
+                executor.close()
+            report['elapsed'] = round(time.time() - started, 3)
+            exporter.close()
+        return report, output, timeline, peer_graph
+
+
+def run_offline(args):
+    """Run the extractors over saved acquisitions, one worker process per case; returns the exit status"""
+    paths = args.evidence
+    if (len(paths) > 1 or args.format in ('ndjson', 'csv', 'sqlite')) and not args.output_dir:
+        args.output_dir = 'atvgumshoe_' + dt.utcnow().strftime('%Y%m%d%H%M%S')
+    names = []
+    for path in paths:
+        name = os.path.basename(os.path.normpath(path)).split('.')[0] or 'evidence'
+        # Keep the result files of cases sharing a name apart
+        names.append(name if name not in names else "{}_{}".format(name, len(names)))
+    timeline_path = args.merge_timeline
+    timeline = Timeline() if timeline_path else None
+    peer_graph = PeerGraph(args.peer_graph) if args.peer_graph else None
+
+    summary = []
+    workers = max(1, min(args.processes or os.cpu_count() or 1, len(paths)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(analyze_evidence, path, name, args) for path, name in zip(paths, names)]
+        for path, future in zip(paths, futures):
+            try:
+                report, output, device_timeline, device_graph = future.result()
+            except Exception as err:
+                error("Analysis of {} failed - {}".format(path, err))
+                summary.append([path, "Failed", None, '-'])
+                continue
+            if timeline is not None and device_timeline is not None:
+                timeline.merge(device_timeline)
+            if peer_graph is not None and device_graph is not None:
+                peer_graph.merge(device_graph)
+            status = "Failed" if 'evidence' in report['errors'] else \
+                "Partial" if report['errors'] else "OK"
+            summary.append([path, status, report['elapsed'], output or '-'])
+
+    if args.output_dir:
+        print(tabulate(summary, headers=['Evidence', 'Status', 'Elapsed (s)', 'Result File']))
+    if timeline_path:
+        timeline.save(timeline_path)
+        logg("{} timeline events of {} cases written to {}".format(len(timeline), len(paths), timeline_path))
+    if peer_graph is not None:
+        peer_graph.save()
+        logg("{} peers of {} acquisitions indexed in {}".format(
+            len(peer_graph), len(peer_graph.observations), peer_graph.path))
+    return 0 if all(row[1] == "OK" for row in summary) else 1
+
+
+def parse_target(text, args):
+    """Turn 'host[:port] [username [password]]' into a (host, port, username, password) target"""
+    fields = text.split()
+    host, port = fields[0], args.port
+    if host.count(':') == 1:
+        host, port = host.split(':')
+        port = int(port)
+    username = fields[1] if len(fields) > 1 else args.username
+    password = fields[2] if len(fields) > 2 else args.password
+    return host, port, username, password
 
-    for o,n in replacements:
-        json_data = re.sub(o, n, json_data)
 
-    return json_data
+def read_inventory(path, args):
+    """Read the fleet inventory file, one target per line; blank lines and # comments are ignored"""
+    targets = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                targets.append(parse_target(line, args))
+    return targets
 
-def main():
+
+def run_headless(args):
+    """Acquire from every target without prompts; returns the process exit status"""
+    targets = [parse_target(host, args) for host in args.host]
+    if args.inventory:
+        targets += read_inventory(args.inventory, args)
+    if (len(targets) > 1 or args.format in ('ndjson', 'csv', 'sqlite')) and not args.output_dir:
+        args.output_dir = 'atvgumshoe_' + dt.utcnow().strftime('%Y%m%d%H%M%S')
+    cache = ArtifactCache(enabled=not args.no_cache)
+    timeline_path = args.merge_timeline
+    timeline = Timeline() if timeline_path else None
+    peer_graph = PeerGraph(args.peer_graph) if args.peer_graph else None
+
+    summary = []
+    with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(targets)))) as pool:
+        futures = [pool.submit(acquire_host, target, args, cache, timeline, peer_graph) for target in targets]
+        for future in futures:
+            report, output = future.result()
+            status = "Failed" if 'connect' in report['errors'] else \
+                "Partial" if report['errors'] else "OK"
+            summary.append(["{}:{}".format(report['host'], report['port']), status,
+                            report['elapsed'], output or '-'])
+
+    if args.output_dir:
+        print(tabulate(summary, headers=['Device', 'Status', 'Elapsed (s)', 'Result File']))
+    if timeline_path:
+        timeline.save(timeline_path)
+        logg("{} timeline events of {} devices written to {}".format(len(timeline), len(targets), timeline_path))
+    if peer_graph is not None:
+        peer_graph.save()
+        logg("{} peers of {} acquisitions indexed in {}".format(
+            len(peer_graph), len(peer_graph.observations), peer_graph.path))
+    return 0 if all(row[1] == "OK" for row in summary) else 1
+
+
+def purge_cache(args):
+    """Remove every file of the artifact cache"""
+    removed = ArtifactCache().clear()
+    print("Removed {} files from the artifact cache in {}".format(removed, CACHE_DIR))
+    return 0
+
+
+def check_manifest(args):
+    """Print the result of verifying an evidence manifest"""
+    problems = verify_manifest(args.verify_manifest, args.signer)
+    for problem in problems:
+        error(problem)
+    if not problems:
+        logg("{} and every file it lists verify.".format(args.verify_manifest))
+    return 1 if problems else 0
+
+
+def query_timeline(args):
+    """Print the events of saved timelines between --from and --to"""
+    timeline = Timeline.load(*args.query_timeline)
+    exporter = _open_exporter('timeline', None, args)[0]
+    try:
+        exporter.write_table('timeline', (
+            [format_unix_time(unix_time), unix_time, device, source, description]
+            for unix_time, device, source, description in timeline.between(args.start, args.end)))
+    finally:
+        exporter.close()
+    return 0
+
+
+def query_peers(args):
+    """Print the vouchers of --vouches-for or the peers reachable from --reachable-from in the peer graph"""
+    peer_graph = PeerGraph(args.peer_graph or PEER_GRAPH_PATH)
+    if args.vouches_for:
+        table = 'vouchers'
+        rows = [row[:4] + [format_unix_time(row[4])] + row[5:] for row in peer_graph.vouches_for(args.vouches_for)]
+    else:
+        table = 'reachable'
+        hops = peer_graph.reachable(args.reachable_from)
+        rows = [[peer_id] + peer_graph.peers.get(peer_id, [None, None])[:2] + [hops[peer_id]]
+                for peer_id in sorted(hops, key=lambda peer_id: (hops[peer_id], peer_id))]
+    exporter = _open_exporter(table, None, args)[0]
+    try:
+        exporter.write_table(table, rows)
+    finally:
+        exporter.close()
+    return 0
+
+
+def query_search_index(args):
+    """Print the IDs and places of the search index matching --search"""
+    index = SearchIndex(args.search_index or SEARCH_INDEX_PATH)
+    try:
+        with PROFILER.stage('search', args.search):
+            tables = OrderedDict([
+                ('id_matches', index.search_ids(args.search, args.substring)),
+                ('place_matches', index.search_places(args.search, args.substring)),
+            ])
+    finally:
+        index.close()
+    exporter = _open_exporter('search', None, args)[0]
+    try:
+        for table, rows in tables.items():
+            exporter.write_table(table, rows)
+    finally:
+        exporter.close()
+    return 0
+
+
+def print_profile(args):
+    """Print the profiling summary and write the JSON and cProfile reports asked for on the command line"""
+    if args.profile:
+        sys.stderr.write("\n*** Profile ***\n\n")
+        sys.stderr.write(tabulate(PROFILER.summary(), headers=PROFILE_COLUMNS) + "\n")
+        PROFILER.write(args.profile)
+        sys.stderr.write("\nProfile written to {}\n".format(args.profile))
+    if args.cprofile:
+        PROFILER.dump_cprofile(args.cprofile)
+        sys.stderr.write("cProfile statistics written to {}\n".format(args.cprofile))
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="ATV Gumshoe is an Apple TV Logical Forensic Tool. (For Jailbroken Devices) "
+                                        "Without --host or --inventory the interactive menu is started.")
+    parser.add_argument('--host', action='append', default=[],
+                        help="Apple TV to acquire, as host[:port]. May be repeated.")
+    parser.add_argument('--inventory',
+                        help="Fleet inventory file, one 'host[:port] [username [password]]' per line.")
+    parser.add_argument('--evidence', nargs='+', default=[], metavar='PATH',
+                        help="Run the extractors offline over saved acquisition or image directories, or "
+                             "tarballs of them, instead of a device")
+    parser.add_argument('--processes', type=int,
+                        help="Worker processes of an offline batch, one case per process [CPU count]")
+    parser.add_argument('--port', type=int, default=DEFAULT_SSH_PORT, help="SSH port [%(default)s]")
+    parser.add_argument('--username', default=DEFAULT_USERNAME, help="SSH username [%(default)s]")
+    parser.add_argument('--password', default=os.environ.get('ATVGUMSHOE_PASSWORD', DEFAULT_PASSWORD),
+                        help="SSH password [$ATVGUMSHOE_PASSWORD or alpine]")
+    parser.add_argument('--key-file', help="SSH private key file")
+    parser.add_argument('--strict-host-keys', action='store_true',
+                        help="Refuse devices whose host key is not in the known hosts")
+    parser.add_argument('--extract', default='all',
+                        help="Comma separated extractors among {} or all [%(default)s]".format(
+                            ','.join(EXTRACTORS)))
+    parser.add_argument('--format', default='json', choices=list(EXPORTERS),
+                        help="Format of the per host result files [%(default)s]")
+    parser.add_argument('--output-dir',
+                        help="Directory for the per host result files (json and table are printed "
+                             "to stdout for one host if unset)")
+    parser.add_argument('--workers', type=int, default=FLEET_WORKERS,
+                        help="Devices acquired in parallel [%(default)s]")
+    parser.add_argument('--concurrency', type=int, default=COMMAND_CONCURRENCY,
+                        help="Concurrent commands per device [%(default)s]")
+    parser.add_argument('--timeout', type=int, default=COMMAND_TIMEOUT,
+                        help="Timeout in seconds of every remote command [%(default)s]")
+    parser.add_argument('--no-cache', action='store_true', help="Always read fresh from the devices")
+    parser.add_argument('--purge-cache', action='store_true',
+                        help="Remove every decoded artifact kept in the artifact cache ({}), then exit".format(
+                            CACHE_DIR))
+    parser.add_argument('--from', dest='start', type=parse_time,
+                        help="Only keep timeline events at or after this UTC time (YYYY-MM-DD[THH:MM[:SS]])")
+    parser.add_argument('--to', dest='end', type=parse_time,
+                        help="Only keep timeline events at or before this UTC time (YYYY-MM-DD[THH:MM[:SS]])")
+    parser.add_argument('--merge-timeline', metavar='FILE',
+                        help="Merge the timeline of every acquired device into one time sorted file")
+    parser.add_argument('--query-timeline', metavar='FILE', nargs='+',
+                        help="Query timeline files written by --merge-timeline instead of acquiring")
+    parser.add_argument('--peer-graph', nargs='?', const=PEER_GRAPH_PATH, metavar='FILE',
+                        help="Merge the Octagon trust network of every acquired device into a persistent "
+                             "peer graph [%(const)s]")
+    parser.add_argument('--vouches-for', metavar='SERIAL',
+                        help="List the peers of the peer graph vouching for a serial number or peerID")
+    parser.add_argument('--reachable-from', metavar='SERIAL',
+                        help="List the peers of the peer graph reachable over trust from a serial number or peerID")
+    parser.add_argument('--search-index', nargs='?', const=SEARCH_INDEX_PATH, metavar='FILE',
+                        help="Index the Apple IDs and places of every acquired device in a persistent search "
+                             "store [%(const)s]")
+    parser.add_argument('--search', metavar='TEXT',
+                        help="Find the IDs and places of the search index with words starting with TEXT")
+    parser.add_argument('--substring', action='store_true',
+                        help="Make --search match TEXT anywhere in the IDs, place names and addresses")
+    parser.add_argument('--profile', nargs='?', const='atvgumshoe_profile.json', metavar='FILE',
+                        help="Print a timing summary of every remote command and local stage on exit "
+                             "and write the details as JSON [%(const)s]")
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help="Capture the local side with cProfile and write the pstats to FILE")
+    parser.add_argument('--reacquire', action='store_true',
+                        help="Fetch only the artifacts that changed since the last snapshot of each device and "
+                             "report the new, removed and changed records instead of running the extractors")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR, help="Snapshot store directory [%(default)s]")
+    parser.add_argument('--image', metavar='REMOTE_ROOT',
+                        help="Image every regular file below REMOTE_ROOT (e.g. /private/var/mobile) instead of "
+                             "running the extractors; rerun the same command to resume an interrupted image")
+    parser.add_argument('--image-dir',
+                        help="Image directory [OUTPUT_DIR/image_HOST_PORT]; with --inventory or several --host "
+                             "every device gets its own subdirectory, named after its device ID")
+    parser.add_argument('--image-workers', type=int, default=IMAGE_WORKERS,
+                        help="Shards streamed concurrently, each over its own channel [%(default)s]")
+    parser.add_argument('--image-compress', action='store_true', help="Compress the shards on the wire with gzip")
+    parser.add_argument('--shard-size', type=int, default=IMAGE_SHARD_BYTES // (1024 * 1024),
+                        help="Approximate size of an image shard in MiB [%(default)s]")
+    parser.add_argument('--md5', dest='hash', action='store_const', const=('sha256', 'md5'), default=HASH_ALGORITHMS,
+                        help="Also record the MD5 of every evidence file in the manifest")
+    parser.add_argument('--hash-workers', type=int, default=HASH_WORKERS,
+                        help="Threads hashing large evidence files during the transfer [%(default)s]")
+    parser.add_argument('--examiner', help="Name of the examiner signing off the evidence manifests")
+    parser.add_argument('--sign-key', help="SSH private key signing the evidence manifests")
+    parser.add_argument('--verify-manifest', metavar='MANIFEST',
+                        help="Check an evidence manifest, its signature and the files it lists, then exit")
+    parser.add_argument('--signer', metavar='KEY',
+                        help="With --verify-manifest, fail unless the manifest is signed by this OpenSSH public "
+                             "key file or SHA256: fingerprint")
+    parser.add_argument('--agent', action='store_true',
+                        help="Connect through the persistent agent, starting it if needed, so repeated runs "
+                             "reuse warm SSH sessions and dropped links are reconnected")
+    parser.add_argument('--agent-socket', default=AGENT_SOCKET, help="Unix socket of the agent [%(default)s]")
+    parser.add_argument('--agent-serve', action='store_true', help="Run the agent in the foreground")
+    parser.add_argument('--agent-status', action='store_true', help="List the devices held by the agent")
+    parser.add_argument('--agent-stop', action='store_true', help="Stop the agent")
+    parser.add_argument('--log-level', default='WARN', choices=sorted(LOGGING_LEVELS_MAP),
+                        help="Logging level [%(default)s]")
+    args = parser.parse_args(argv)
+
+    if args.reacquire and args.format != 'json':
+        parser.error("--reacquire reports the deltas in the json format")
+    if args.image and args.format != 'json':
+        parser.error("--image reports its summary in the json format")
+    if args.extract == 'all':
+        args.extract = list(EXTRACTORS)
+    else:
+        args.extract = [name.strip() for name in args.extract.split(',') if name.strip()]
+        unknown = [name for name in args.extract if name not in EXTRACTORS]
+        if unknown:
+            parser.error("unknown extractor(s): {}".format(', '.join(unknown)))
+    return args
+
+
+def main(args=None):
     global STATUS
+    agent_socket = args.agent_socket if args is not None and args.agent else None
+    hash_algorithms = args.hash if args is not None else HASH_ALGORITHMS
+    sign_key = args.sign_key if args is not None else None
+    examiner = args.examiner if args is not None else None
     ssh_client = ''
-    plutil_json = 'plutil -showjson '
-    ls = 'ls '
+    executor = None
+    # (host, port) of the connected device, read once when it connects
+    connected_to = None
+    cache = ArtifactCache()
+    cold_start = True
     while True:
-        os.system("clear")
+        clear_screen()
         print(welcome("ATV GUMSHOE"))
-        print("ATV Gumshoe is an Apple TV Logical Forensic Tool. (For Jailbroken Devices)\n")
-        print("Please select an option ")
-        if STATUS:
-            tv_tuple = ssh_client.get_transport().getpeername()
-            print("\t1 : Connect (Already Connected to {}:{})".format(tv_tuple[0], tv_tuple[1]))
-        else:
-            print("\t1 : Connect")
-        print("""\t2 : Device Info
-        3 : Keychain Trusted Peers
-        4 : User Wifi information
-        5 : User ID information
-        6 : User Location History
-        7 : Installed Applications
-        0 : Exit""")
+        print(render_menu(connected_to if STATUS else None))
+        if cold_start:
+            report_cold_start()
+            cold_start = False
         c = input("\nEnter your choice : ")
 
         if c == '1':
             try:
-                ssh_client = ssh_login()
+                new_client = ssh_login(agent_socket)
+                if new_client:
+                    if executor:
+                        executor.close()
+                    if ssh_client:
+                        ssh_client.close()
+                    ssh_client = new_client
+                    executor = CommandExecutor(ssh_client)
+                    connected_to = tuple(ssh_client.get_transport().getpeername()[:2])
             except Exception as err:
                 print("SSH Connection failed - {}".format(err))
         elif c == '2':
-            os.system("clear")
+            clear_screen()
             print(welcome("ATV GUMSHOE"))
             print("*** Device Information ***\n")
             if STATUS:
                 try:
-                    serial_number = ''
-                    os_version = ''
-                    os_build = ''
-                    hw_model = ''
-                    device_id = ''
-
-                    # Get device Serial Number
-                    try:
-                        cmd = 'otctl status -j'
-                        result_out, result_err = run_cmd(ssh_client, cmd)
-                        result_data = json.load(result_out)
-                        serial_number = result_data['contextDump']['self']['stableInfo']['serial_number']
-                    except Exception as err:
-                        print("Getting Device Serial Number Failed - {}".format(err))
-
-                    # Get OS Version
-                    try:
-                        cmd = plutil_json + FORENSIC_FILES['systemversion']
-                        result_out, result_err = run_cmd(ssh_client, cmd)
-                        result_out_utf8 = fix_json(result_out.read().decode("utf-8"))
-                        result_data = json.loads(result_out_utf8)
-                        os_version = result_data['ProductName'] + ' ' \
-                                     + result_data['ProductVersion']
-                        os_build = result_data['ProductBuildVersion']
-                    except Exception as err:
-                        print("Getting OS Version Failed - {}".format(err))
-
-                    # Get HW Model
-                    try:
-                        cmd = plutil_json + FORENSIC_FILES['tvsettings']
-                        result_out, result_err = run_cmd(ssh_client, cmd)
-                        result_out_utf8 = fix_json(result_out.read().decode("utf-8"))
-                        result_data = json.loads(result_out_utf8)
-                        hw_model = result_data['SSDeviceType']['hardwareModel']
-                    except Exception as err:
-                        print("Getting HW Model Failed - {}".format(err))
-
-                    # Get Device ID
-                    try:
-                        cmd = plutil_json + FORENSIC_FILES['appstored']
-                        result_out, result_err = run_cmd(ssh_client, cmd)
-                        result_out_utf8 = fix_json(result_out.read().decode("utf-8"))
-                        result_data = json.loads(result_out_utf8)
-                        device_id = result_data['ArcadeDeviceGUID']
-                    except Exception as err:
-                        print("Getting Device ID Failed - {}".format(err))
+                    device_info, errors = get_device_info(executor, cache)
+                    for err in errors:
+                        print(err)
 
-                    print('Serial Number: {}'.format(serial_number))
-                    print('HW Model: {}'.format(hw_model))
-                    print('OS Version: {}'.format(os_version))
-                    print('OS Built: {}'.format(os_build))
-                    print('Device ID: {}'.format(device_id))
+                    print('Serial Number: {}'.format(device_info['serial_number']))
+                    print('HW Model: {}'.format(device_info['hw_model']))
+                    print('OS Version: {}'.format(device_info['os_version']))
+                    print('OS Built: {}'.format(device_info['os_build']))
+                    print('Device ID: {}'.format(device_info['device_id']))
 
                 except Exception as err:
                     print("Getting Device Info Failed - {}".format(err))
@@ -277,42 +4485,22 @@ def main():
                 input("Press any key to go to main menu.")
                 continue
         elif c == '3':
-            os.system("clear")
+            clear_screen()
             print(welcome("ATV GUMSHOE"))
             print("*** Keychain Trusted Peers ***\n")
             print("Data source: Octagon Trust utility - otctl\n")
             if STATUS:
                 try:
-                    cmd = 'otctl status -j'
-                    result_out, result_err = run_cmd(ssh_client, cmd)
-                    result_data = json.load(result_out)
-                    trusted_peers = result_data['contextDump']['self']['dynamicInfo']['included']
-                    excluded_peers = result_data['contextDump']['self']['dynamicInfo']['excluded']
-                    trusted_peers_list = []
-                    excluded_peers_list = []
-                    self_list = []
-                    for peer in result_data['contextDump']['peers']:
-                        if peer['peerID'] in trusted_peers:
-                            trusted_peers_list.append([peer['peerID'],
-                                                       peer['stableInfo']['serial_number'],
-                                                       peer['permanentInfo']['model_id'],
-                                                       peer['stableInfo']['os_version']])
-                        elif peer['peerID'] in excluded_peers:
-                            excluded_peers_list.append([peer['peerID'],
-                                                        peer['stableInfo']['serial_number'],
-                                                        peer['permanentInfo']['model_id'],
-                                                        peer['stableInfo']['os_version']])
-                    self_list.append([result_data['contextDump']['self']['peerID'],
-                                      result_data['contextDump']['self']['stableInfo']['serial_number'],
-                                      result_data['contextDump']['self']['permanentInfo']['model_id'],
-                                      result_data['contextDump']['self']['stableInfo']['os_version']])
+                    result_data = _raise_if_error(fetch_plan(executor, ['peers'], cache)['otctl'])
+                    with PROFILER.stage('parse', 'peers'):
+                        self_list, trusted_peers_list, excluded_peers_list = parse_trusted_peers(result_data)
                     print("\nDevice Trust Network collected from the Octagon Trust utility - otctl:\n")
                     print("Device Self Information:")
-                    print(tabulate(self_list, headers=['ID', 'SN', 'Model', 'OS Version']))
+                    print(render_table(self_list, headers=['ID', 'SN', 'Model', 'OS Version']))
                     print("\nTrusted peers:")
-                    print(tabulate(trusted_peers_list, headers=['Peer ID', 'SN', 'Model', 'OS Version']))
+                    print(render_table(trusted_peers_list, headers=['Peer ID', 'SN', 'Model', 'OS Version']))
                     print("\nExcluded peers:")
-                    print(tabulate(excluded_peers_list, headers=['Peer ID', 'SN', 'Model', 'OS Version']))
+                    print(render_table(excluded_peers_list, headers=['Peer ID', 'SN', 'Model', 'OS Version']))
                 except Exception as err:
                     print("Getting Keychain Trusted Peers Failed - {}".format(err))
                 input("\nPress any key to go to main menu.")
@@ -322,32 +4510,17 @@ def main():
                 input("Press any key to go to main menu.")
                 continue
         elif c == '4':
-            os.system("clear")
+            clear_screen()
             print(welcome("ATV GUMSHOE"))
             print("*** User Wifi information ***\n")
             print("Data source file: " + FORENSIC_FILES['wifi'] + '\n')
             if STATUS:
                 try:
-                    wifi_dict = {}
-                    cmd = plutil_json + FORENSIC_FILES['wifi']
-                    result_out, result_err = run_cmd(ssh_client, cmd)
-                    result_out_utf8 = fix_json(result_out.read().decode("utf-8"))
-                    result_data = json.loads(result_out_utf8)
-                    for ssid in result_data['values']:
-                        wifi_dict[ssid] = [
-                            result_data['values'][ssid]['value'].get('added_by', "Not Available"),
-                            result_data['values'][ssid]['value'].get('added_by_os_ver', "Not Available"),
-                            result_data['values'][ssid]['value'].get('added_at',
-                                                                     get_cfAbsoluteTime(
-                                                                         result_data['values'][ssid].get("timestamp", None))
-                                                                     + ' (Estimate)'
-                                                                     )
-                        ]
-
+                    wifi_dict = get_wifi_info(executor, cache)
                     headers = ["SSID", "ADDED BY", "OS VERSION", "ADDED AT (UTC)"]
                     #print(tabulate([[k,] + v for k,v in sorted(wifi_dict.items(), key=lambda i:i[1][2]) ],headers = headers))
                     print(
-                        tabulate([[k, ] + v for k, v in wifi_dict.items()], headers=headers))
+                        render_table([[k, ] + v for k, v in wifi_dict.items()], headers=headers))
                 except Exception as err:
                     print("Getting User Wifi information Failed - {}".format(err))
                 input("\nPress any key to go to main menu.")
@@ -357,41 +4530,22 @@ def main():
                 input("Press any key to go to main menu.")
                 continue
         elif c == '5':
-            os.system("clear")
+            clear_screen()
             print(welcome("ATV GUMSHOE"))
             print("*** User ID information ***\n")
             print("Data source file: " + FORENSIC_FILES['id_cache'] + '\n')
             if STATUS:
                 try:
-                    id_dict = {
-                        'icloud': [],
-                        'fmd': [],
-                        'cloudmessaging': [],
-                        'nearby': [],
-                    }
-                    cmd = plutil_json + FORENSIC_FILES['id_cache']
-                    result_out, result_err = run_cmd(ssh_client, cmd)
-                    #result_out_utf8 = result_out.read().decode("utf-8").replace(":,", ":\"\",")
-                    result_out_utf8 = fix_json(result_out.read().decode("utf-8"))
-                    result_data = json.loads(result_out_utf8)
-                    for record in result_data.keys():
-                        if 'icloudpairing' in record:
-                            id_dict['icloud'] = result_data[record].keys()
-                        elif 'fmd' in record:
-                            id_dict['fmd'] = result_data[record].keys()
-                        elif 'cloudmessaging' in record:
-                            id_dict['cloudmessaging'] = result_data[record].keys()
-                        elif 'nearby' in record:
-                            id_dict['nearby'] = result_data[record].keys()
+                    id_dict = get_id_info(executor, cache)
                     headers = ['Number','ID']
                     print("User Apple ID:")
-                    print(tabulate(zip(range(1,len(id_dict['icloud'])+1),id_dict['icloud']),headers=headers))
+                    print(render_table(zip(range(1,len(id_dict['icloud'])+1),id_dict['icloud']),headers=headers))
                     print("\nUser family member IDS:")
-                    print(tabulate(zip(range(1,len(id_dict['fmd'])+1),id_dict['fmd']),headers=headers))
+                    print(render_table(zip(range(1,len(id_dict['fmd'])+1),id_dict['fmd']),headers=headers))
                     print("\nUser messaging IDs:")
-                    print(tabulate(zip(range(1,len(id_dict['cloudmessaging'])+1),id_dict['cloudmessaging']),headers=headers))
+                    print(render_table(zip(range(1,len(id_dict['cloudmessaging'])+1),id_dict['cloudmessaging']),headers=headers))
                     print("\nUser nearby IDs:")
-                    print(tabulate(zip(range(1,len(id_dict['nearby'])+1),id_dict['nearby']),headers=headers))
+                    print(render_table(zip(range(1,len(id_dict['nearby'])+1),id_dict['nearby']),headers=headers))
                 except Exception as err:
                     print("Getting User ID information Failed - {}".format(err))
                 input("\nPress any key to go to main menu.")
@@ -401,27 +4555,16 @@ def main():
                 input("Press any key to go to main menu.")
                 continue
         elif c == '6':
-            os.system("clear")
+            clear_screen()
             print(welcome("ATV GUMSHOE"))
             print("*** User Location History ***\n")
             print("Data source file: " + FORENSIC_FILES['location'] + '\n')
             if STATUS:
                 try:
-                    location_list = []
-                    cmd = plutil_json + FORENSIC_FILES['location']
-                    result_out, result_err = run_cmd(ssh_client, cmd)
-                    result_out_utf8 = fix_json(result_out.read().decode("utf-8"))
-                    result_data = json.loads(result_out_utf8)
-
-                    for record in result_data['values'].keys():
-                        location_list.append([
-                            result_data['values'][record]['value'].get('n', "Not Available"),
-                            result_data['values'][record]['value'].get('a', "Not Available"),
-                            get_cfAbsoluteTime(result_data['values'][record].get("timestamp", None)),
-                            result_data['values'][record]['value'].get('S', "Not Available"),
-                        ])
+                    location_list = parse_location_history(
+                        _records(fetch_plan(executor, ['location'], cache)['location']))
                     headers = ['Name','Address','Timestamp (UTC)','Source']
-                    print(tabulate(location_list, headers=headers))
+                    print(render_table(location_list, headers=headers))
                 except Exception as err:
                     print("Getting User Location History Failed - {}".format(err))
                 input("\nPress any key to go to main menu.")
@@ -431,68 +4574,224 @@ def main():
                 input("Press any key to go to main menu.")
                 continue
         elif c == '7':
-            os.system("clear")
+            clear_screen()
             print(welcome("ATV GUMSHOE"))
             print("*** Installed Application ***\n")
             if STATUS:
                 try:
-                    apple_app_list = []
-                    other_app_list = []
-
-                    # Get the list of Apple Installed Apps
-                    cmd = ls + FORENSIC_FILES['apple_app_info'].split("/APPNAME/")[0]
-                    apple_result_out, apple_result_err = run_cmd(ssh_client, cmd)
-
-
-                    # Parse the Apple Apps information
-                    for app in apple_result_out.readlines():
-                        cmd = plutil_json + FORENSIC_FILES['apple_app_info'].replace('APPNAME', app.rstrip())
-                        apple_result_out, result_err = run_cmd(ssh_client, cmd)
-                        apple_result_out_utf8 = fix_json(apple_result_out.read().decode("utf-8"))
-                        apple_result_data = json.loads(apple_result_out_utf8)
-                        apple_app_list.append([apple_result_data["CFBundleName"],
-                                               apple_result_data["CFBundleVersion"],
-                                               apple_result_data["CFBundleIdentifier"]])
+                    apple_app_list, other_app_list, failures = get_installed_apps(executor)
 
                     # Print Application Lists
+                    headers = ['App Name','App Version','App Bundle ID']
                     print("** Apple Internal Applications **")
                     print("Data location /Applications/<APPNAME>/Info.plist\n")
-                    headers = ['App Name','App Version','App Bundle ID']
-                    print(tabulate(apple_app_list, headers=headers))
-
-                    # Get the list of Other Installed Apps
-                    cmd = ls + FORENSIC_FILES['other_app_info'].split("/UUID/")[0]
-                    other_result_out, other_result_err = run_cmd(ssh_client, cmd)
-                    # Parse the Other Apps information
-                    for app in other_result_out.readlines():
-                        cmd = plutil_json + FORENSIC_FILES['other_app_info'].replace('UUID', app.rstrip())
-                        other_result_out, other_result_err = run_cmd(ssh_client, cmd)
-                        other_result_out_utf8 = fix_json(other_result_out.read().decode("utf-8"))
-                        other_result_data = json.loads(other_result_out_utf8)
-                        other_app_list.append([other_result_data["itemName"],
-                                               other_result_data["bundleVersion"],
-                                               other_result_data["softwareVersionBundleId"]])
+                    print(render_table(apple_app_list, headers=headers))
 
                     print("\n\n** User Installed Applications **")
                     print("Data location /private/var/containers/Bundle/Application/<APP UUID>/iTunesMetadata.plist\n")
-                    print(tabulate(other_app_list, headers=headers))
+                    print(render_table(other_app_list, headers=headers))
+
+                    if failures:
+                        print("\n\n** Applications that could not be parsed **\n")
+                        print(render_table(failures, headers=['Type', 'Directory', 'Error']))
 
                 except Exception as err:
-                    print("Getting User Location History Failed - {}".format(err))
+                    print("Getting Installed Applications Failed - {}".format(err))
+                input("\nPress any key to go to main menu.")
+                continue
+            else:
+                error("No device connected.")
+                input("Press any key to go to main menu.")
+                continue
+        elif c == '8':
+            clear_screen()
+            print(welcome("ATV GUMSHOE"))
+            print("*** Acquire Artifacts ***\n")
+            if STATUS:
+                try:
+                    default_dir = "evidence_{}_{}".format(connected_to[0],
+                                                          dt.utcnow().strftime('%Y%m%d%H%M%S'))
+                    evidence_dir = input("Enter the evidence directory [{}]: ".format(default_dir)) or default_dir
+                    include_apps = input("Include application metadata plists [y/N]: ").lower().startswith('y')
+                    examiner = input("Examiner signing off the manifest [{}]: ".format(examiner or '')) or examiner
+                    custody = CustodyManifest(hash_algorithms)
+                    artifacts, missing = acquire_artifacts(executor, evidence_dir, include_apps, custody)
+                    manifest = custody.seal(evidence_dir, device_id(executor),
+                                            '{}:{}'.format(*connected_to),
+                                            examiner, sign_key)
+                    parsed = parse_artifacts(artifacts)
+
+                    hashes = dict((entry['remote_path'], entry['sha256']) for entry in custody.files)
+                    artifact_list = []
+                    for path in sorted(artifacts):
+                        status = "OK"
+                        if isinstance(parsed[path], Exception):
+                            status = "Parsing failed - {}".format(parsed[path])
+                        artifact_list.append([path, len(artifacts[path]), hashes.get(path), status])
+                    for path in missing:
+                        artifact_list.append([path, 0, None, "Not found"])
+                    print("Evidence directory: {}".format(os.path.abspath(evidence_dir)))
+                    print("Manifest: {}\n".format(os.path.abspath(manifest)))
+                    print(render_table(artifact_list, headers=['Remote Path', 'Size', 'SHA-256', 'Status']))
+                except Exception as err:
+                    print("Acquiring Artifacts Failed - {}".format(err))
+                input("\nPress any key to go to main menu.")
+                continue
+            else:
+                error("No device connected.")
+                input("Press any key to go to main menu.")
+                continue
+        elif c == '9':
+            clear_screen()
+            print(welcome("ATV GUMSHOE"))
+            print("*** Artifact Cache ***\n")
+            print("Cache directory: {}\n".format(cache.directory))
+            print(render_table(sorted(cache.stats().items()), headers=['Counter', 'Value']))
+            print("\n\te : Enable the cache")
+            print("\td : Disable the cache (always read fresh from the device)")
+            print("\tc : Clear the cache")
+            choice = input("\nEnter your choice [keep current settings]: ").lower()
+            if choice == 'e':
+                cache.enabled = True
+            elif choice == 'd':
+                cache.enabled = False
+            elif choice == 'c':
+                cache.clear()
+            continue
+        elif c == '10':
+            clear_screen()
+            print(welcome("ATV GUMSHOE"))
+            print("*** Timeline ***\n")
+            print("Data sources: " + ', '.join(FORENSIC_FILES[source] for source in TIMELINE_SOURCES) + '\n')
+            if STATUS:
+                try:
+                    start = input("From (UTC, YYYY-MM-DD[THH:MM[:SS]]) [beginning]: ")
+                    end = input("To (UTC, YYYY-MM-DD[THH:MM[:SS]]) [now]: ")
+                    start = parse_time(start) if start else None
+                    end = parse_time(end) if end else None
+                    timeline = build_timeline(executor, cache)
+                    event_list = [[format_unix_time(unix_time), source, description]
+                                  for unix_time, device, source, description in timeline.between(start, end)]
+                    print("\n{} of {} events\n".format(len(event_list), len(timeline)))
+                    print(render_table(event_list, headers=['Time (UTC)', 'Source', 'Event']))
+                except Exception as err:
+                    print("Getting Timeline Failed - {}".format(err))
+                input("\nPress any key to go to main menu.")
+                continue
+            else:
+                error("No device connected.")
+                input("Press any key to go to main menu.")
+                continue
+        elif c == '11':
+            clear_screen()
+            print(welcome("ATV GUMSHOE"))
+            print("*** Re-acquire Changes ***\n")
+            if STATUS:
+                try:
+                    delta = reacquire(executor, SnapshotStore(), CustodyManifest(hash_algorithms), examiner, sign_key)
+                    if delta['baseline']:
+                        print("First acquisition of this device, all records were stored as the baseline.\n")
+                    summary_list = [[source] + list(counts.values()) for source, counts in delta['summary'].items()]
+                    print(render_table(summary_list, headers=['Source', 'Added', 'Removed', 'Changed']))
+                    if not delta['baseline']:
+                        for source, changes in delta['records'].items():
+                            change_list = [[change, key] + row for change, rows in changes.items()
+                                           for key, row in rows.items()]
+                            if change_list:
+                                print("\n{}:\n".format(source.capitalize()))
+                                columns = list(SCHEMAS[source][:len(change_list[0]) - 2])
+                                print(render_table(change_list, headers=['Change', 'Key'] + columns))
+                    for path, reason in delta['errors'].items():
+                        error("{} - {}".format(path, reason))
+                    print("\n{} changed and {} removed files.".format(len(delta['changed_files']),
+                                                                      len(delta['removed_files'])))
+                except Exception as err:
+                    print("Re-acquiring Changes Failed - {}".format(err))
+                input("\nPress any key to go to main menu.")
+                continue
+            else:
+                error("No device connected.")
+                input("Press any key to go to main menu.")
+                continue
+        elif c == '12':
+            clear_screen()
+            print(welcome("ATV GUMSHOE"))
+            print("*** Peer Graph ***\n")
+            print("Peer graph file: " + PEER_GRAPH_PATH + '\n')
+            if STATUS:
+                try:
+                    result_data = _raise_if_error(fetch_plan(executor, ['peers'], cache)['otctl'])
+                    self_list = parse_trusted_peers(result_data)[0]
+                    peer_graph = PeerGraph(PEER_GRAPH_PATH)
+                    if input("Add the trust network of this device to the peer graph [y/N]: ").lower().startswith('y'):
+                        peer_graph.add_context_dump(result_data, device_label(executor, result_data))
+                        peer_graph.save()
+                    vouchers = peer_graph.vouches_for(self_list[0][0])
+                    print("\nPeer graph: {} peers from {} acquisitions".format(
+                        len(peer_graph), len(peer_graph.observations)))
+                    print("\nPeers vouching for this device:")
+                    print(render_table([row[:4] + [format_unix_time(row[4]), row[5]] for row in vouchers],
+                                       headers=['Peer ID', 'SN', 'Model', 'Vouches For', 'Observed', 'Seen By']))
+                except Exception as err:
+                    print("Updating the peer graph failed - {}".format(err))
                 input("\nPress any key to go to main menu.")
                 continue
             else:
                 error("No device connected.")
                 input("Press any key to go to main menu.")
                 continue
+        elif c == '13':
+            clear_screen()
+            print(welcome("ATV GUMSHOE"))
+            print("*** Search Index ***\n")
+            print("Search index file: " + SEARCH_INDEX_PATH + '\n')
+            if STATUS and input("Add the IDs and places of this device to the search index [y/N]: ").lower().startswith('y'):
+                try:
+                    sources = fetch_plan(executor, ['peers', 'ids', 'location'], cache)
+                    index_sources(SEARCH_INDEX_PATH, device_label(executor, sources['otctl']), sources)
+                except Exception as err:
+                    print("Indexing the device failed - {}".format(err))
+            search_menu()
+            continue
         elif c == '0':
             if STATUS:
                 info("Closing SSH Connection")
+                executor.close()
                 ssh_client.close()
             info("Bye!")
-            exit()
-        os.system("clear")
+            return 0
+        clear_screen()
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    logging_addLevelName(LOGGING_LEVELS['NORMAL']['level'], LOGGING_LEVELS['NORMAL']['name'])
+    logging_basicConfig(level=LOGGING_LEVELS_MAP[args.log_level],
+                        format='%(asctime)s %(levelname)s %(threadName)s %(message)s')
+    PROFILER.enabled = bool(args.profile)
+    PROFILER.cprofile = bool(args.cprofile)
+    with PROFILER.thread():
+        try:
+            if args.query_timeline:
+                status = query_timeline(args)
+            elif args.vouches_for or args.reachable_from:
+                status = query_peers(args)
+            elif args.search:
+                status = query_search_index(args)
+            elif args.verify_manifest:
+                status = check_manifest(args)
+            elif args.purge_cache:
+                status = purge_cache(args)
+            elif args.agent_serve:
+                status = run_agent(args)
+            elif args.agent_status or args.agent_stop:
+                status = control_agent(args)
+            elif args.evidence:
+                status = run_offline(args)
+            elif args.host or args.inventory:
+                status = run_headless(args)
+            else:
+                status = main(args)
+        finally:
+            print_profile(args)
+    sys.exit(status)
@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+#
+#   Apple TV Gumshoe benchmark suite.
+#
+#   Runs every extractor of atvGumshoe.py, and a full acquisition, against a
+#   local fake Apple TV: a paramiko SSH server answering from generated
+#   fixtures, with configurable fixture sizes and injectable latency and
+#   bandwidth. No device is needed, so every performance change can be
+#   checked offline on a plain Linux box:
+#
+#       python3 atvGumshoe_bench.py --locations 10000 --apps 500 --peers 200 --latency 0.05
+#
+#   The fake server can also be started on its own and used with the
+#   headless CLI or the menu, logging in with the password it prints (any
+#   username is accepted). It only answers the commands atvGumshoe sends:
+#
+#       python3 atvGumshoe_bench.py serve --port 2222
+#
+#   startup times how long the interactive menu takes to come up:
+#
+#       python3 atvGumshoe_bench.py startup --runs 10
+#
+
+import os
+import os.path
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import plistlib
+import datetime
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import warnings
+import re
+import shlex
+import secrets
+from argparse import ArgumentParser
+from logging import basicConfig as logging_basicConfig, \
+    info as info, \
+    error as error, \
+    getLogger
+import paramiko
+from tabulate import tabulate
+
+import atvGumshoe
+
+STATS_COMMAND = '__atvgumshoe_stats__'
+SEND_CHUNK_SIZE = 32768
+COLD_START_PATTERN = re.compile(r'Cold start took ([0-9.]+)s')
+PLUTIL_PATH = re.compile(r'plutil -showjson (\S+)')
+# Shell commands of atvGumshoe run by the fake Apple TV; their operands must be plain paths or globs
+TAR_COMMAND = re.compile(r'^cd / && tar -cz?f - (.+)$', re.S)
+STAT_COMMAND = re.compile(r"^if stat -c %s / >/dev/null 2>&1; then stat -c '%s %Y(?: %i %Z)? %n' (.+?); "
+                          r"else stat -f '%z %m(?: %i %c)? %N' \1; fi 2>/dev/null$", re.S)
+FIND_COMMAND = re.compile(r"^if stat -c %s / >/dev/null 2>&1; then find (\S+) -xdev -type f -exec stat -c '%s %n' "
+                          r"\{\} \+; else find \1 -xdev -type f -exec stat -f '%z %N' \{\} \+; fi$", re.S)
+BATCH_SOURCE = re.compile(re.escape('echo "{} BEGIN source '.format(atvGumshoe.FRAME_MARKER)) + r'(\S+)"')
+UNQUOTED_OPERAND = re.compile(r'^[\w@%+=:,./*-]+$')
+BENCH_EXTRACTORS = ('device', 'peers', 'wifi', 'ids', 'location', 'apps', 'timeline')
+LOCATION_SOURCES = ('com.apple.mobilecal', 'com.apple.Maps', 'com.apple.MobileSMS', 'com.apple.mobilemail')
+APPLE_APPS = ('TVMusic', 'TVPhotos', 'TVSettings', 'TVSearch', 'TVAppStore', 'TVWatchList',
+              'TVPodcasts', 'TVMovies', 'TVShows', 'Siri', 'Arcade', 'Fitness')
+
+
+#
+# Fixtures
+#
+
+def plutil_json(value):
+    """Render a decoded plist the way plutil -showjson does, quirks included
+
+    Arrays keep a trailing comma and data values are printed as nothing at
+    all, which is what the tolerant decoder of atvGumshoe has to cope with.
+    """
+    if isinstance(value, dict):
+        return '{' + ','.join('{}:{}'.format(json.dumps(str(k)), plutil_json(v)) for k, v in value.items()) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ''.join(plutil_json(v) + ',' for v in value) + ']'
+    if isinstance(value, datetime.datetime):
+        return json.dumps((value - atvGumshoe.CF_ABSOLUTE_EPOCH).total_seconds())
+    if isinstance(value, bytes):
+        return ''
+    return json.dumps(value)
+
+
+def _write_plist(root, path, value):
+    local_path = os.path.join(root, path.lstrip('/'))
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    with open(local_path, 'wb') as f:
+        plistlib.dump(value, f, fmt=plistlib.FMT_BINARY)
+    # Pre-rendered plutil output read by the plutil shim of shell commands
+    with open(local_path + '.plutil.json', 'w') as f:
+        f.write(plutil_json(value))
+
+
+def _random_time(rng):
+    return datetime.datetime(2016, 1, 1) + datetime.timedelta(seconds=rng.randint(0, 5 * 365 * 86400))
+
+
+def generate_fixtures(root, locations=10000, apps=500, peers=200, wifi=100, ids=50, seed=1):
+    """Write a fake Apple TV filesystem under root"""
+    rng = random.Random(seed)
+    files = atvGumshoe.FORENSIC_FILES
+
+    def new_uuid():
+        return str(uuid.UUID(int=rng.getrandbits(128))).upper()
+
+    _write_plist(root, files['systemversion'], {
+        'ProductName': 'Apple TVOS', 'ProductVersion': '14.0', 'ProductBuildVersion': '18J386'})
+    _write_plist(root, files['tvsettings'], {'SSDeviceType': {'hardwareModel': 'J105aAP'}})
+    _write_plist(root, files['appstored'], {'ArcadeDeviceGUID': new_uuid()})
+    _write_plist(root, files['app_ids'], {'apps': ['com.example.app{}'.format(i) for i in range(apps)]})
+
+    _write_plist(root, files['wifi'], {'values': dict(
+        ('Network {}'.format(i), {
+            'value': {'added_by': rng.choice(('iPhone', 'iPad', 'MacBookPro')),
+                      'added_by_os_ver': '14.{}'.format(rng.randint(0, 4)),
+                      'blob': b'\x00\x01'},
+            'timestamp': _random_time(rng),
+        }) for i in range(wifi))})
+
+    _write_plist(root, files['location'], {'values': dict(
+        (new_uuid(), {
+            'value': {'n': 'Place {}'.format(i % max(1, locations // 3)),
+                      'a': '{} Example Street, Springfield'.format(rng.randint(1, 999)),
+                      'S': rng.choice(LOCATION_SOURCES)},
+            'timestamp': _random_time(rng),
+        }) for i in range(locations))})
+
+    id_cache = {}
+    for service in ('icloudpairing', 'fmd', 'cloudmessaging', 'nearby'):
+        id_cache['com.apple.private.alloy.' + service] = dict(
+            ('mailto:user{}@example.com'.format(i), {'LookupStatus': 1}) for i in range(ids))
+    _write_plist(root, files['id_cache'], id_cache)
+
+    apple_root, apple_plist = atvGumshoe.APP_INVENTORY_ROOTS['apple']
+    other_root, other_plist = atvGumshoe.APP_INVENTORY_ROOTS['other']
+    apple_apps = min(apps, len(APPLE_APPS))
+    for i in range(apple_apps):
+        _write_plist(root, '{}/{}.app/{}'.format(apple_root, APPLE_APPS[i], apple_plist), {
+            'CFBundleName': APPLE_APPS[i], 'CFBundleVersion': '1.0',
+            'CFBundleIdentifier': 'com.apple.' + APPLE_APPS[i]})
+    for i in range(apps - apple_apps):
+        _write_plist(root, '{}/{}/{}'.format(other_root, new_uuid(), other_plist), {
+            'itemName': 'App {}'.format(i), 'bundleVersion': '{}.0'.format(rng.randint(1, 9)),
+            'softwareVersionBundleId': 'com.example.app{}'.format(i)})
+
+    peer_list = []
+    for i in range(peers):
+        peer_list.append({
+            'peerID': 'SPID-{:04d}'.format(i),
+            'stableInfo': {'serial_number': 'SN{:08d}'.format(i), 'os_version': 'iOS 14.{}'.format(i % 5)},
+            'permanentInfo': {'model_id': rng.choice(('iPhone12,1', 'iPad8,1', 'MacBookPro16,1'))},
+        })
+    otctl = {'contextDump': {
+        'self': {
+            'peerID': 'SPID-SELF',
+            'stableInfo': {'serial_number': 'SNSELF0001', 'os_version': 'tvOS 14.0'},
+            'permanentInfo': {'model_id': 'AppleTV6,2'},
+            'dynamicInfo': {'included': [peer['peerID'] for peer in peer_list[::2]],
+                            'excluded': [peer['peerID'] for peer in peer_list[1::2]]},
+        },
+        'peers': peer_list,
+    }}
+    with open(os.path.join(root, '.otctl.json'), 'w') as f:
+        json.dump(otctl, f)
+    db = os.path.join(root, atvGumshoe.OTCTL_STATE_FILES[0].lstrip('/'))
+    os.makedirs(os.path.dirname(db), exist_ok=True)
+    with open(db, 'wb') as f:
+        f.write(b'SQLite format 3\x00')
+
+    # Shims for the commands run through the shell (inventory loop, tar, stat)
+    bin_dir = os.path.join(root, '.bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    shims = {
+        'plutil': '#!/bin/sh\n'
+                  '[ -f "$2.plutil.json" ] || { echo "$2: file does not exist or is not readable"; exit 1; }\n'
+                  'cat "$2.plutil.json"\n',
+        'otctl': '#!/bin/sh\ncat "{}"\n'.format(os.path.join(root, '.otctl.json')),
+    }
+    for name, script in shims.items():
+        with open(os.path.join(bin_dir, name), 'w') as f:
+            f.write(script)
+        os.chmod(os.path.join(bin_dir, name), 0o755)
+
+
+#
+# Fake Apple TV SSH server
+#
+
+class FakeAppleTV(object):
+    """Answer remote commands from a fixture directory, with injected latency and bandwidth"""
+
+    DEVICE_PATH = re.compile(r'(?<![\w.])/(?=(?:private|Applications|System)\b)')
+
+    def __init__(self, root, latency=0.0, bandwidth=0, password=None):
+        self.root = os.path.abspath(root)
+        self.password = password
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.round_trips = 0
+        self.bytes_sent = 0
+        # {remote path: commands running plutil on it}
+        self.plutil_reads = {}
+        self.lock = threading.Lock()
+
+    def local_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def execute(self, channel, cmd):
+        try:
+            if cmd == STATS_COMMAND:
+                self.send(channel, json.dumps({'round_trips': self.round_trips,
+                                               'bytes_sent': self.bytes_sent,
+                                               'plutil_reads': self.plutil_reads}).encode(), throttle=False)
+                channel.send_exit_status(0)
+                return
+            with self.lock:
+                self.round_trips += 1
+                for path in set(PLUTIL_PATH.findall(cmd)):
+                    self.plutil_reads[path] = self.plutil_reads.get(path, 0) + 1
+            time.sleep(self.latency)
+            channel.send_exit_status(self.dispatch(channel, cmd))
+        except Exception as err:
+            error("Fake Apple TV failed to run {} - {}".format(cmd, err))
+        finally:
+            # Closing is left to the client: a close sent from this thread
+            # could overtake the reply to the exec request itself
+            channel.shutdown_write()
+
+    def dispatch(self, channel, cmd):
+        argv = shlex.split(cmd) if not any(token in cmd for token in (';', '&&', '|', '$')) else None
+        if argv == ['otctl', 'status', '-j']:
+            with open(os.path.join(self.root, '.otctl.json'), 'rb') as f:
+                self.send(channel, f.read())
+            return 0
+        if argv and argv[:2] == ['plutil', '-showjson'] and len(argv) == 3:
+            try:
+                with open(self.local_path(argv[2]), 'rb') as f:
+                    self.send(channel, plutil_json(plistlib.load(f)).encode('utf-8'))
+                return 0
+            except (IOError, OSError, plistlib.InvalidFileException):
+                self.send(channel, "{}: file does not exist or is not readable\n".format(argv[2]).encode())
+                return 1
+        if argv and argv[0] == 'ls' and len(argv) == 2:
+            try:
+                names = sorted(name for name in os.listdir(self.local_path(argv[1])) if not name.startswith('.'))
+            except OSError as err:
+                channel.sendall_stderr("ls: {}\n".format(err).encode())
+                return 1
+            self.send(channel, ''.join(name + '\n' for name in names).encode())
+            return 0
+        if not self.known(cmd):
+            channel.sendall_stderr("{}: not answered by the fake Apple TV\n".format(cmd).encode())
+            return 127
+        return self.shell(channel, cmd)
+
+    @staticmethod
+    def known(cmd):
+        """Return whether cmd is one of the shell commands atvGumshoe sends, so that no other runs locally"""
+        inventory = atvGumshoe.build_inventory_cmd()
+        if cmd == inventory:
+            return True
+        names = BATCH_SOURCE.findall(cmd)
+        if names and all(name in atvGumshoe.SOURCES for name in names):
+            if cmd.endswith(inventory):
+                names.append('inventory')
+            return cmd == atvGumshoe.build_batch_cmd(names)
+        match = TAR_COMMAND.match(cmd) or STAT_COMMAND.match(cmd) or FIND_COMMAND.match(cmd)
+        return match is not None and _plain_operands(match.group(1))
+
+    def shell(self, channel, cmd):
+        """Run any other command in a local shell rooted at the fixture directory"""
+        local_cmd = self.DEVICE_PATH.sub(self.root + '/', cmd).replace('cd / ', 'cd {} '.format(self.root))
+        env = dict(os.environ, PATH=os.path.join(self.root, '.bin') + os.pathsep + os.environ.get('PATH', ''))
+        process = subprocess.Popen(local_cmd, shell=True, env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        binary = ' tar ' in ' ' + cmd
+        root = self.root.encode()
+        # stderr is small; read it on the side so a chatty command cannot block
+        stderr = []
+        reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()))
+        reader.start()
+        # The tail of every text chunk is held back, so that a fixture path
+        # split across two chunks is still rewritten
+        pending = b''
+        while True:
+            data = process.stdout.read1(SEND_CHUNK_SIZE) if hasattr(process.stdout, 'read1') \
+                else process.stdout.read(SEND_CHUNK_SIZE)
+            if not data:
+                break
+            if binary:
+                self.send(channel, data)
+                continue
+            pending = (pending + data).replace(root, b'')
+            cut = max(0, len(pending) - len(root) + 1)
+            self.send(channel, pending[:cut])
+            pending = pending[cut:]
+        self.send(channel, pending)
+        reader.join()
+        channel.sendall_stderr(b''.join(stderr).replace(root, b''))
+        return process.wait()
+
+    def send(self, channel, data, throttle=True):
+        for offset in range(0, len(data), SEND_CHUNK_SIZE):
+            chunk = data[offset:offset + SEND_CHUNK_SIZE]
+            channel.sendall(chunk)
+            if throttle and self.bandwidth:
+                time.sleep(len(chunk) / float(self.bandwidth))
+        with self.lock:
+            self.bytes_sent += len(data)
+
+
+def _plain_operands(text):
+    """Return whether text only holds quoted paths and unquoted globs, as shlex.quote renders them"""
+    try:
+        operands = shlex.split(text)
+    except ValueError:
+        return False
+    return text == ' '.join(operand if UNQUOTED_OPERAND.match(operand) else shlex.quote(operand)
+                            for operand in operands)
+
+
+class FakeAppleTVServer(paramiko.ServerInterface):
+
+    def __init__(self, device):
+        self.device = device
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if self.device.password is not None and secrets.compare_digest(password, self.device.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_exec_request(self, channel, command):
+        thread = threading.Thread(target=self.device.execute, args=(channel, command.decode('utf-8')))
+        thread.daemon = True
+        thread.start()
+        return True
+
+
+def serve(device, host='127.0.0.1', port=0, ready=None):
+    """Accept SSH connections forever; ready is called with the bound port"""
+    host_key = paramiko.RSAKey.generate(2048)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(100)
+    if ready:
+        ready(sock.getsockname()[1])
+    while True:
+        client, address = sock.accept()
+        transport = paramiko.Transport(client)
+        transport.add_server_key(host_key)
+        try:
+            transport.start_server(server=FakeAppleTVServer(device))
+        except paramiko.SSHException as err:
+            error("SSH negotiation with {} failed - {}".format(address, err))
+
+
+def start_server_process(root, latency, bandwidth):
+    """Start the fake Apple TV in a subprocess, so it does not share the memory or GIL of the client"""
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', '--root', root,
+                                '--latency', str(latency), '--bandwidth', str(bandwidth)],
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith('READY'):
+        process.kill()
+        raise RuntimeError("The fake Apple TV did not start")
+    ready, port, password = line.split()
+    return process, int(port), password
+
+
+#
+# Benchmarks
+#
+
+class NullExporter(object):
+    """Consume the rows of every table, only counting them"""
+
+    def __init__(self):
+        self.rows = 0
+
+    def write_table(self, table, rows):
+        for row in rows:
+            self.rows += 1
+
+    def close(self):
+        pass
+
+
+def server_stats(executor):
+    """Return the round trips and bytes counted by the fake Apple TV so far"""
+    return json.loads(executor.run(STATS_COMMAND).stdout.decode())
+
+
+def run_scenario(port, password, scenario, args, measure_memory):
+    """Run one scenario on a new connection and return its measurements"""
+    ssh_client = atvGumshoe.ssh_connect('127.0.0.1', port, 'root', password, timeout=args.timeout)
+    executor = atvGumshoe.CommandExecutor(ssh_client, args.concurrency, args.timeout)
+    cache = atvGumshoe.ArtifactCache(args.cache_dir, enabled=bool(args.cache_dir))
+    try:
+        before = server_stats(executor)
+        if measure_memory:
+            tracemalloc.start()
+        started = time.time()
+        rows = 0
+        errors = {}
+        if scenario == 'acquire':
+            evidence_dir = tempfile.mkdtemp(prefix='atvgumshoe_bench_evidence_')
+            try:
+                artifacts, missing = atvGumshoe.acquire_artifacts(executor, evidence_dir, include_apps=True)
+                rows = len(atvGumshoe.parse_artifacts(artifacts))
+            finally:
+                shutil.rmtree(evidence_dir, ignore_errors=True)
+        else:
+            names = list(BENCH_EXTRACTORS) if scenario == 'all' else [scenario]
+            exporter = NullExporter()
+            errors = atvGumshoe.run_extractors(executor, names, exporter, cache)
+            rows = exporter.rows
+        elapsed = time.time() - started
+        peak = None
+        if measure_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        after = server_stats(executor)
+    finally:
+        executor.close()
+        ssh_client.close()
+    # Every source is fetched once, however many extractors read it
+    for path, count in sorted(after['plutil_reads'].items()):
+        reads = count - before['plutil_reads'].get(path, 0)
+        if reads > 1:
+            errors['round trips'] = "{} was read {} times".format(path, reads)
+    return {
+        'scenario': scenario,
+        'seconds': round(elapsed, 3),
+        'round_trips': after['round_trips'] - before['round_trips'],
+        'bytes': after['bytes_sent'] - before['bytes_sent'],
+        'rows': rows,
+        'peak_memory': peak,
+        'errors': errors,
+    }
+
+
+def run_benchmarks(args):
+    root = args.root or tempfile.mkdtemp(prefix='atvgumshoe_bench_')
+    if not args.root:
+        info("Generating fixtures in {}".format(root))
+        generate_fixtures(root, args.locations, args.apps, args.peers, args.wifi, args.ids)
+    process, port, password = start_server_process(root, args.latency, args.bandwidth)
+    results = []
+    try:
+        for scenario in args.scenarios:
+            result = run_scenario(port, password, scenario, args, measure_memory=False)
+            if not args.no_memory:
+                measured = run_scenario(port, password, scenario, args, measure_memory=True)
+                result['peak_memory'] = measured['peak_memory']
+            results.append(result)
+    finally:
+        process.kill()
+        if not args.root and not args.keep_fixtures:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print(tabulate([[r['scenario'], r['seconds'], r['round_trips'], r['bytes'], r['rows'],
+                     '-' if r['peak_memory'] is None else r['peak_memory'] // 1024,
+                     ', '.join(sorted(r['errors'])) or '-'] for r in results],
+                   headers=['Scenario', 'Wall (s)', 'Round trips', 'Bytes', 'Rows', 'Peak memory (KiB)', 'Errors']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'parameters': dict((k, v) for k, v in vars(args).items() if k != 'func'),
+                       'results': results}, f, indent=2)
+    return 0 if not any(r['errors'] for r in results) else 1
+
+
+def run_startup(args):
+    """Start the interactive menu and exit it, args.runs times; report the time to the first menu
+
+    The first run may render and cache the banner, so the runs after it are
+    checked against COLD_START_BUDGET.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'atvGumshoe.py')
+    results = []
+    for run in range(args.runs):
+        started = time.time()
+        process = subprocess.run([sys.executable, script, '--log-level', 'info'], input=b'0\n',
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        match = COLD_START_PATTERN.search(process.stderr.decode('utf-8', 'replace'))
+        results.append({'run': run + 1, 'seconds': round(time.time() - started, 3),
+                        'cold_start': float(match.group(1)) if match else None})
+
+    measured = sorted(r['cold_start'] for r in results[1:] or results if r['cold_start'] is not None)
+    median = measured[len(measured) // 2] if measured else None
+    print(tabulate([[r['run'], r['seconds'], '-' if r['cold_start'] is None else r['cold_start']] for r in results],
+                   headers=['Run', 'Process (s)', 'To first menu (s)']))
+    print("\nMedian time to the first menu: {} (budget {}s)".format(
+        '-' if median is None else '{}s'.format(median), atvGumshoe.COLD_START_BUDGET))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'budget': atvGumshoe.COLD_START_BUDGET, 'median': median, 'results': results}, f, indent=2)
+    return 0 if median is not None and median <= atvGumshoe.COLD_START_BUDGET else 1
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Benchmark atvGumshoe against a local fake Apple TV.")
+    parser.add_argument('command', nargs='?', default='bench', choices=('bench', 'serve', 'fixtures', 'startup'),
+                        help="bench (default), serve a fake Apple TV, only write the fixtures, or time the "
+                             "start of the interactive menu")
+    parser.add_argument('--root', help="Existing fixture directory (generated in a temporary directory if unset)")
+    parser.add_argument('--locations', type=int, default=10000, help="Location history records [%(default)s]")
+    parser.add_argument('--apps', type=int, default=500, help="Installed applications [%(default)s]")
+    parser.add_argument('--peers', type=int, default=200, help="Octagon peers [%(default)s]")
+    parser.add_argument('--wifi', type=int, default=100, help="Synced Wifi networks [%(default)s]")
+    parser.add_argument('--ids', type=int, default=50, help="IDs per identity services category [%(default)s]")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every command [%(default)s]")
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help="Bytes per second sent by the fake Apple TV, 0 for unlimited [%(default)s]")
+    parser.add_argument('--port', type=int, default=0, help="Port of the fake Apple TV in serve mode")
+    parser.add_argument('--password',
+                        help="Password of the fake Apple TV in serve mode (a random one is printed if unset)")
+    parser.add_argument('--scenarios', default=','.join(BENCH_EXTRACTORS + ('all', 'acquire')),
+                        help="Comma separated scenarios [%(default)s]")
+    parser.add_argument('--concurrency', type=int, default=atvGumshoe.COMMAND_CONCURRENCY,
+                        help="Concurrent commands per device [%(default)s]")
+    parser.add_argument('--timeout', type=int, default=atvGumshoe.COMMAND_TIMEOUT,
+                        help="Timeout in seconds of every remote command [%(default)s]")
+    parser.add_argument('--cache-dir', help="Benchmark with the artifact cache in this directory (off if unset)")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc pass measuring peak memory")
+    parser.add_argument('--keep-fixtures', action='store_true', help="Keep the generated fixture directory")
+    parser.add_argument('--runs', type=int, default=5, help="Starts of the menu timed in startup mode [%(default)s]")
+    parser.add_argument('--output', help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging_basicConfig(level='ERROR')
+    warnings.simplefilter('ignore')
+    if args.command == 'fixtures':
+        root = args.root or tempfile.mkdtemp(prefix='atvgumshoe_fixtures_')
+        generate_fixtures(root, args.locations, args.apps, args.peers, args.wifi, args.ids)
+        print(root)
+        return 0
+    if args.command == 'serve':
+        root = args.root
+        if not root:
+            root = tempfile.mkdtemp(prefix='atvgumshoe_fixtures_')
+            generate_fixtures(root, args.locations, args.apps, args.peers, args.wifi, args.ids)
+        device = FakeAppleTV(root, args.latency, args.bandwidth, args.password or secrets.token_urlsafe(16))
+        # Clients hanging up after each scenario are not worth reporting
+        getLogger('paramiko').setLevel('CRITICAL')
+
+        def ready(port):
+            print("READY {} {}".format(port, device.password))
+            sys.stdout.flush()
+        serve(device, port=args.port, ready=ready)
+        return 0
+    if args.command == 'startup':
+        return run_startup(args)
+    return run_benchmarks(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
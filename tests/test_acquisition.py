@@ -0,0 +1,191 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import plistlib
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import paramiko
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atvGumshoe
+
+
+class ReceiveFileTest(unittest.TestCase):
+
+    def test_complete_stream(self):
+        hasher = atvGumshoe.StreamHasher()
+        data = atvGumshoe.receive_file(io.BytesIO(b'x' * 200), 200, hasher=hasher)
+        self.assertEqual(bytes(data), b'x' * 200)
+        self.assertEqual(hasher.hexdigests()['sha256'], hashlib.sha256(b'x' * 200).hexdigest())
+
+    def test_short_stream(self):
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        for hasher in (None, atvGumshoe.StreamHasher(), atvGumshoe.StreamHasher(pool=pool)):
+            with self.assertLogs(level='WARNING'):
+                data = atvGumshoe.receive_file(io.BytesIO(b'x' * 100), 200, hasher=hasher)
+            self.assertEqual(bytes(data), b'x' * 100)
+            if hasher:
+                self.assertEqual(hasher.size, 100)
+                self.assertEqual(hasher.hexdigests()['sha256'], hashlib.sha256(b'x' * 100).hexdigest())
+
+    def test_short_stream_without_keep(self):
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(atvGumshoe.receive_file(io.BytesIO(b'x' * 100), 200, keep=False))
+
+
+OTCTL_OUTPUT = b'{"contextDump": {"self": {"peerID": "SPID:test"}}}'
+
+
+class LocalDevice(object):
+    """Executor answering the acquisition commands from a local directory standing in for the device root
+
+    tar runs for real below the directory; with length the streams are cut
+    after that many bytes.
+    """
+
+    def __init__(self, root, length=None):
+        self.root = root
+        self.length = length
+
+    def run(self, cmd, timeout=None):
+        if cmd == atvGumshoe.OTCTL_STATUS:
+            return atvGumshoe.CommandResult(cmd, OTCTL_OUTPUT, b'', 0)
+        assert cmd.startswith('cd / && '), cmd
+        process = subprocess.run('cd {} && {}'.format(self.root, cmd[len('cd / && '):]), shell=True,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return atvGumshoe.CommandResult(cmd, process.stdout, process.stderr, process.returncode)
+
+    def submit(self, cmd, timeout=None):
+        future = Future()
+        future.set_result(self.run(cmd, timeout))
+        return future
+
+    @contextlib.contextmanager
+    def stream(self, cmd, timeout=None):
+        result = self.run(cmd, timeout)
+        yield atvGumshoe.CountingReader(io.BytesIO(result.stdout[:self.length]), atvGumshoe.EvidenceChannel(result))
+
+
+class AcquireArtifactsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.root = os.path.join(self.tmp, 'device')
+        self.evidence_dir = os.path.join(self.tmp, 'evidence')
+        self.files = {}
+        for name in atvGumshoe.ACQUISITION_SOURCES:
+            if name == 'app_ids':
+                # Left out to check the missing files are reported
+                continue
+            data = plistlib.dumps({'source': name, 'values': {'k': {'value': {'n': name * 100}}}},
+                                  fmt=plistlib.FMT_BINARY)
+            self.write(atvGumshoe.FORENSIC_FILES[name], data)
+        self.write('/Applications/TV.app/Info.plist', plistlib.dumps({'CFBundleName': 'TV'}))
+
+    def write(self, remote_path, data):
+        path = os.path.join(self.root, remote_path.lstrip('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.files[remote_path] = data
+
+    def acquire(self, device, include_apps=False):
+        custody = atvGumshoe.CustodyManifest()
+        with self.assertLogs(level='WARNING') as logs:
+            artifacts, missing = atvGumshoe.acquire_artifacts(device, self.evidence_dir, include_apps, custody)
+        manifest = custody.seal(self.evidence_dir)
+        return artifacts, missing, manifest, '\n'.join(logs.output)
+
+    def test_files_and_hashes(self):
+        artifacts, missing, manifest, logs = self.acquire(LocalDevice(self.root))
+        self.assertEqual(missing, [atvGumshoe.FORENSIC_FILES['app_ids']])
+        self.assertIn(atvGumshoe.FORENSIC_FILES['app_ids'].lstrip('/'), logs)
+        self.assertEqual(set(artifacts), set(self.files) - {'/Applications/TV.app/Info.plist'})
+        for remote_path, data in artifacts.items():
+            self.assertEqual(bytes(data), self.files[remote_path])
+            with open(os.path.join(self.evidence_dir, remote_path.lstrip('/')), 'rb') as f:
+                self.assertEqual(f.read(), self.files[remote_path])
+        parsed = atvGumshoe.parse_artifacts(artifacts)
+        self.assertEqual(parsed[atvGumshoe.FORENSIC_FILES['wifi']]['source'], 'wifi')
+
+        with open(manifest) as f:
+            entries = dict((entry['remote_path'], entry) for entry in json.load(f)['files'])
+        for remote_path in artifacts:
+            self.assertEqual(entries[remote_path]['size'], len(self.files[remote_path]))
+            self.assertEqual(entries[remote_path]['sha256'], hashlib.sha256(self.files[remote_path]).hexdigest())
+        self.assertEqual(entries[atvGumshoe.OTCTL_STATUS]['sha256'], hashlib.sha256(OTCTL_OUTPUT).hexdigest())
+        self.assertEqual(atvGumshoe.verify_manifest(manifest), [])
+
+    def test_app_metadata(self):
+        artifacts, missing, manifest, logs = self.acquire(LocalDevice(self.root), include_apps=True)
+        self.assertEqual(bytes(artifacts['/Applications/TV.app/Info.plist']),
+                         self.files['/Applications/TV.app/Info.plist'])
+
+    def test_truncated_stream(self):
+        device = LocalDevice(self.root)
+        with tarfile.open(fileobj=io.BytesIO(device.run(atvGumshoe.build_tar_cmd(
+                [atvGumshoe.FORENSIC_FILES[name] for name in atvGumshoe.ACQUISITION_SOURCES])).stdout)) as tar:
+            members = [member for member in tar]
+        complete = ['/' + member.name for member in members]
+        last = complete[-1]
+        # Cut the stream in the middle of the data of the last file
+        device.length = members[-1].offset_data + members[-1].size // 2
+        artifacts, missing, manifest, logs = self.acquire(device)
+        self.assertIn('cut short', logs)
+        self.assertIn('ended early', logs)
+        self.assertLess(len(artifacts[last]), len(self.files[last]))
+        for remote_path in complete[:-1]:
+            self.assertEqual(bytes(artifacts[remote_path]), self.files[remote_path])
+        with open(manifest) as f:
+            entries = dict((entry['remote_path'], entry) for entry in json.load(f)['files'])
+        self.assertEqual(entries[last]['size'], len(artifacts[last]))
+        self.assertEqual(entries[last]['sha256'], hashlib.sha256(bytes(artifacts[last])).hexdigest())
+        self.assertEqual(atvGumshoe.verify_manifest(manifest), [])
+
+
+class ManifestSignerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.evidence_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.evidence_dir)
+        self.key = paramiko.RSAKey.generate(1024)
+        self.public_key = os.path.join(self.evidence_dir, 'examiner.pub')
+        with open(self.public_key, 'w') as f:
+            f.write('ssh-rsa {} examiner\n'.format(self.key.get_base64()))
+
+    def seal(self, sign_key=None):
+        with self.assertLogs(level='INFO'):
+            return atvGumshoe.CustodyManifest().seal(self.evidence_dir, sign_key=sign_key)
+
+    def test_expected_signer(self):
+        manifest = self.seal(self.key)
+        self.assertEqual(atvGumshoe.verify_manifest(manifest, self.public_key), [])
+        self.assertEqual(atvGumshoe.verify_manifest(manifest, atvGumshoe.key_fingerprint(self.key)), [])
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertEqual(atvGumshoe.verify_manifest(manifest), [])
+        self.assertIn(atvGumshoe.key_fingerprint(self.key), '\n'.join(logs.output))
+
+    def test_manifest_signed_by_another_key(self):
+        manifest = self.seal(paramiko.RSAKey.generate(1024))
+        problems = atvGumshoe.verify_manifest(manifest, self.public_key)
+        self.assertEqual(len(problems), 1)
+        self.assertIn('not by the expected', problems[0])
+
+    def test_unsigned_manifest(self):
+        manifest = self.seal()
+        self.assertEqual(atvGumshoe.verify_manifest(manifest, self.public_key), ["The manifest is not signed"])
+
+
+if __name__ == '__main__':
+    unittest.main()
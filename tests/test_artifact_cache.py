@@ -0,0 +1,122 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atvGumshoe
+
+
+class LocalExecutor(object):
+
+    def run(self, cmd, timeout=None):
+        process = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return atvGumshoe.CommandResult(cmd, process.stdout, process.stderr, process.returncode)
+
+
+class ArtifactCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.directory = os.path.join(self.tmp, 'cache')
+
+    def cache(self, **kwargs):
+        return atvGumshoe.ArtifactCache(self.directory, **kwargs)
+
+    def test_hit_and_miss(self):
+        cache = self.cache()
+        self.assertRaises(KeyError, cache.get, 'a')
+        cache.put('a', {'n': [1, 2]})
+        self.assertEqual(cache.get('a'), {'n': [1, 2]})
+        # A new cache only finds the value on disk
+        other = self.cache()
+        self.assertEqual(other.get('a'), {'n': [1, 2]})
+        self.assertRaises(KeyError, other.get, 'b')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual((other.hits, other.misses), (1, 1))
+        self.assertEqual(other.stats()['memory_entries'], 1)
+
+    def test_memory_eviction(self):
+        cache = self.cache(memory_bytes=25)
+        for key in 'abc':
+            cache.put(key, key * 8)
+        cache.get('b')
+        cache.put('d', 'd' * 8)
+        self.assertEqual(list(cache.memory), ['b', 'd'])
+        self.assertLessEqual(cache.memory_used, 25)
+        # Evicted values are still read back from disk
+        self.assertEqual(cache.get('a'), 'a' * 8)
+
+    def test_disk_eviction_drops_the_least_recently_used(self):
+        cache = self.cache(disk_bytes=25)
+        cache.put('a', 'a' * 8)
+        cache.put('b', 'b' * 8)
+        past = time.time() - 100
+        os.utime(os.path.join(self.directory, 'a.json'), (past, past))
+        os.utime(os.path.join(self.directory, 'b.json'), (past + 1, past + 1))
+        # Reading a from disk marks it as recently used
+        self.cache().get('a')
+        cache.put('c', 'c' * 8)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['a.json', 'c.json'])
+
+    def test_records_round_trip(self):
+        cache = self.cache()
+        records = [('k1', {'value': {'n': 'é'}}), ('k2', {'value': {}})]
+        self.assertRaises(KeyError, cache.records, 'v')
+        self.assertFalse(cache.has_records('v'))
+        self.assertEqual(list(cache.spool_records('v', iter(records))), records)
+        self.assertTrue(cache.has_records('v'))
+        self.assertEqual([tuple(item) for item in cache.records('v')], records)
+
+    def test_abandoned_spool_is_not_cached(self):
+        cache = self.cache()
+        spool = cache.spool_records('v', iter([('k1', {}), ('k2', {})]))
+        next(spool)
+        spool.close()
+        self.assertFalse(cache.has_records('v'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_files_are_private(self):
+        cache = self.cache()
+        cache.put('a', 1)
+        list(cache.spool_records('v', iter([('k', {})])))
+        self.assertEqual(os.stat(self.directory).st_mode & 0o777, 0o700)
+        for name in os.listdir(self.directory):
+            self.assertEqual(os.stat(os.path.join(self.directory, name)).st_mode & 0o777, 0o600)
+
+    def test_key_changes_with_inode_or_ctime(self):
+        path = os.path.join(self.tmp, 'com.apple.wifi.known-networks.plist')
+
+        def key():
+            stats = atvGumshoe.remote_stat(LocalExecutor(), [path], identity=True)
+            return atvGumshoe.ArtifactCache.key('SN1', 'wifi', stats[path])
+
+        with open(path, 'wb') as f:
+            f.write(b'first')
+        os.utime(path, (1000000000, 1000000000))
+        first = key()
+        self.assertEqual(key(), first)
+
+        # Same size and mtime, but a new file
+        with open(path + '.new', 'wb') as f:
+            f.write(b'other')
+        os.utime(path + '.new', (1000000000, 1000000000))
+        os.replace(path + '.new', path)
+        replaced = key()
+        self.assertNotEqual(replaced, first)
+
+        # Same inode, size and mtime, but rewritten in place
+        time.sleep(1.1)
+        with open(path, 'r+b') as f:
+            f.write(b'third')
+        os.utime(path, (1000000000, 1000000000))
+        self.assertNotEqual(key(), replaced)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atvGumshoe
+
+
+class EvidenceStatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.case = os.path.join(self.tmp, 'case')
+        self.paths = [atvGumshoe.FORENSIC_FILES['wifi'], atvGumshoe.FORENSIC_FILES['location']]
+        for size, path in enumerate(self.paths, 1):
+            local = os.path.join(self.case, path.lstrip('/'))
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            with open(local, 'wb') as f:
+                f.write(b'x' * size)
+            os.utime(local, (1000000000, 1000000000))
+        self.tarball = os.path.join(self.tmp, 'case.tgz')
+        with tarfile.open(self.tarball, 'w:gz') as tar:
+            tar.add(self.case, 'case')
+
+    def remote_stat(self, evidence, identity):
+        executor = atvGumshoe.EvidenceExecutor(evidence)
+        self.addCleanup(executor.close)
+        return atvGumshoe.remote_stat(executor, self.paths + ['/private/var/missing'], identity=identity)
+
+    def test_size_and_mtime(self):
+        for evidence in (self.case, self.tarball):
+            self.assertEqual(self.remote_stat(evidence, False),
+                             {self.paths[0]: (1, 1000000000), self.paths[1]: (2, 1000000000)})
+
+    def test_identity(self):
+        for evidence in (self.case, self.tarball):
+            stats = self.remote_stat(evidence, True)
+            self.assertEqual(sorted(stats), sorted(self.paths))
+            self.assertEqual([stats[path][:2] for path in self.paths], [(1, 1000000000), (2, 1000000000)])
+            self.assertNotEqual(stats[self.paths[0]][2], stats[self.paths[1]][2])
+        local = os.stat(os.path.join(self.case, self.paths[0].lstrip('/')))
+        self.assertEqual(self.remote_stat(self.case, True)[self.paths[0]][2:], (local.st_ino, int(local.st_ctime)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atvGumshoe
+
+
+def peer(peer_id, serial, included=(), excluded=()):
+    return {'peerID': peer_id,
+            'stableInfo': {'serial_number': serial, 'os_version': 'tvOS 17'},
+            'permanentInfo': {'model_id': 'AppleTV14,1'},
+            'dynamicInfo': {'included': list(included), 'excluded': list(excluded)}}
+
+
+def context_dump(own, *peers):
+    return {'contextDump': {'self': own, 'peers': list(peers)}}
+
+
+class PeerGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        # TV vouches for the phone, the phone for the laptop, the laptop for the watch
+        self.graph = atvGumshoe.PeerGraph()
+        self.graph.add_context_dump(context_dump(
+            peer('TV', 'SNTV', included=['PHONE']),
+            peer('PHONE', 'SNPHONE', included=['TV', 'LAPTOP']),
+            peer('LAPTOP', 'SNLAPTOP', included=['WATCH'])), 'SNTV', observed=100)
+
+    def test_vouches_for(self):
+        self.assertEqual(self.graph.vouches_for('SNPHONE'), [['TV', 'SNTV', 'AppleTV14,1', 'PHONE', 100, 'SNTV']])
+        self.assertEqual([row[0] for row in self.graph.vouches_for('TV')], ['PHONE'])
+        self.assertEqual(self.graph.vouches_for('SNUNKNOWN'), [])
+
+    def test_reachable(self):
+        self.assertEqual(self.graph.reachable('SNTV'), {'TV': 0, 'PHONE': 1, 'LAPTOP': 2, 'WATCH': 3})
+        self.assertEqual(self.graph.reachable('LAPTOP'), {'LAPTOP': 0, 'WATCH': 1})
+
+    def test_later_exclusion_replaces_inclusion(self):
+        self.graph.add_context_dump(context_dump(
+            peer('PHONE', 'SNPHONE', included=['TV'], excluded=['LAPTOP'])), 'SNPHONE', observed=200)
+        self.assertEqual(self.graph.vouches_for('LAPTOP'), [])
+        self.assertEqual(self.graph.reachable('SNTV'), {'TV': 0, 'PHONE': 1})
+        self.assertEqual(self.graph.edges['PHONE']['LAPTOP'], ['excluded', 200, 'SNPHONE'])
+
+    def test_earlier_observation_does_not_replace_a_later_one(self):
+        self.graph.add_context_dump(context_dump(
+            peer('PHONE', 'SNPHONE', excluded=['LAPTOP'])), 'SNPHONE', observed=50)
+        self.assertEqual([row[0] for row in self.graph.vouches_for('LAPTOP')], ['PHONE'])
+
+    def test_merge_and_reload(self):
+        other = atvGumshoe.PeerGraph()
+        other.add_context_dump(context_dump(
+            peer('PHONE', 'SNPHONE', excluded=['LAPTOP'])), 'SNPHONE', observed=200)
+        self.graph.merge(other)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.graph.save(os.path.join(tmp, 'peers.json'))
+        reloaded = atvGumshoe.PeerGraph(os.path.join(tmp, 'peers.json'))
+        self.assertEqual(len(reloaded), 3)
+        self.assertEqual(len(reloaded.observations), 2)
+        self.assertEqual(reloaded.reachable('TV'), {'TV': 0, 'PHONE': 1})
+        self.assertEqual(oct(os.stat(os.path.join(tmp, 'peers.json')).st_mode & 0o777), '0o600')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atvGumshoe
+
+
+def decode(data, chunk_size=atvGumshoe.CHANNEL_CHUNK_SIZE):
+    return atvGumshoe.PlutilJSONDecoder(io.BytesIO(data.encode('utf-8')), chunk_size).load()
+
+
+class PlutilJSONDecoderTest(unittest.TestCase):
+
+    def test_trailing_commas(self):
+        self.assertEqual(decode('{"a":[1,2,],"b":{"c":1,},"d":[],}'), {'a': [1, 2], 'b': {'c': 1}, 'd': []})
+
+    def test_missing_values(self):
+        self.assertEqual(decode('{"k":,"j":1}'), {'k': '', 'j': 1})
+        self.assertEqual(decode('{"j":1,"k":}'), {'j': 1, 'k': ''})
+        self.assertEqual(decode('{"a":[{"k":,},],"k":}'), {'a': [{'k': ''}], 'k': ''})
+
+    def test_escaped_quotes_in_keys(self):
+        data = '{"a\\"b":1,"c":{"d\\"e":"f\\"g",},}'
+        expected = {'a"b': 1, 'c': {'d"e': 'f"g'}}
+        for chunk_size in (1, 3, 1024):
+            self.assertEqual(decode(data, chunk_size), expected)
+
+    def test_multibyte_character_split_across_chunks(self):
+        data = '{"n":"café ☕ \U0001f4fa","m":[",é,",],}'
+        for chunk_size in range(1, 8):
+            self.assertEqual(decode(data, chunk_size), {'n': 'café ☕ \U0001f4fa', 'm': [',é,']})
+
+    def test_iter_values_with_one_byte_chunks(self):
+        data = ('{"source":"x","values":{"k1":{"value":{"n":"é",}},"k\\"2":{"value":{"n":,}},},'
+                '"other":[1,],}').encode('utf-8')
+        decoder = atvGumshoe.PlutilJSONDecoder(io.BytesIO(data), chunk_size=1)
+        self.assertEqual(list(decoder.iter_values()),
+                         [('k1', {'value': {'n': 'é'}}), ('k"2', {'value': {'n': ''}})])
+
+    def test_document_larger_than_the_fast_path_limit(self):
+        values = dict(('key{}'.format(i), {'value': {'n': 'Place {}'.format(i), 'a': 'é' * 40}})
+                      for i in range(20000))
+        well_formed = json.dumps({'values': values})
+        self.assertGreater(len(well_formed), atvGumshoe.PlutilJSONDecoder.FAST_PATH_LIMIT)
+        self.assertEqual(decode(well_formed), {'values': values})
+        # With a trailing comma the document is only decodable by the tokenizer
+        self.assertEqual(decode(well_formed[:-2] + ',}}'), {'values': values})
+        decoder = atvGumshoe.PlutilJSONDecoder(io.BytesIO(well_formed.encode('utf-8')))
+        self.assertEqual(dict(decoder.iter_values()), values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import contextlib
+import io
+import os
+import plistlib
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from collections import OrderedDict
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atvGumshoe
+
+
+class LocalTransport(object):
+
+    def get_remote_server_key(self):
+        return atvGumshoe.AgentHostKey('ssh-ed25519', b'local device')
+
+    def getpeername(self):
+        return ('127.0.0.1', 44)
+
+
+class LocalDevice(object):
+    """Executor running the stat and tar commands of reacquire below a local directory standing in for the device root"""
+
+    DEVICE_PATH = re.compile(r"(?<=[\s'])/(?=private/|Applications/|System/)")
+
+    def __init__(self, root):
+        self.root = root
+        self.transport = LocalTransport()
+        self.commands = []
+
+    def run(self, cmd, timeout=None):
+        self.commands.append(cmd)
+        local_cmd = self.DEVICE_PATH.sub(self.root + '/', cmd).replace('cd / ', 'cd {} '.format(self.root))
+        process = subprocess.run(local_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout = process.stdout.replace(self.root.encode(), b'')
+        return atvGumshoe.CommandResult(cmd, stdout, process.stderr, process.returncode)
+
+    def submit(self, cmd, timeout=None):
+        future = Future()
+        future.set_result(self.run(cmd, timeout))
+        return future
+
+    @contextlib.contextmanager
+    def stream(self, cmd, timeout=None):
+        result = self.run(cmd, timeout)
+        yield atvGumshoe.CountingReader(io.BytesIO(result.stdout), atvGumshoe.EvidenceChannel(result))
+
+
+def wifi_plist(networks):
+    return {'values': dict((ssid, {'timestamp': 100.0, 'value': {'added_by': added_by}})
+                           for ssid, added_by in networks.items())}
+
+
+class DiffRecordsTest(unittest.TestCase):
+
+    def test_added_removed_changed(self):
+        old = OrderedDict([('a', [1]), ('b', [2]), ('c', [3])])
+        new = OrderedDict([('b', [2]), ('c', [4]), ('d', [5])])
+        self.assertEqual(atvGumshoe.diff_records(old, new), OrderedDict([
+            ('added', OrderedDict([('d', [5])])),
+            ('removed', OrderedDict([('a', [1])])),
+            ('changed', OrderedDict([('c', [4])])),
+        ]))
+
+    def test_unchanged(self):
+        rows = OrderedDict([('a', [1])])
+        self.assertEqual(atvGumshoe.diff_records(rows, OrderedDict(rows)),
+                         OrderedDict([('added', {}), ('removed', {}), ('changed', {})]))
+
+
+class ReacquireTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.root = os.path.join(self.tmp, 'device')
+        self.store = atvGumshoe.SnapshotStore(os.path.join(self.tmp, 'snapshots'))
+        self.write('wifi', wifi_plist({'Home': 'iPhone', 'Cafe': 'iPad'}))
+        self.write('location', {'values': {'r1': {'timestamp': 100.0, 'value': {'n': 'Library', 'a': '1 Main St',
+                                                                                'S': 'com.apple.Maps'}}}})
+        self.write('id_cache', {})
+        self.write('systemversion', {'ProductName': 'tvOS', 'ProductVersion': '17.0'})
+
+    def write(self, name, value, mtime=1000000000):
+        path = os.path.join(self.root, atvGumshoe.FORENSIC_FILES[name].lstrip('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            plistlib.dump(value, f, fmt=plistlib.FMT_BINARY)
+        os.utime(path, (mtime, mtime))
+
+    def reacquire(self):
+        device = LocalDevice(self.root)
+        return device, atvGumshoe.reacquire(device, self.store)
+
+    def test_only_the_changed_file_is_fetched(self):
+        device, baseline = self.reacquire()
+        self.assertTrue(baseline['baseline'])
+        self.assertEqual(len(baseline['changed_files']), 4)
+        self.assertEqual(baseline['summary']['wifi'], OrderedDict([('added', 2), ('removed', 0), ('changed', 0)]))
+
+        self.write('wifi', wifi_plist({'Home': 'iPhone', 'Cafe': 'Mac', 'Office': 'iPhone'}), mtime=1000000060)
+        device, delta = self.reacquire()
+        wifi = atvGumshoe.FORENSIC_FILES['wifi']
+        self.assertFalse(delta['baseline'])
+        self.assertEqual(delta['changed_files'], [wifi])
+        self.assertEqual(delta['removed_files'], [])
+        self.assertEqual(delta['errors'], {})
+        self.assertEqual(list(delta['records']), ['wifi'])
+        self.assertEqual(list(delta['records']['wifi']['added']), ['Office'])
+        self.assertEqual(list(delta['records']['wifi']['changed']), ['Cafe'])
+        self.assertEqual(delta['records']['wifi']['removed'], {})
+        tar = [cmd for cmd in device.commands if ' tar ' in cmd]
+        self.assertEqual(tar, [atvGumshoe.build_tar_cmd([wifi])])
+
+        device, delta = self.reacquire()
+        self.assertEqual(delta['changed_files'], [])
+        self.assertEqual(delta['records'], {})
+        self.assertEqual(len(self.store.deltas(atvGumshoe.device_id(device))), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atvGumshoe
+
+
+def visit(name, address, source, timestamp):
+    return {'timestamp': timestamp, 'value': {'n': name, 'a': address, 'S': source}}
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.index = atvGumshoe.SearchIndex(os.path.join(tmp, 'search.db'))
+        self.addCleanup(self.index.close)
+        self.index.add_ids('SN1', {'icloud': ['mailto:John.Appleseed@icloud.com'], 'fmd': ['tel:+1 (555) 010-9999']})
+        self.index.add_ids('SN2', {'icloud': ['mailto:John.Appleseed@icloud.com']})
+        self.index.add_locations('SN1', [
+            ('r1', visit('Blue Bottle Coffee', '1 Main Street, Springfield', 'com.apple.Maps', 100.0)),
+            ('r2', visit('Blue Bottle Coffee', '1 Main Street, Springfield', 'com.apple.Maps', 200.0)),
+            ('r3', visit('blue bottle  coffee', '1 main street, springfield', 'com.apple.mobilecal', 300.0)),
+            ('r4', visit('Town Library', '9 Oak Avenue, Springfield', 'com.apple.Maps', 400.0)),
+        ])
+        self.index.add_locations('SN2', [
+            ('r1', visit('Blue Bottle Coffee', '1 Main Street, Springfield', 'com.apple.MobileSMS', 500.0)),
+        ])
+
+    def test_id_prefix(self):
+        self.assertEqual(self.index.search_ids('john app'), [
+            ['mailto:John.Appleseed@icloud.com', 'icloud', 'SN1'],
+            ['mailto:John.Appleseed@icloud.com', 'icloud', 'SN2'],
+        ])
+        self.assertEqual(self.index.search_ids('ppleseed'), [])
+        self.assertEqual(self.index.search_ids('+1 555 010'), [['tel:+1 (555) 010-9999', 'fmd', 'SN1']])
+
+    def test_id_substring(self):
+        self.assertEqual([row[2] for row in self.index.search_ids('ppleseed', substring=True)], ['SN1', 'SN2'])
+        self.assertEqual(self.index.search_ids('xyz', substring=True), [])
+
+    def test_place_prefix_and_visits_per_source(self):
+        rows = self.index.search_places('blue bot main')
+        self.assertEqual(len(rows), 1)
+        name, address, visits, devices, first, last, sources = rows[0]
+        self.assertEqual((name, address, visits, devices), ('Blue Bottle Coffee', '1 Main Street, Springfield', 4, 2))
+        self.assertEqual(first, atvGumshoe.format_unix_time(atvGumshoe.cf_to_unix([100.0])[0]))
+        self.assertEqual(last, atvGumshoe.format_unix_time(atvGumshoe.cf_to_unix([500.0])[0]))
+        self.assertEqual(sources, 'com.apple.Maps 2, com.apple.MobileSMS 1, com.apple.mobilecal 1')
+
+    def test_place_substring(self):
+        self.assertEqual([row[0] for row in self.index.search_places('springfield')],
+                         ['Blue Bottle Coffee', 'Town Library'])
+        self.assertEqual([row[0] for row in self.index.search_places('ak ave', substring=True)], ['Town Library'])
+        self.assertEqual(self.index.search_places('ak ave'), [])
+
+    def test_visits_are_not_counted_twice(self):
+        self.index.add_locations('SN2', [
+            ('r1', visit('Blue Bottle Coffee', '1 Main Street, Springfield', 'com.apple.MobileSMS', 500.0)),
+        ])
+        self.assertEqual(self.index.search_places('blue')[0][2], 4)
+        self.assertEqual(self.index.stats()['places'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import pickle
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atvGumshoe
+
+
+def timeline(device, times):
+    events = atvGumshoe.Timeline()
+    events.extend(device, 'location', times, ['{} {}'.format(device, t) for t in times])
+    return events
+
+
+class TimelineTest(unittest.TestCase):
+
+    def test_merge_interleaved(self):
+        merged = timeline('A', [5, 1, 3, 7, 7])
+        merged.merge(timeline('B', [2, 7, 4, 8, 0]))
+        self.assertEqual([(t, device) for t, device, source, description in merged.between()], [
+            (0, 'B'), (1, 'A'), (2, 'B'), (3, 'A'), (4, 'B'), (5, 'A'), (7, 'A'), (7, 'A'), (7, 'B'), (8, 'B')])
+        self.assertEqual([description for t, device, source, description in merged.between()][:2], ['B 0', 'A 1'])
+
+    def test_merge_matches_a_full_sort(self):
+        rng = random.Random(1)
+        for trial in range(50):
+            a = [rng.randrange(100) for i in range(rng.randrange(30))]
+            b = [rng.randrange(100) for i in range(rng.randrange(30))]
+            merged = timeline('A', a)
+            merged.merge(timeline('B', b))
+            self.assertEqual([t for t, device, source, description in merged.between()], sorted(a + b))
+            self.assertEqual(sorted(merged.devices), sorted(['A'] * len(a) + ['B'] * len(b)))
+
+    def test_merge_into_empty_timeline(self):
+        merged = atvGumshoe.Timeline()
+        merged.merge(timeline('B', [3, 1]))
+        merged.merge(atvGumshoe.Timeline())
+        self.assertEqual([t for t, device, source, description in merged.between()], [1, 3])
+
+    def test_between_is_inclusive(self):
+        events = timeline('A', [1, 2, 2, 3, 4, 5])
+        self.assertEqual([t for t, device, source, description in events.between(2, 4)], [2, 2, 3, 4])
+        self.assertEqual([t for t, device, source, description in events.between(start=5)], [5])
+        self.assertEqual([t for t, device, source, description in events.between(end=0)], [])
+
+    def test_events_without_time_are_skipped(self):
+        events = atvGumshoe.Timeline()
+        events.add_records('A', 'location', [('k1', {'timestamp': 10.0}), ('k2', {}), ('k3', {'timestamp': 5.0})],
+                           lambda key, record: key, batch_size=2)
+        self.assertEqual([description for t, device, source, description in events.between()], ['k3', 'k1'])
+        self.assertEqual(list(events.times), list(atvGumshoe.cf_to_unix([5.0, 10.0])))
+
+    def test_wifi_events_use_the_time_they_were_added(self):
+        describe, event_time = atvGumshoe.TIMELINE_SOURCES['wifi']
+        records = [('Home', {'timestamp': 900.0, 'value': {'added_at': 100.0}}),
+                   ('Cafe', {'timestamp': 500.0, 'value': {}})]
+        events = atvGumshoe.Timeline()
+        events.add_records('A', 'wifi', records, lambda key, record: key, event_time)
+        self.assertEqual([(t, description) for t, device, source, description in events.between()],
+                         list(zip(atvGumshoe.cf_to_unix([100.0, 500.0]), ['Home', 'Cafe'])))
+
+    def test_pickle(self):
+        events = pickle.loads(pickle.dumps(timeline('A', [2, 1])))
+        events.merge(timeline('B', [0]))
+        self.assertEqual([device for t, device, source, description in events.between()], ['B', 'A', 'A'])
+
+
+if __name__ == '__main__':
+    unittest.main()